@@ -0,0 +1,117 @@
+"""
+Recall@k vs latency of the ANN index types against the flat baseline.
+
+Uses synthetic clustered vectors (default) or the vectors stored in the
+current RAG artifact (--artifact), so it runs without the embedding model.
+
+Usage (from the repo root):
+    python -m benchmarks.ann_recall --n 50000 --queries 500 --k 5
+    python -m benchmarks.ann_recall --artifact
+"""
+
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from rag.index_spec import (
+    INDEX_TYPES,
+    apply_search_parameters,
+    factory_string,
+    make_spec,
+    new_index,
+    reconstruct_all,
+    train,
+)
+from rag.store import ARTIFACT_DIR, INDEX_FILE
+
+
+def synthetic_vectors(n, dimension, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dimension))
+    vectors = centres[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype("float32")
+
+
+def artifact_vectors():
+    index = faiss.read_index(f"{ARTIFACT_DIR}/{INDEX_FILE}")
+    return reconstruct_all(index)[1]
+
+
+def bench_spec(spec, vectors, queries, truth, k):
+    index = new_index(spec, vectors.shape[1])
+
+    start = time.perf_counter()
+    train(index, vectors)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype="int64"))
+    build_s = time.perf_counter() - start
+
+    apply_search_parameters(index, spec)
+
+    latencies = []
+    found = np.zeros((len(queries), k), dtype="int64")
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None], k)
+        latencies.append(time.perf_counter() - start)
+        found[i] = ids[0]
+
+    hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+    samples = np.asarray(latencies) * 1000
+    return {
+        "index": factory_string(spec),
+        "params": {key: spec[key] for key in ("nprobe", "ef_search") if key in spec},
+        f"recall@{k}": hits / (len(queries) * k),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "build_s": build_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[None])
+    parser.add_argument("--ef-search", nargs="+", type=int, default=[64])
+    parser.add_argument("--artifact", action="store_true", help="use vectors from the RAG artifact")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.artifact:
+        vectors = artifact_vectors()
+    else:
+        vectors = synthetic_vectors(args.n, args.dimension, args.clusters, args.seed)
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(len(vectors), args.queries)] + 0.05 * rng.normal(
+        size=(args.queries, vectors.shape[1])
+    ).astype("float32")
+    queries = queries.astype("float32")
+
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    _, truth = baseline.search(queries, args.k)
+
+    for index_type in args.types:
+        variants = [{}]
+        if index_type in ("ivf", "ivfpq"):
+            variants = [{"nprobe": nprobe} for nprobe in args.nprobe]
+        elif index_type == "hnsw":
+            variants = [{"ef_search": ef} for ef in args.ef_search]
+
+        for options in variants:
+            options = {key: value for key, value in options.items() if value is not None}
+            spec = make_spec(index_type, n=len(vectors), dimension=vectors.shape[1], **options)
+            print(json.dumps(bench_spec(spec, vectors, queries, truth, args.k)))
+
+
+if __name__ == "__main__":
+    main()
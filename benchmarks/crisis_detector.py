@@ -0,0 +1,68 @@
+"""
+Time the compiled crisis detector as the phrase list grows.
+
+Compares the single-pass trie regex against the old per-keyword
+substring loop, reporting nanoseconds per input character.
+
+Usage (from the repo root):
+    python -m benchmarks.crisis_detector --sizes 10 100 1000 5000
+"""
+
+import argparse
+import json
+import random
+import string
+import time
+
+from chat.safety import CrisisDetector, load_phrases, normalize
+
+MESSAGE = (
+    "I have been feeling really low lately and I can't sleep at night, "
+    "my thoughts keep racing about work and family and I don't know what to do. "
+) * 4
+
+
+def random_phrases(n, seed):
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(2000)]
+    return [" ".join(rng.choices(words, k=rng.randint(1, 4))) for _ in range(n)]
+
+
+def time_per_char(fn, text, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(text)
+    return (time.perf_counter() - start) / repeats / len(text) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeats", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        phrases = load_phrases() + random_phrases(size, args.seed)
+
+        start = time.perf_counter()
+        detector = CrisisDetector(phrases)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        lowered = [phrase.lower() for phrase in phrases]
+
+        def substring_loop(text):
+            text = text.lower()
+            return any(phrase in text for phrase in lowered)
+
+        print(json.dumps({
+            "phrases": len(phrases),
+            "compile_ms": compile_ms,
+            "detector_ns_per_char": time_per_char(detector.find, MESSAGE, args.repeats),
+            "normalize_ns_per_char": time_per_char(normalize, MESSAGE, args.repeats),
+            "substring_loop_ns_per_char": time_per_char(substring_loop, MESSAGE, args.repeats),
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Measure request throughput under each database profile (DB_PROFILE).
+
+Every profile runs in a fresh process (settings are read once) against a
+fresh database. N client threads each log in and alternate between
+posting a message to the chat page (one turn written through save_turn
+plus queued tasks) and loading it (paginated reads). The LLM is the local
+stand-in with zero latency, so the numbers are dominated by the database.
+
+"plain" is bare dj_database_url: a new connection per request and SQLite's
+default rollback journal. "tuned" is the profile in settings.py.
+
+Usage (from the repo root):
+    python -m benchmarks.db_load --threads 1 8 --requests 200
+    python -m benchmarks.db_load --database-url postgres://localhost/wellness_bench
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+def run_profile(threads, requests_per_thread):
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+
+    from chat.models import ChatSession
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def client_thread(i):
+        nonlocal errors
+        user = User.objects.create_user(f"load{i}-{time.time_ns()}", password="pw")
+        session = ChatSession.objects.create(user=user)
+        client = Client()
+        client.force_login(user)
+        connection.close()
+
+        for n in range(requests_per_thread):
+            start = time.perf_counter()
+            if n % 2 == 0:
+                response = client.post(
+                    f"/chat/{session.id}/", {"message": f"How can we handle stress at work? ({n})"}
+                )
+            else:
+                response = client.get(f"/chat/{session.id}/")
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code >= 400:
+                    errors += 1
+                else:
+                    latencies.append(elapsed)
+        connection.close()
+
+    workers = [threading.Thread(target=client_thread, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    samples = np.asarray(latencies or [0.0]) * 1000
+    return {
+        "profile": os.environ["DB_PROFILE"],
+        "vendor": connection.vendor,
+        "threads": threads,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "req_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(samples, 50)), 2),
+        "p95_ms": round(float(np.percentile(samples, 95)), 2),
+        "p99_ms": round(float(np.percentile(samples, 99)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=["plain", "tuned"])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=200, help="requests per thread")
+    parser.add_argument("--database-url", help="empty database to use (default: temporary SQLite file per run)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_profile(args.threads[0], args.requests)))
+        return
+
+    for threads in args.threads:
+        for profile in args.profiles:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                env = dict(
+                    os.environ,
+                    DJANGO_SETTINGS_MODULE="wellness_bot.settings",
+                    DB_PROFILE=profile,
+                    DATABASE_URL=args.database_url or f"sqlite:///{os.path.join(tmpdir, 'load.sqlite3')}",
+                    LLM_PROVIDER="local",
+                    LLM_LOCAL_LATENCY="0",
+                    LLM_LOCAL_TOKEN_DELAY="0",
+                )
+                result = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.db_load", "--child",
+                     "--threads", str(threads), "--requests", str(args.requests)],
+                    env=env, capture_output=True, text=True
+                )
+                if result.returncode:
+                    print(result.stderr, file=sys.stderr)
+                    continue
+                print(result.stdout.strip().splitlines()[-1])
+                sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Measure chat-turn persistence throughput (turns per second).
+
+Compares the old write pattern (two ChatMessage.objects.create calls plus
+a session save, each its own autocommit transaction) with save_turn (one
+transaction: a two-row INSERT and one session UPDATE), optionally with
+several writer threads.
+
+Runs against a throwaway database: a temporary SQLite file by default,
+or whatever --database-url points at (it gets migrated, use an empty
+database).
+
+Usage (from the repo root):
+    python -m benchmarks.db_turns --turns 2000
+    python -m benchmarks.db_turns --threads 1 4 --database-url postgres://localhost/wellness_bench
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+def setup_django(database_url):
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wellness_bot.settings")
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+def separate_writes(session, user_message, bot_reply):
+    from chat.models import ChatMessage
+
+    ChatMessage.objects.create(session=session, role="user", content=user_message)
+    ChatMessage.objects.create(session=session, role="bot", content=bot_reply)
+    session.save()
+
+
+def single_transaction(session, user_message, bot_reply):
+    from chat.persistence import save_turn
+
+    save_turn(session, [("user", user_message), ("bot", bot_reply)])
+
+
+MODES = {"separate": separate_writes, "save_turn": single_transaction}
+
+
+def run(mode, threads, turns):
+    from django.contrib.auth.models import User
+    from django.db import connection
+
+    from chat.models import ChatSession
+
+    user, _ = User.objects.get_or_create(username="bench")
+    sessions = [ChatSession.objects.create(user=user, title="bench") for _ in range(threads)]
+    write = MODES[mode]
+    per_thread = turns // threads
+    errors = []
+
+    def writer(session):
+        try:
+            for i in range(per_thread):
+                write(session, f"message {i}", "a reply " * 40)
+        except Exception as e:
+            errors.append(repr(e))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=writer, args=(session,)) for session in sessions]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "vendor": connection.vendor,
+        "threads": threads,
+        "turns": per_thread * threads,
+        "errors": len(errors),
+        "turns_per_s": round(per_thread * threads / elapsed, 1),
+        "ms_per_turn": round(elapsed * 1000 / (per_thread * threads), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="database to benchmark (default: temporary SQLite file)")
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    tmpdir = None
+    database_url = args.database_url
+    if not database_url:
+        tmpdir = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.sqlite3')}"
+    setup_django(database_url)
+
+    for threads in args.threads:
+        for mode in args.modes:
+            print(json.dumps(run(mode, threads, args.turns)))
+            sys.stdout.flush()
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
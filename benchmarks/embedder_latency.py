@@ -0,0 +1,102 @@
+"""
+Compare query-embedding latency of the local and remote embedder backends.
+
+Also reports each backend's resident memory growth (model load plus first
+call) and, next to the local fp32 model, the cosine similarity of its
+vectors to the local ones, which is how the int8 "onnx" backend's savings
+and accuracy are checked. Run one backend per process for clean memory
+numbers: backends loaded later share libraries already imported.
+
+Usage (from the repo root):
+    python -m benchmarks.embedder_latency --runs 200
+    HF_API_KEY=... python -m benchmarks.embedder_latency --backends local remote
+    python -m rag.export_onnx && python -m benchmarks.embedder_latency --backends onnx
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from rag.embedder import load_embedder
+
+QUERIES = [
+    "I feel anxious",
+    "can't sleep",
+    "how do I stop a panic attack",
+    "grounding techniques?",
+    "I keep overthinking everything at night",
+    "what is a thought record",
+    "I have no motivation to do anything",
+    "how can I be kinder to myself",
+]
+
+
+def percentile(samples, q):
+    return float(np.percentile(np.asarray(samples) * 1000, q))
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def bench_backend(backend, runs, batch_size, vectors):
+    before = rss_mb()
+    embedder = load_embedder(backend)
+    # Warm up (model load / TLS handshake are not part of the per-query cost)
+    embedder.encode(QUERIES[:1])
+    loaded = rss_mb() - before
+
+    single = []
+    for i in range(runs):
+        start = time.perf_counter()
+        embedder.encode([QUERIES[i % len(QUERIES)]])
+        single.append(time.perf_counter() - start)
+
+    batched = []
+    batch = (QUERIES * (batch_size // len(QUERIES) + 1))[:batch_size]
+    for _ in range(max(1, runs // batch_size)):
+        start = time.perf_counter()
+        embedder.encode(batch)
+        batched.append((time.perf_counter() - start) / batch_size)
+
+    vectors[embedder.name] = embedder.encode(QUERIES)
+    result = {
+        "backend": embedder.name,
+        "precision": embedder.precision,
+        "rss_mb": round(loaded, 1),
+        "runs": runs,
+        "p50_ms": percentile(single, 50),
+        "p99_ms": percentile(single, 99),
+        "batched_per_query_p50_ms": percentile(batched, 50),
+        "batch_size": batch_size,
+    }
+    if "local" in vectors and embedder.name != "local":
+        cosine = (vectors["local"] * vectors[embedder.name]).sum(axis=1)
+        result["cosine_vs_local_min"] = round(float(cosine.min()), 4)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["local", "onnx", "remote"])
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    vectors = {}
+    for backend in args.backends:
+        try:
+            result = bench_backend(backend, args.runs, args.batch_size, vectors)
+        except Exception as e:
+            result = {"backend": backend, "error": str(e)}
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Throughput of query embedding with and without the micro-batcher.
+
+N user threads each embed one query at a time in a closed loop, like
+concurrent chat turns do. "direct" gives every caller its own model call
+(serialised by the model lock, as LocalEmbedder does); the other rows
+route through rag.batching.MicroBatcher with the given window.
+
+The model is the local sentence-transformers one when it can be loaded,
+else a stand-in whose call costs --overhead-ms plus --per-item-ms per
+text (roughly MiniLM on a few CPU cores: fixed cost dominates small
+batches).
+
+Usage (from the repo root):
+    python -m benchmarks.embedding_batching --users 1 8 64 --windows 0 1 2 5 10
+    python -m benchmarks.embedding_batching --model simulated --overhead-ms 8 --per-item-ms 0.4
+"""
+
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.embedder_latency import QUERIES
+from rag.batching import MicroBatcher
+from rag.embedder import DIMENSION
+
+
+class SimulatedModel:
+    name = "simulated"
+
+    def __init__(self, overhead_ms, per_item_ms):
+        self.overhead = overhead_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self._lock = threading.Lock()
+
+    def encode(self, texts):
+        with self._lock:
+            # torch releases the GIL while it computes; so does sleep
+            time.sleep(self.overhead + self.per_item * len(texts))
+        return np.zeros((len(texts), DIMENSION), dtype="float32")
+
+
+def run(encode, users, requests):
+    latencies = [[] for _ in range(users)]
+
+    def user(i):
+        for n in range(requests):
+            start = time.perf_counter()
+            encode([QUERIES[(i + n) % len(QUERIES)]])
+            latencies[i].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    samples = np.concatenate([np.asarray(user_latencies) for user_latencies in latencies]) * 1000
+    return {
+        "users": users,
+        "texts_per_s": round(len(samples) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(samples, 50)), 2),
+        "p95_ms": round(float(np.percentile(samples, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 1, 2, 5, 10], help="batch windows in ms")
+    parser.add_argument("--max-items", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=50, help="queries per user")
+    parser.add_argument("--model", choices=["auto", "local", "simulated"], default="auto")
+    parser.add_argument("--overhead-ms", type=float, default=8.0)
+    parser.add_argument("--per-item-ms", type=float, default=0.4)
+    args = parser.parse_args()
+
+    model, kind = None, "simulated"
+    if args.model != "simulated":
+        try:
+            from rag.embedder import LocalEmbedder
+            model, kind = LocalEmbedder(), "local"
+        except Exception:
+            if args.model == "local":
+                raise
+    if model is None:
+        model = SimulatedModel(args.overhead_ms, args.per_item_ms)
+    model.encode(QUERIES[:1])  # model load / first call is not part of the cost
+
+    for users in args.users:
+        print(json.dumps({"model": kind, "mode": "direct", **run(model.encode, users, args.requests)}))
+        for window in args.windows:
+            batcher = MicroBatcher(model.encode, args.max_items, window)
+            result = run(batcher.encode, users, args.requests)
+            print(json.dumps({"model": kind, "mode": f"batched {window:g}ms", **result,
+                              "avg_batch": batcher.stats()["avg_batch"]}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Local stand-in for the two upstream APIs a chat turn calls, so load tests
+measure this app rather than Groq or Hugging Face.
+
+- POST /openai/v1/chat/completions    Groq/OpenAI chat completions, plain
+                                      or streamed (SSE), as GroqProvider
+                                      calls it via LLM_BASE_URL
+- POST /pipeline/feature-extraction/* HF feature extraction, as
+                                      RemoteEmbedder calls it via
+                                      EMBEDDING_API_URL
+
+Replies take --latency to the first token and then stream at --token-rate
+tokens per second. Embeddings are deterministic hashed bag-of-words
+vectors after --embed-latency. --error-rate / --embed-error-rate turn that
+share of calls into 503s.
+
+Usage (from the repo root):
+    python -m benchmarks.fake_upstream --port 8900 --latency 0.3 --token-rate 50 --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+DIMENSION = 384
+REPLY = (
+    "Thank you for telling me how you feel. It makes sense that this has been weighing on you. "
+    "Let's slow down for a moment and take one small step together, starting with your breathing."
+)
+WORD_RE = re.compile(r"\w+")
+
+
+def fake_embedding(text):
+    """Unit vector of hashed words: same text, same vector; shared words, closer vectors."""
+    vector = np.zeros(DIMENSION, dtype="float32")
+    for word in WORD_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode(), digest_size=4).digest()
+        vector[int.from_bytes(digest, "little") % DIMENSION] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+class FakeUpstream:
+    """Raw ASGI app; no framework so the server itself costs next to nothing."""
+
+    def __init__(self, latency=0.3, token_rate=50.0, error_rate=0.0, embed_latency=0.02, embed_error_rate=0.0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.embed_latency = embed_latency
+        self.embed_error_rate = embed_error_rate
+
+    async def __call__(self, scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        payload = json.loads(body or b"{}")
+
+        path = scope["path"]
+        if path.endswith("/chat/completions"):
+            await self.chat(payload, send)
+        elif path.startswith("/pipeline/feature-extraction"):
+            await self.embed(payload, send)
+        else:
+            await self.respond(send, 404, {"error": {"message": f"unknown path {path}"}})
+
+    async def respond(self, send, status, payload, headers=()):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), *headers],
+        })
+        await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+    async def fail(self, send, service):
+        await self.respond(send, 503, {"error": {"message": f"fake {service} overloaded", "type": "service_unavailable"}})
+
+    async def chat(self, payload, send):
+        await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            return await self.fail(send, "llm")
+
+        tokens = [word + " " for word in REPLY.split()][:payload.get("max_tokens") or None]
+        delay = 1.0 / self.token_rate if self.token_rate else 0.0
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": payload.get("model", "fake")}
+
+        if not payload.get("stream"):
+            await asyncio.sleep(delay * len(tokens))
+            return await self.respond(send, 200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+        })
+        for token in tokens:
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode(), "more_body": True})
+            await asyncio.sleep(delay)
+        await send({"type": "http.response.body", "body": b"data: [DONE]\n\n"})
+
+    async def embed(self, payload, send):
+        await asyncio.sleep(self.embed_latency)
+        if random.random() < self.embed_error_rate:
+            return await self.fail(send, "embedding")
+
+        inputs = payload.get("inputs", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        await self.respond(send, 200, [fake_embedding(text) for text in inputs])
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds to the first LLM token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="LLM tokens per second (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of LLM calls answered with 503")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="seconds per embedding call")
+    parser.add_argument("--embed-error-rate", type=float, default=0.0, help="share of embedding calls answered with 503")
+
+
+def options(args):
+    return {name: getattr(args, name) for name in
+            ("latency", "token_rate", "error_rate", "embed_latency", "embed_error_rate")}
+
+
+def start(port, **kwargs):
+    """Run the fake server in a subprocess on ``port``; returns the Popen once it accepts connections."""
+    command = [sys.executable, "-m", "benchmarks.fake_upstream", "--port", str(port)]
+    for name, value in kwargs.items():
+        command += [f"--{name.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(process.stderr.read().decode())
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fake upstream did not start")
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    uvicorn.run(FakeUpstream(**options(args)), host="127.0.0.1", port=args.port, log_level="warning",
+                access_log=False, lifespan="off")
+
+
+if __name__ == "__main__":
+    main()
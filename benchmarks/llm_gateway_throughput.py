@@ -0,0 +1,88 @@
+"""
+Measure LLMGateway throughput against the local stand-in provider.
+
+Simulates N concurrent callers hitting an upstream with fixed latency
+(and optional error rate) and reports completed calls per second and
+latency percentiles for each concurrency cap.
+
+Usage (from the repo root):
+    python -m benchmarks.llm_gateway_throughput --latency 0.5 --callers 64
+    python -m benchmarks.llm_gateway_throughput --error-rate 0.1 --caps 8 32
+"""
+
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+
+from chat.llm import LLMError, LLMGateway, LocalProvider
+
+MESSAGES = [{"role": "user", "content": "How do I calm down before sleep?"}]
+
+
+def run(cap, callers, requests_per_caller, latency, error_rate, timeout):
+    provider = LocalProvider(latency=latency, token_delay=0, error_rate=error_rate)
+    gateway = LLMGateway(
+        provider,
+        timeout=timeout,
+        max_concurrency=cap,
+        backoff_base=0.05,
+    )
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def caller():
+        nonlocal errors
+        for _ in range(requests_per_caller):
+            start = time.perf_counter()
+            try:
+                gateway.complete(MESSAGES)
+            except LLMError:
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=caller) for _ in range(callers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    samples = np.asarray(latencies or [0.0]) * 1000
+    return {
+        "max_concurrency": cap,
+        "callers": callers,
+        "upstream_latency_s": latency,
+        "error_rate": error_rate,
+        "completed": len(latencies),
+        "failed": errors,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p99_ms": float(np.percentile(samples, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--caps", nargs="+", type=int, default=[1, 8, 32, 128])
+    parser.add_argument("--callers", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=5, help="requests per caller")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    for cap in args.caps:
+        result = run(cap, args.callers, args.requests, args.latency, args.error_rate, args.timeout)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
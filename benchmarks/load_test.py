@@ -0,0 +1,291 @@
+"""
+Load test the chat endpoints end to end against local fake upstreams.
+
+Starts benchmarks.fake_upstream (stand-in Groq + HF embedding APIs), a
+throwaway SQLite database and one gunicorn worker (gunicorn.conf.py), then
+replays conversation scripts against the chosen targets:
+
+- api: POST /chat/api/          (ChatAPIView)
+- ui:  POST /chat/<session>/    (chat_page form post, answered by a redirect)
+
+Each simulated user takes a script, opens a fresh chat session and sends
+its messages one after another (closed loop). For every target and user
+count it reports throughput, error count and p50/p95/p99 latency. The DB
+queries each turn issues are counted separately by replaying one script
+in-process under CaptureQueriesContext.
+
+Scripts are JSONL: ``{"messages": ["...", "..."]}`` per line, or any line
+with a "message" or "body" string as a one-message script (so a requests
+file can be replayed as-is). Without --scripts a built-in set is used.
+
+The report is one JSON document with sorted keys, so runs on two commits
+can be diffed directly or with --compare.
+
+Usage (from the repo root):
+    python -m benchmarks.load_test --users 1 8 32 --output load.json
+    python -m benchmarks.load_test --targets api --latency 0.5 --error-rate 0.05 --compare load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import fake_upstream
+from benchmarks.server_capacity import free_port, start_server
+
+SCRIPTS = [
+    ["I can't sleep, my mind keeps racing at night", "I tried counting sheep but it doesn't help",
+     "What should I do when I wake up at 3am?"],
+    ["My heart is pounding and I feel like something terrible is about to happen",
+     "It happens mostly on the train", "How can I calm down quickly?"],
+    ["I have no motivation to do anything anymore", "Even things I used to enjoy feel pointless",
+     "Can you help me plan something small for tomorrow?", "Thanks, I'll try the walk"],
+    ["My friend hasn't replied in two days and I think they hate me",
+     "How do I stop assuming the worst?"],
+]
+
+
+def load_scripts(path):
+    scripts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            messages = record.get("messages") or [record.get("message") or record.get("body")]
+            messages = [message for message in messages if isinstance(message, str) and message.strip()]
+            if messages:
+                scripts.append(messages)
+    if not scripts:
+        raise SystemExit(f"no scripts in {path}")
+    return scripts
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def setup_users(count):
+    """Migrate the throwaway DB and create ``count`` logged-in users."""
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    users = []
+    for i in range(count):
+        user = User.objects.create(username=f"load{i}")
+        client = Client()
+        client.force_login(user)
+        users.append({"user": user, "cookie": client.cookies[settings.SESSION_COOKIE_NAME].value})
+    return users
+
+
+def new_sessions(users):
+    from chat.models import ChatSession
+
+    return [ChatSession.objects.create(user=user["user"]).id for user in users]
+
+
+async def send(http, target, session_id, message, csrf):
+    if target == "api":
+        response = await http.post(
+            "/chat/api/",
+            json={"message": message, "session_id": session_id},
+            headers={"X-CSRFToken": csrf},
+        )
+        return response.status_code == 200
+    response = await http.post(
+        f"/chat/{session_id}/",
+        data={"message": message, "csrfmiddlewaretoken": csrf},
+    )
+    return response.status_code == 302
+
+
+async def drive(base_url, target, users, session_ids, scripts):
+    import httpx
+
+    latencies = []
+    errors = 0
+
+    async def user_loop(http, user, session_id, script):
+        nonlocal errors
+        csrf = secrets.token_hex(16)
+        http.cookies.set("sessionid", user["cookie"])
+        http.cookies.set("csrftoken", csrf)
+        for message in script:
+            start = time.perf_counter()
+            try:
+                ok = await send(http, target, session_id, message, csrf)
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    clients = [
+        httpx.AsyncClient(base_url=base_url, timeout=120, limits=httpx.Limits(max_connections=1))
+        for _ in users
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        user_loop(http, user, session_id, scripts[i % len(scripts)])
+        for i, (http, user, session_id) in enumerate(zip(clients, users, session_ids))
+    ))
+    elapsed = time.perf_counter() - start
+    for http in clients:
+        await http.aclose()
+    return latencies, errors, elapsed
+
+
+def summarize(target, count, latencies, errors, elapsed):
+    samples = np.asarray(latencies or [0.0]) * 1000
+    return {
+        "target": target,
+        "users": count,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "req_per_s": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(samples, 50)), 1),
+        "p95_ms": round(float(np.percentile(samples, 95)), 1),
+        "p99_ms": round(float(np.percentile(samples, 99)), 1),
+    }
+
+
+def count_queries(target, user, script):
+    """Replay one script in-process and count the queries of each turn."""
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    client = Client()
+    client.force_login(user["user"])
+    session_id = new_sessions([user])[0]
+    counts = []
+    for message in script:
+        with CaptureQueriesContext(connection) as queries:
+            if target == "api":
+                client.post("/chat/api/", {"message": message, "session_id": session_id},
+                            content_type="application/json")
+            else:
+                client.post(f"/chat/{session_id}/", {"message": message})
+        counts.append(len(queries))
+    return {"per_turn": counts, "mean": round(sum(counts) / len(counts), 2), "max": max(counts)}
+
+
+def compare(report, baseline):
+    """Print the change of each metric against an earlier report."""
+    before = {(row["target"], row["users"]): row for row in baseline["results"]}
+    for row in report["results"]:
+        old = before.get((row["target"], row["users"]))
+        if old is None:
+            continue
+        deltas = {
+            key: round(row[key] - old[key], 2)
+            for key in ("req_per_s", "p50_ms", "p95_ms", "p99_ms", "errors")
+        }
+        print(json.dumps({"target": row["target"], "users": row["users"], "delta": deltas,
+                          "baseline": baseline.get("revision")}))
+    for target, queries in report["db_queries"].items():
+        old = baseline.get("db_queries", {}).get(target)
+        if old:
+            print(json.dumps({"target": target, "db_queries_delta": round(queries["mean"] - old["mean"], 2)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", choices=["api", "ui"], default=["api", "ui"])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--scripts", help="JSONL conversation scripts (default: built-in)")
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="asgi", help="gunicorn worker type")
+    parser.add_argument("--threads", type=int, default=4, help="gthread threads for --mode wsgi")
+    parser.add_argument("--response-cache", action="store_true", help="leave the semantic reply cache on")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", help="earlier report to print deltas against")
+    fake_upstream.add_arguments(parser)
+    args = parser.parse_args()
+
+    scripts = load_scripts(args.scripts) if args.scripts else SCRIPTS
+    upstream_port, app_port = free_port(), free_port()
+    upstream = fake_upstream.start(upstream_port, **fake_upstream.options(args))
+
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE="wellness_bot.settings",
+                DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, 'load.sqlite3')}",
+                LLM_PROVIDER="groq",
+                LLM_BASE_URL=f"http://127.0.0.1:{upstream_port}",
+                GROQ_API_KEY="fake",
+                LLM_MAX_CONCURRENCY=str(max(args.users)),
+                EMBEDDING_BACKEND="remote",
+                EMBEDDING_API_URL=f"http://127.0.0.1:{upstream_port}/pipeline/feature-extraction/fake",
+                RESPONSE_CACHE_ENABLED=str(args.response_cache),
+            )
+            os.environ.update(env)
+            users = setup_users(max(args.users))
+
+            results = []
+            server = start_server(args.mode, app_port, env, args.threads)
+            try:
+                base_url = f"http://127.0.0.1:{app_port}"
+                for target in args.targets:
+                    # First turn starts the gateway, maps the index and fills caches
+                    asyncio.run(drive(base_url, target, users[:1], new_sessions(users[:1]), [["hello"]]))
+                    for count in args.users:
+                        sessions = new_sessions(users[:count])
+                        row = summarize(target, count, *asyncio.run(
+                            drive(base_url, target, users[:count], sessions, scripts)
+                        ))
+                        results.append(row)
+                        print(json.dumps(row), file=sys.stderr)
+            finally:
+                server.terminate()
+                server.wait()
+
+            db_queries = {target: count_queries(target, users[0], scripts[0]) for target in args.targets}
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    report = {
+        "revision": git_revision(),
+        "config": {
+            "mode": args.mode,
+            "scripts": len(scripts),
+            "response_cache": args.response_cache,
+            **fake_upstream.options(args),
+        },
+        "results": results,
+        "db_queries": db_queries,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Cost of the per-turn instrumentation in chat.metrics.
+
+Times an empty span, a counter increment and a whole instrumented turn
+(trace_turn + the spans and counters a chat turn records), and checks the
+per-request total against the budget.
+
+Usage (from the repo root):
+    python -m benchmarks.metrics_overhead --repeats 100000 --budget-us 50
+"""
+
+import argparse
+import json
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wellness_bot.settings")
+django.setup()
+
+from chat import metrics  # noqa: E402
+
+TURN_STAGES = ["context", "safety", "bm25", "embed", "faiss", "retrieve", "prompt", "cache", "llm", "persist"]
+
+
+def empty_span():
+    with metrics.span("safety"):
+        pass
+
+
+def counter():
+    metrics.incr("chat_fallbacks_total", reason="llm_error")
+
+
+def turn():
+    with metrics.trace_turn("api"):
+        for stage in TURN_STAGES:
+            with metrics.span(stage):
+                pass
+        metrics.incr("chat_upstream_errors_total", service="llm", reason="503")
+        metrics.incr("chat_fallbacks_total", reason="llm_error")
+
+
+def time_us(fn, repeats):
+    fn()  # registry entries created outside the timed loop
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=100000)
+    parser.add_argument("--budget-us", type=float, default=50.0)
+    args = parser.parse_args()
+
+    results = {name: round(time_us(fn, args.repeats), 3) for name, fn in
+               [("span_us", empty_span), ("counter_us", counter), ("turn_us", turn)]}
+    start = time.perf_counter()
+    metrics.render()
+    results["render_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    results["within_budget"] = results["turn_us"] <= args.budget_us
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Recall and latency of the knowledge retrievers on a small labelled set.
+
+Each query is labelled with the knowledge file(s) that should answer it.
+For every mode it reports recall@k (a labelled file in the top k), MRR
+and per-query latency:
+
+- dense:   FAISS search on the query embedding
+- bm25:    keyword index only
+- hybrid:  reciprocal-rank fusion of both (retrieve_knowledge)
+- rerank:  hybrid + the RAG_RERANKER cross-encoder
+
+Modes whose model can't be loaded here (no embedder / no reranker) are
+skipped with a note.
+
+Usage (from the repo root):
+    python -m benchmarks.retrieval_quality --k 1 2 5
+    RAG_RERANKER=cross-encoder/ms-marco-MiniLM-L-6-v2 python -m benchmarks.retrieval_quality
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from rag.rag_utils import embed_query, get_reranker, retrieve_knowledge
+from rag.store import get_store
+
+LABELLED_QUERIES = [
+    ("My heart is racing and I feel like I'm dying", ["panic_attack_protocol.txt"]),
+    ("what should I do during a panic attack", ["panic_attack_protocol.txt"]),
+    ("how long should I breathe in and out when panicking", ["panic_attack_protocol.txt", "sleep_anxiety_steps.txt"]),
+    ("I keep lying awake worrying at night", ["sleep_anxiety_steps.txt"]),
+    ("tips for a bedtime routine so I can fall asleep", ["sleep_anxiety_steps.txt"]),
+    ("my mind won't stop overthinking when I'm in bed", ["sleep_anxiety_steps.txt"]),
+    ("they haven't texted back and I think they hate me", ["cbt_thought_record.txt"]),
+    ("how do I challenge negative automatic thoughts", ["cbt_thought_record.txt"]),
+    ("write down evidence for and against a thought", ["cbt_thought_record.txt"]),
+    ("I have no motivation to do anything anymore", ["behavioral_activation.txt"]),
+    ("I've stopped doing things I used to enjoy", ["behavioral_activation.txt"]),
+    ("how to plan small activities when my mood is low", ["behavioral_activation.txt"]),
+    ("I feel like a complete failure", ["self_compassion_practice.txt"]),
+    ("how can I be kinder to myself", ["self_compassion_practice.txt"]),
+    ("bring me back to the present moment", ["grounding_techniques.txt"]),
+    ("the 5 4 3 2 1 exercise", ["grounding_techniques.txt", "panic_attack_protocol.txt"]),
+    ("holding ice or cold water to calm down", ["grounding_techniques.txt"]),
+    ("I get so angry I want to lash out", ["emotional_regulation_skills.txt"]),
+    ("how do I manage strong emotions", ["emotional_regulation_skills.txt"]),
+    ("is my reaction proportional to what happened", ["emotional_regulation_skills.txt"]),
+    ("what are common symptoms of anxiety", ["anxiety_guide.txt"]),
+    ("why do I feel restless and can't concentrate", ["anxiety_guide.txt"]),
+]
+
+
+def dense(query, k):
+    return get_store().search(np.expand_dims(embed_query(query), axis=0), k)[0]
+
+
+def bm25(query, k):
+    return get_store().keyword_search(query, k)
+
+
+def hybrid(query, k):
+    return [{"source": p.source} for p in retrieve_knowledge(query, k, min_score=0.0, use_reranker=False)]
+
+
+def rerank(query, k):
+    return [{"source": p.source} for p in retrieve_knowledge(query, k, min_score=0.0, use_reranker=True)]
+
+
+MODES = {"dense": dense, "bm25": bm25, "hybrid": hybrid, "rerank": rerank}
+
+
+def available(mode):
+    try:
+        # Without the embedder hybrid would silently degrade to bm25
+        if mode != "bm25":
+            embed_query("warm up")
+        if mode == "rerank" and get_reranker() is None:
+            return "RAG_RERANKER not set or not loadable"
+    except Exception as e:
+        return f"embedder unavailable ({type(e).__name__})"
+    return None
+
+
+def run(mode, ks):
+    search = MODES[mode]
+    depth = max(ks)
+    hits = {k: 0 for k in ks}
+    reciprocal_ranks = []
+    latencies = []
+
+    for query, relevant in LABELLED_QUERIES:
+        start = time.perf_counter()
+        results = search(query, depth)
+        latencies.append(time.perf_counter() - start)
+
+        sources = [result["source"] for result in results]
+        rank = next((i + 1 for i, source in enumerate(sources) if source in relevant), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        for k in ks:
+            hits[k] += rank is not None and rank <= k
+
+    samples = np.asarray(latencies) * 1000
+    return {
+        "mode": mode,
+        "queries": len(LABELLED_QUERIES),
+        **{f"recall@{k}": round(hits[k] / len(LABELLED_QUERIES), 3) for k in ks},
+        "mrr": round(float(np.mean(reciprocal_ranks)), 3),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 5])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    get_store()
+    for mode in args.modes:
+        reason = available(mode)
+        if reason:
+            print(json.dumps({"mode": mode, "skipped": reason}))
+            continue
+        print(json.dumps(run(mode, args.k)))
+
+
+if __name__ == "__main__":
+    main()
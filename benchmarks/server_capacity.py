@@ -0,0 +1,185 @@
+"""
+Measure how many concurrent chat users one web worker can carry, served
+as WSGI (gthread) or ASGI (uvicorn), through gunicorn.conf.py.
+
+Each mode starts a real gunicorn with a single worker against a throwaway
+SQLite database and the local stand-in LLM with a fixed latency. N users
+(logged in via session cookies) then post to the chat API in a closed
+loop: send a message, wait for the reply, send the next one. For every N
+it reports throughput and latency percentiles; "capacity" is the largest
+N whose p95 stays under --slo times the LLM latency.
+
+The WSGI worker can only have GUNICORN_THREADS requests in flight, so
+beyond that users queue behind the LLM wait. The ASGI worker parks each
+request on the event loop while the LLM answers.
+
+Usage (from the repo root):
+    python -m benchmarks.server_capacity --latency 0.5 --users 1 4 16 64 128
+    python -m benchmarks.server_capacity --modes asgi --requests 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def setup_users(count):
+    """Create ``count`` users with one chat session each; return their cookies."""
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    from chat.models import ChatSession
+
+    users = []
+    for i in range(count):
+        user = User.objects.create(username=f"capacity{i}")
+        session = ChatSession.objects.create(user=user)
+        client = Client()
+        client.force_login(user)
+        users.append({
+            "session_id": session.id,
+            "cookie": client.cookies[settings.SESSION_COOKIE_NAME].value,
+        })
+    return users
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, env, threads, workers=1):
+    server_env = dict(env, SERVER_MODE=mode, PORT=str(port), WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}"],
+        env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(process.stderr.read().decode())
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+async def drive(base_url, users, requests_per_user):
+    import httpx
+
+    latencies = []
+    errors = 0
+
+    async def user_loop(http, user):
+        nonlocal errors
+        csrf = secrets.token_hex(16)
+        http.cookies.set("sessionid", user["cookie"])
+        http.cookies.set("csrftoken", csrf)
+        for n in range(requests_per_user):
+            start = time.perf_counter()
+            try:
+                response = await http.post(
+                    "/chat/api/",
+                    json={"message": f"How can I sleep better? ({n})", "session_id": user["session_id"]},
+                    headers={"X-CSRFToken": csrf},
+                )
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    clients = [
+        httpx.AsyncClient(base_url=base_url, timeout=120, limits=httpx.Limits(max_connections=1))
+        for _ in users
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop(http, user) for http, user in zip(clients, users)))
+    elapsed = time.perf_counter() - start
+    for http in clients:
+        await http.aclose()
+    return latencies, errors, elapsed
+
+
+def run(mode, port, env, args, users):
+    process = start_server(mode, port, env, args.threads)
+    results = []
+    try:
+        # First request starts the LLM gateway and fills caches
+        asyncio.run(drive(f"http://127.0.0.1:{port}", users[:1], 1))
+        for count in args.users:
+            latencies, errors, elapsed = asyncio.run(
+                drive(f"http://127.0.0.1:{port}", users[:count], args.requests)
+            )
+            samples = np.asarray(latencies or [0.0]) * 1000
+            results.append({
+                "mode": mode,
+                "users": count,
+                "requests": len(latencies) + errors,
+                "errors": errors,
+                "req_per_s": round(len(latencies) / elapsed, 1),
+                "p50_ms": round(float(np.percentile(samples, 50)), 1),
+                "p95_ms": round(float(np.percentile(samples, 95)), 1),
+                "p99_ms": round(float(np.percentile(samples, 99)), 1),
+            })
+            print(json.dumps(results[-1]))
+            sys.stdout.flush()
+    finally:
+        process.terminate()
+        process.wait()
+
+    slo_ms = args.slo * args.latency * 1000
+    ok = [r["users"] for r in results if not r["errors"] and r["p95_ms"] <= slo_ms]
+    print(json.dumps({"mode": mode, "capacity_users": max(ok, default=0), "p95_slo_ms": slo_ms}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=["wsgi", "asgi"], default=["wsgi", "asgi"])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=10, help="requests per user")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the fake LLM takes per reply")
+    parser.add_argument("--threads", type=int, default=4, help="gthread threads per WSGI worker")
+    parser.add_argument("--slo", type=float, default=2.0, help="p95 budget as a multiple of --latency")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE="wellness_bot.settings",
+            DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, 'capacity.sqlite3')}",
+            LLM_PROVIDER="local",
+            LLM_LOCAL_LATENCY=str(args.latency),
+            LLM_LOCAL_TOKEN_DELAY="0",
+            LLM_MAX_CONCURRENCY=str(max(args.users)),
+            RESPONSE_CACHE_ENABLED="False",
+        )
+        os.environ.update(env)
+        users = setup_users(max(args.users))
+
+        for mode in args.modes:
+            run(mode, free_port(), env, args, users)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Cold-start cost of the web workers with and without the preload warm-up.
+
+For GUNICORN_PRELOAD=False and True it starts gunicorn (gunicorn.conf.py)
+with --workers workers against the fake upstreams and reports:
+
+- ready_s:       spawn until the port accepts connections
+- first_ms:      latency of the first chat turn hitting each worker
+                 (--workers turns sent at once, so each worker gets one),
+                 sent --settle seconds after the port opens so worker boot
+                 isn't counted, only what is still loaded lazily
+- steady_ms:     p50 of the turns after that
+- workers_pss_mb: proportional set size summed over the workers; pages
+                 shared copy-on-write with the master count fractionally
+
+Usage (from the repo root):
+    python -m benchmarks.worker_startup --workers 2
+    python -m benchmarks.worker_startup --embedding-backend local   # needs sentence-transformers
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import fake_upstream
+from benchmarks.load_test import drive, new_sessions, setup_users
+from benchmarks.server_capacity import free_port, start_server
+
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def pss_mb(pid):
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run(preload, port, env, args, users):
+    start = time.perf_counter()
+    server = start_server(args.mode, port, dict(env, GUNICORN_PRELOAD=str(preload)), 4, workers=args.workers)
+    ready = time.perf_counter() - start
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        script = [["I can't sleep and my thoughts keep racing"]]
+        time.sleep(args.settle)
+        first, _, _ = asyncio.run(drive(base_url, "api", users, new_sessions(users), script))
+        steady, errors = [], 0
+        for _ in range(args.requests):
+            latencies, failed, _ = asyncio.run(drive(base_url, "api", users, new_sessions(users), script))
+            steady += latencies
+            errors += failed
+        pss = sum(pss_mb(pid) for pid in worker_pids(server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "preload": preload,
+        "workers": args.workers,
+        "ready_s": round(ready, 2),
+        "first_ms": round(max(first or [0.0]) * 1000, 1),
+        "steady_ms": round(float(np.percentile(np.asarray(steady or [0.0]) * 1000, 50)), 1),
+        "errors": errors,
+        "workers_pss_mb": round(pss, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=5, help="steady-state turns per worker")
+    parser.add_argument("--settle", type=float, default=5.0, help="seconds to let the workers boot")
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="asgi")
+    parser.add_argument("--embedding-backend", choices=["local", "remote"], default="remote")
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    upstream = fake_upstream.start(upstream_port, latency=0.05, token_rate=0)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE="wellness_bot.settings",
+                DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, 'startup.sqlite3')}",
+                LLM_PROVIDER="groq",
+                LLM_BASE_URL=f"http://127.0.0.1:{upstream_port}",
+                GROQ_API_KEY="fake",
+                EMBEDDING_BACKEND=args.embedding_backend,
+                EMBEDDING_API_URL=f"http://127.0.0.1:{upstream_port}/pipeline/feature-extraction/fake",
+                RESPONSE_CACHE_ENABLED="False",
+            )
+            os.environ.update(env)
+            users = setup_users(args.workers)
+            for preload in (False, True):
+                print(json.dumps(run(preload, free_port(), env, args, users)))
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+
+if __name__ == "__main__":
+    main()
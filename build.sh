@@ -1,3 +1,6 @@
 #!/usr/bin/env bash
 pip install --upgrade pip
-pip install -r requirements.txt
\ No newline at end of file
+pip install -r requirements.txt
+# Re-embed the knowledge base if the committed artifact is out of date
+# (format, chunker, model or knowledge files); needs the model from requirements
+python -m rag.build_embeddings --check || python -m rag.build_embeddings --full
@@ -0,0 +1,83 @@
+import os
+
+from django.core.cache import cache
+
+from .models import ChatMessage
+from .safety import CRISIS_MARKER
+
+# CONFIG
+# Messages kept per session; at least SUMMARY_KEEP + SUMMARY_FOLD, or the
+# window never shows a summary as due
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", "12"))
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+
+
+def drop_crisis_turns(rows):
+    """
+    Leave out whole crisis turns, the user's message and the CRISIS_MARKER
+    reply saved with it, so they never go back into the LLM context.
+    ``rows`` are oldest first.
+    """
+    kept = []
+    for row in rows:
+        if row["content"] == CRISIS_MARKER:
+            if kept and kept[-1]["role"] == "user":
+                kept.pop()
+            continue
+        kept.append(row)
+    return kept
+
+
+def _cache_key(session_id):
+    return f"chat:window:{session_id}"
+
+
+def _messages(session_id):
+    return ChatMessage.objects.filter(session_id=session_id).order_by("-created_at", "-id")
+
+
+def load_window(session_id, n=CONTEXT_WINDOW):
+    """
+    Return the latest ``n`` messages of a session, oldest first, as
+    ``{"id", "role", "content"}`` dicts.
+
+    The cache is per process unless a shared backend is configured, and
+    other workers write to the same sessions, so a cached window is only
+    used while it still ends at the session's newest message (one LIMIT 1
+    lookup on the (session, created_at) index). Otherwise the window is
+    read again with one indexed query.
+    """
+    newest = _messages(session_id).values_list("id", flat=True).first()
+    if n <= CONTEXT_WINDOW:
+        cached = cache.get(_cache_key(session_id))
+        if cached is not None and cached["newest"] == newest:
+            window = cached["rows"]
+            return window[-n:] if n else []
+
+    # Twice the window, so crisis turns dropped below still leave it full
+    rows = list(_messages(session_id).values("id", "role", "content")[:2 * max(n, CONTEXT_WINDOW)])
+    rows.reverse()
+    rows = drop_crisis_turns(rows)[-max(n, CONTEXT_WINDOW):]
+
+    cache.set(_cache_key(session_id), {"newest": newest, "rows": rows[-CONTEXT_WINDOW:]}, CONTEXT_CACHE_TTL)
+    return rows[-n:] if n else []
+
+
+def append_to_window(message):
+    """Keep the cached window in step with a message that was just saved."""
+    key = _cache_key(message.session_id)
+    cached = cache.get(key)
+    if cached is None:
+        # Nothing cached yet; the next load_window reads it from the DB
+        return
+
+    # Crisis turns leave the rows (the marker takes its user message with
+    # it) but still move the newest id
+    cached["newest"] = message.id
+    row = {"id": message.id, "role": message.role, "content": message.content}
+    cached["rows"] = drop_crisis_turns(cached["rows"] + [row])[-CONTEXT_WINDOW:]
+    cache.set(key, cached, CONTEXT_CACHE_TTL)
+
+
+def invalidate_window(session_id):
+    cache.delete(_cache_key(session_id))
@@ -0,0 +1,304 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+from .metrics import incr
+
+# CONFIG
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")  # "groq" or "local"
+LLM_MODEL = os.getenv("LLM_MODEL", "openai/gpt-oss-20b")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL")  # override the Groq endpoint
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))  # seconds, whole call incl. retries
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+
+# Local stand-in provider (offline dev, load tests)
+LLM_LOCAL_LATENCY = float(os.getenv("LLM_LOCAL_LATENCY", "0.5"))
+LLM_LOCAL_TOKEN_DELAY = float(os.getenv("LLM_LOCAL_TOKEN_DELAY", "0.02"))
+
+
+class LLMError(Exception):
+    """Raised when the upstream model could not produce a reply."""
+
+    def __init__(self, message, status_code=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class GroqProvider:
+    name = "groq"
+
+    def __init__(self, api_key=None, base_url=LLM_BASE_URL, max_connections=LLM_MAX_CONNECTIONS):
+        import httpx
+        from groq import AsyncGroq
+
+        api_key = api_key or os.getenv("GROQ_API_KEY")
+        if not api_key:
+            raise RuntimeError("GROQ_API_KEY not set")
+
+        # One pooled keep-alive client for the whole worker
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        # Retries and deadlines are handled by the gateway
+        self.client = AsyncGroq(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            max_retries=0,
+            timeout=LLM_TIMEOUT,
+        )
+
+    def _translate(self, exc):
+        import groq
+
+        if isinstance(exc, groq.APIStatusError):
+            retry_after = exc.response.headers.get("retry-after")
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            return LLMError(
+                str(exc),
+                status_code=exc.status_code,
+                retryable=exc.status_code == 429 or exc.status_code >= 500,
+                retry_after=retry_after,
+            )
+        if isinstance(exc, (groq.APIConnectionError, groq.APITimeoutError)):
+            return LLMError(str(exc), retryable=True)
+        return LLMError(str(exc))
+
+    async def complete(self, messages, model, **params):
+        import groq
+
+        try:
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **params
+            )
+        except groq.GroqError as e:
+            raise self._translate(e) from e
+        return response.choices[0].message.content or ""
+
+    async def stream(self, messages, model, **params):
+        import groq
+
+        try:
+            stream = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **params
+            )
+            async for chunk in stream:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    yield token
+        except groq.GroqError as e:
+            raise self._translate(e) from e
+
+
+class LocalProvider:
+    """
+    Stand-in model with configurable latency and error rate, used for
+    offline development and for load-testing the gateway itself.
+    """
+
+    name = "local"
+
+    def __init__(self, latency=LLM_LOCAL_LATENCY, token_delay=LLM_LOCAL_TOKEN_DELAY, error_rate=0.0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+
+    def _reply(self, messages):
+        user_message = next(
+            (m["content"] for m in reversed(messages) if m["role"] == "user"),
+            "",
+        )
+        return (
+            "Thank you for sharing that with me. "
+            f"It sounds like \"{user_message[:60]}\" has been on your mind. "
+            "Let's take a slow breath together and go one step at a time."
+        )
+
+    async def _maybe_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            raise LLMError("local provider simulated 503", status_code=503, retryable=True)
+
+    async def complete(self, messages, model, **params):
+        await asyncio.sleep(self.latency)
+        await self._maybe_fail()
+        return self._reply(messages)
+
+    async def stream(self, messages, model, **params):
+        await asyncio.sleep(self.latency)
+        await self._maybe_fail()
+        for word in self._reply(messages).split(" "):
+            await asyncio.sleep(self.token_delay)
+            yield word + " "
+
+
+PROVIDERS = {
+    "groq": GroqProvider,
+    "local": LocalProvider,
+}
+
+
+class LLMGateway:
+    """
+    Single entry point for chat completions.
+
+    All upstream calls run on one event loop owned by the gateway, so the
+    pooled HTTP connections and the concurrency cap are shared by every
+    caller in the worker: sync views (``complete``), async views
+    (``acomplete`` / ``astream``) and background threads alike.
+    """
+
+    def __init__(self, provider, model=LLM_MODEL, timeout=LLM_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, max_concurrency=LLM_MAX_CONCURRENCY,
+                 backoff_base=0.5, backoff_max=8.0):
+        self.provider = provider
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever,
+            name="llm-gateway",
+            daemon=True,
+        )
+        self._thread.start()
+        self._semaphore = self._run(self._make_semaphore(max_concurrency))
+
+    @staticmethod
+    async def _make_semaphore(limit):
+        return asyncio.Semaphore(limit)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _backoff(self, attempt, error):
+        # Full jitter, but never earlier than the server asked for
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if error.retry_after:
+            delay = max(delay, error.retry_after)
+        return delay
+
+    async def _complete(self, messages, params):
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+
+        async with self._semaphore:
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    return await asyncio.wait_for(
+                        self.provider.complete(messages, self.model, **params),
+                        timeout=remaining,
+                    )
+                except asyncio.TimeoutError:
+                    incr("chat_upstream_errors_total", service="llm", reason="timeout")
+                    raise LLMError("LLM call exceeded its deadline", retryable=False)
+                except LLMError as e:
+                    incr("chat_upstream_errors_total", service="llm", reason=str(e.status_code or "error"))
+                    delay = self._backoff(attempt, e)
+                    if not e.retryable or attempt >= self.max_retries or delay >= deadline - time.monotonic():
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(delay)
+
+    async def _stream(self, messages, params, emit):
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+
+        async with self._semaphore:
+            while True:
+                started = False
+                stream = self.provider.stream(messages, self.model, **params)
+                try:
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        try:
+                            token = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+                        except StopAsyncIteration:
+                            return
+                        started = True
+                        emit(token)
+                except asyncio.TimeoutError:
+                    incr("chat_upstream_errors_total", service="llm", reason="timeout")
+                    raise LLMError("LLM stream exceeded its deadline", retryable=False)
+                except LLMError as e:
+                    incr("chat_upstream_errors_total", service="llm", reason=str(e.status_code or "error"))
+                    # Once tokens reached the caller a retry would duplicate them
+                    delay = self._backoff(attempt, e)
+                    if (started or not e.retryable or attempt >= self.max_retries
+                            or delay >= deadline - time.monotonic()):
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                finally:
+                    await stream.aclose()
+
+    def complete(self, messages, **params):
+        """Blocking call for sync views; returns the reply text."""
+        return self._run(self._complete(messages, params))
+
+    async def acomplete(self, messages, **params):
+        future = asyncio.run_coroutine_threadsafe(self._complete(messages, params), self.loop)
+        return await asyncio.wrap_future(future)
+
+    async def astream(self, messages, **params):
+        """Yield reply tokens as the provider produces them."""
+        caller_loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def emit(token):
+            caller_loop.call_soon_threadsafe(queue.put_nowait, token)
+
+        async def produce():
+            try:
+                await self._stream(messages, params, emit)
+                emit(done)
+            except BaseException as e:
+                emit(e)
+
+        future = asyncio.run_coroutine_threadsafe(produce(), self.loop)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+
+# Globals (lazy-loaded, one per worker)
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                provider = PROVIDERS[LLM_PROVIDER]()
+                _gateway = LLMGateway(provider)
+    return _gateway
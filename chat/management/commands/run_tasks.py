@@ -0,0 +1,36 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.tasks import TASK_BATCH_SIZE, drain, release_stale, run_pending, stats
+
+
+class Command(BaseCommand):
+    help = "Run queued post-reply tasks (memory indexing, summaries)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="drain the queue and exit")
+        parser.add_argument("--batch", type=int, default=TASK_BATCH_SIZE, help="tasks claimed per poll")
+        parser.add_argument("--interval", type=float, default=1.0, help="seconds to sleep when idle")
+
+    def handle(self, *args, **options):
+        release_stale()
+
+        if options["once"]:
+            ran = drain(options["batch"])
+            self.stdout.write(f"Ran {ran} tasks")
+            self.stdout.write(json.dumps(stats(), indent=2))
+            return
+
+        self.stdout.write("Task worker started")
+        last_cleanup = time.monotonic()
+        try:
+            while True:
+                if not run_pending(options["batch"]):
+                    time.sleep(options["interval"])
+                if time.monotonic() - last_cleanup > 60:
+                    release_stale()
+                    last_cleanup = time.monotonic()
+        except KeyboardInterrupt:
+            self.stdout.write(json.dumps(stats(), indent=2))
@@ -1,50 +1,210 @@
-import faiss
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from rag.embedder import DIMENSION, embed_texts
+
+from .models import MemoryItem
+
+logger = logging.getLogger(__name__)
+
+# CONFIG
+MEMORY_CAPACITY = int(os.getenv("MEMORY_CAPACITY", "500"))  # items per user
+MEMORY_CACHE_USERS = int(os.getenv("MEMORY_CACHE_USERS", "256"))  # users kept in RAM per worker
+MEMORY_CACHE_TTL = float(os.getenv("MEMORY_CACHE_TTL", "60"))  # seconds before re-reading the DB
+MEMORY_RECALL_K = int(os.getenv("MEMORY_RECALL_K", "2"))  # memories added to each prompt
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", "0.35"))  # cosine similarity
+
+
+class UserMemory:
+    """
+    In-process snapshot of one user's memory. ``state`` is replaced as a
+    whole on every change, so readers never see half-updated arrays.
+    """
 
-# Globals (lazy-loaded)
-_model = None
-_index = None
-_memory_texts = []
+    def __init__(self, ids, session_ids, texts, vectors):
+        self.state = (ids, session_ids, texts, vectors)
+        self.loaded_at = time.monotonic()
 
-DIMENSION = 384
+    @classmethod
+    def load(cls, user_id):
+        rows = list(
+            MemoryItem.objects
+            .filter(user_id=user_id)
+            .order_by("id")
+            .values_list("id", "session_id", "text", "embedding")
+        )
+        vectors = np.zeros((len(rows), DIMENSION), dtype="float32")
+        for i, row in enumerate(rows):
+            vectors[i] = np.frombuffer(row[3], dtype="float32")
+        return cls(
+            np.array([row[0] for row in rows], dtype="int64"),
+            np.array([row[1] or 0 for row in rows], dtype="int64"),
+            [row[2] for row in rows],
+            vectors,
+        )
 
+    def update(self, new_ids, session_id, new_texts, new_vectors, evicted_ids):
+        ids, session_ids, texts, vectors = self.state
+        ids = np.concatenate([ids, new_ids])
+        session_ids = np.concatenate([session_ids, np.full(len(new_ids), session_id or 0, dtype="int64")])
+        texts = texts + list(new_texts)
+        vectors = np.vstack([vectors, new_vectors])
 
-def get_model():
-    global _model
-    if _model is None:
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
-    return _model
+        if len(evicted_ids):
+            keep = ~np.isin(ids, evicted_ids)
+            ids, session_ids, vectors = ids[keep], session_ids[keep], vectors[keep]
+            texts = [text for text, kept in zip(texts, keep) if kept]
 
+        self.state = (ids, session_ids, texts, vectors)
 
-def get_index():
-    global _index
-    if _index is None:
-        _index = faiss.IndexFlatL2(DIMENSION)
-    return _index
 
+# Globals (per worker)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Bumped by every write; a snapshot read while it moved may be stale
+_writes = 0
 
-def add_to_memory(text: str):
-    model = get_model()
-    index = get_index()
 
-    embedding = model.encode([text])
-    index.add(np.array(embedding))
-    _memory_texts.append(text)
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
 
 
-def retrieve_memory(query: str, k: int = 2):
-    if len(_memory_texts) == 0:
+def _get_user_memory(user_id):
+    with _cache_lock:
+        memory = _cache.get(user_id)
+        if memory is not None and time.monotonic() - memory.loaded_at < MEMORY_CACHE_TTL:
+            _cache.move_to_end(user_id)
+            return memory
+        writes = _writes
+
+    memory = UserMemory.load(user_id)
+    with _cache_lock:
+        if _writes != writes:
+            # A write landed during the load; use it once, don't cache it
+            return memory
+        _cache[user_id] = memory
+        _cache.move_to_end(user_id)
+        while len(_cache) > MEMORY_CACHE_USERS:
+            _cache.popitem(last=False)
+    return memory
+
+
+def _evict(user_id, capacity):
+    """Drop the least important (then oldest) items beyond ``capacity``."""
+    queryset = MemoryItem.objects.filter(user_id=user_id)
+    excess = queryset.count() - capacity
+    if excess <= 0:
         return []
 
-    model = get_model()
-    index = get_index()
+    evicted = list(
+        queryset
+        .order_by("importance", "created_at")
+        .values_list("id", flat=True)[:excess]
+    )
+    MemoryItem.objects.filter(id__in=evicted).delete()
+    return evicted
+
+
+def add_to_memory(user, texts, session=None, importance=0.0, vectors=None):
+    """
+    Store one text or a batch of texts in ``user``'s long-term memory.
+
+    ``vectors`` can be passed when the caller already embedded ``texts``
+    (e.g. a batch spanning several users).
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    texts = [text for text in texts if text.strip()]
+    if not texts:
+        return []
 
-    query_embedding = model.encode([query])
-    distances, indices = index.search(np.array(query_embedding), k)
+    if vectors is None:
+        vectors = embed_texts(texts)
+    vectors = _normalize(np.asarray(vectors, dtype="float32"))
 
-    return [
-        _memory_texts[i]
-        for i in indices[0]
-        if i < len(_memory_texts)
-    ]
+    user_id = getattr(user, "pk", user)
+    session_id = getattr(session, "pk", session)
+
+    with transaction.atomic():
+        # Row lock on the user: concurrent writers (task workers in other
+        # processes) would otherwise both count and both evict
+        list(User.objects.select_for_update().filter(pk=user_id).values_list("pk", flat=True))
+        items = MemoryItem.objects.bulk_create([
+            MemoryItem(
+                user_id=user_id,
+                session_id=session_id,
+                text=text,
+                embedding=vector.tobytes(),
+                importance=importance,
+            )
+            for text, vector in zip(texts, vectors)
+        ])
+        evicted = _evict(user_id, MEMORY_CAPACITY)
+
+    # Keep this worker's snapshot current without re-reading the DB; under
+    # the lock so two writers can't each build on the same old state
+    global _writes
+    ids = [item.pk for item in items]
+    with _cache_lock:
+        _writes += 1
+        memory = _cache.get(user_id)
+        if memory is not None:
+            if None in ids:
+                # Backend can't return ids from bulk_create, reload next time
+                _cache.pop(user_id, None)
+            else:
+                memory.update(np.array(ids, dtype="int64"), session_id, texts, vectors, evicted)
+
+    return items
+
+
+def retrieve_memory(user, query: str, k: int = 2, session=None, exclude_session=None, min_score=None):
+    """
+    Return up to ``k`` stored texts most similar to ``query``, optionally
+    only from ``session`` or from any session but ``exclude_session``, and
+    only those scoring at least ``min_score``.
+    """
+    ids, session_ids, texts, vectors = _get_user_memory(getattr(user, "pk", user)).state
+    if not len(ids):
+        return []
+
+    query_vector = _normalize(embed_texts([query]))[0]
+    scores = vectors @ query_vector
+
+    if session is not None:
+        session_id = getattr(session, "pk", session)
+        scores = np.where(session_ids == session_id, scores, -np.inf)
+    if exclude_session is not None:
+        session_id = getattr(exclude_session, "pk", exclude_session)
+        scores = np.where(session_ids == session_id, -np.inf, scores)
+    if min_score is not None:
+        scores = np.where(scores >= min_score, scores, -np.inf)
+
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+
+    return [texts[i] for i in top if np.isfinite(scores[i])]
+
+
+def recall(session, query):
+    """
+    Memories from the user's other conversations that relate to ``query``,
+    for the prompt. The current session is already in the window/summary.
+    """
+    try:
+        return retrieve_memory(
+            session.user_id, query, k=MEMORY_RECALL_K, exclude_session=session.id, min_score=MEMORY_MIN_SCORE
+        )
+    except Exception:
+        # A reply without memory beats no reply
+        logger.warning("Memory recall failed", exc_info=True)
+        return []
@@ -0,0 +1,339 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+# CONFIG
+# /metrics answers staff users, or "Authorization: Bearer <token>" when set
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Directory shared by the workers of one server (gunicorn.conf.py sets one):
+# each worker writes its numbers there and /metrics adds them up. Unset,
+# /metrics shows only the process that served it.
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))  # seconds
+SLOW_TURN_MS = float(os.getenv("SLOW_TURN_MS", "5000"))  # log the stage breakdown of slower turns
+
+# Seconds; spans range from sub-millisecond (safety, prompt) to LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "chat_stage_seconds": ("histogram", "Time spent in each stage of a chat turn."),
+    "chat_turn_seconds": ("histogram", "Wall time of a whole chat turn."),
+    "chat_stage_errors_total": ("counter", "Stages that raised."),
+    "chat_fallbacks_total": ("counter", "Turns answered with a fallback instead of the normal path."),
+    "chat_upstream_errors_total": ("counter", "Failed calls to the LLM and retrieval backends."),
+    "chat_crisis_turns_total": ("counter", "Messages answered with the crisis response."),
+}
+
+
+class Histogram:
+    """Prometheus-style histogram: per-bucket counts, sum and count."""
+
+    __slots__ = ("buckets", "counts", "sum", "lock")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+
+# Globals (per worker process, like the other in-process caches)
+_histograms = {}  # (name, labels) -> Histogram
+_counters = {}  # (name, labels) -> number
+_registry_lock = threading.Lock()
+_turn = ContextVar("chat_turn", default=None)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def histogram(name, **labels):
+    key = (name, _labels(labels))
+    found = _histograms.get(key)
+    if found is None:
+        with _registry_lock:
+            found = _histograms.setdefault(key, Histogram())
+    return found
+
+
+def incr(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _registry_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(stage, seconds, ok=True):
+    """Record one stage timing (and failure) for the current turn."""
+    histogram("chat_stage_seconds", stage=stage).observe(seconds)
+    if not ok:
+        incr("chat_stage_errors_total", stage=stage)
+    stages = _turn.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+class span:
+    """
+    ``with span("embed"): ...`` times the block into the stage histogram.
+    A plain class rather than @contextmanager keeps it around 1µs.
+    """
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.start, ok=exc_type is None)
+        return False
+
+
+class trace_turn:
+    """
+    Wraps one chat turn: records its total time and, past SLOW_TURN_MS,
+    logs which stages the time went to.
+    """
+
+    __slots__ = ("view", "start", "stages", "token")
+
+    def __init__(self, view):
+        self.view = view
+
+    def __enter__(self):
+        self.stages = []
+        self.token = _turn.set(self.stages)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        _turn.reset(self.token)
+        histogram("chat_turn_seconds", view=self.view).observe(elapsed)
+        if elapsed * 1000 >= SLOW_TURN_MS:
+            logger.warning(
+                "slow %s turn: %.0fms (%s)", self.view, elapsed * 1000,
+                ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in self.stages)
+            )
+        return False
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def _collect_stats():
+    """Stats kept by other modules, as ``(name, type, help, labels, value)``."""
+    from .response_cache import _caches
+    from .tasks import stats as task_stats
+
+    for namespace, response_cache in list(_caches.items()):
+        stats = response_cache.stats()
+        labels = (("namespace", namespace),)
+        yield "chat_response_cache_hits_total", "counter", "Replies served from the semantic cache.", labels, stats["hits"]
+        yield "chat_response_cache_misses_total", "counter", "Semantic cache lookups that missed.", labels, stats["misses"]
+        yield "chat_response_cache_entries", "gauge", "Replies held in the semantic cache.", labels, stats["size"]
+        yield ("chat_response_cache_saved_seconds_total", "counter", "LLM time avoided by cache hits.",
+               labels, stats["saved_ms"] / 1000)
+
+    from rag import embedder
+
+    if embedder._embedder is not None:
+        info = embedder.describe(embedder._embedder)
+        labels = (("backend", info["backend"]), ("precision", info["precision"]), ("configured", embedder.EMBEDDING_BACKEND))
+        yield "chat_embedder_info", "gauge", "Embedding backend in use (differs from configured after a fallback).", labels, 1
+
+    if embedder._batcher is not None:
+        stats = embedder._batcher.stats()
+        yield "chat_embedding_batches_total", "counter", "Model calls made by the embedding batcher.", (), stats["batches"]
+        yield ("chat_embedding_batch_items_total", "counter", "Texts embedded through the batcher.",
+               (), stats["items"])
+
+    for name, stats in task_stats().items():
+        labels = (("task", name),)
+        yield "chat_tasks_total", "counter", "Background tasks run by this process.", labels, stats["count"]
+        yield "chat_tasks_failed_total", "counter", "Background tasks that raised.", labels, stats["failed"]
+        yield ("chat_task_wait_seconds_avg", "gauge", "Average queue wait before a task ran.",
+               labels, stats["avg_wait_ms"] / 1000)
+
+
+def snapshot():
+    """
+    This process's metrics as plain data: ``histograms`` as (name, labels,
+    buckets, counts, sum), ``counters`` as (name, labels, value) and
+    ``stats`` as _collect_stats() yields them.
+    """
+    with _registry_lock:
+        histograms = [(name, labels, found.buckets, *found.snapshot()) for (name, labels), found in _histograms.items()]
+        counters = [(name, labels, value) for (name, labels), value in _counters.items()]
+    return {"histograms": histograms, "counters": counters, "stats": list(_collect_stats())}
+
+
+def _write(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush():
+    """Write this worker's snapshot to METRICS_DIR."""
+    if METRICS_DIR:
+        _write(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), snapshot())
+
+
+def start_flusher():
+    """Flush every METRICS_FLUSH_INTERVAL seconds (gunicorn post_worker_init)."""
+    if not METRICS_DIR:
+        return
+
+    def run():
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                flush()
+            except Exception:
+                logger.warning("Writing metrics failed", exc_info=True)
+
+    threading.Thread(target=run, name="metrics-flush", daemon=True).start()
+
+
+def _merge(snapshots):
+    """
+    Add up ``[(worker, data), ...]``. Histograms and counters are summed,
+    so totals survive worker restarts; gauges describe a live process, so
+    they keep a ``worker`` label and are dropped for dead ones (worker None).
+    """
+    histograms, counters, stats = {}, {}, {}
+    for worker, data in snapshots:
+        for name, labels, buckets, counts, total in data["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                found = histograms[key]
+                found[1] = [a + b for a, b in zip(found[1], counts)]
+                found[2] += total
+            else:
+                histograms[key] = [tuple(buckets), list(counts), total]
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, kind, text, labels, value in data["stats"]:
+            labels = tuple(map(tuple, labels))
+            if kind == "gauge":
+                if worker is None:
+                    continue
+                labels += (("worker", worker),)
+            key = (name, labels)
+            stats[key] = (kind, text, stats[key][2] + value if key in stats else value)
+
+    return {
+        "histograms": [(name, labels, *found) for (name, labels), found in histograms.items()],
+        "counters": [(name, labels, value) for (name, labels), value in counters.items()],
+        "stats": [(name, kind, text, labels, value) for (name, labels), (kind, text, value) in stats.items()],
+    }
+
+
+def mark_dead(pid):
+    """
+    Fold an exited worker's file into ``dead.json`` (gunicorn child_exit,
+    in the master), keeping its counters and dropping its gauges.
+    """
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"{pid}.json")
+    data = _read(path)
+    if data is None:
+        return
+    dead_path = os.path.join(METRICS_DIR, "dead.json")
+    snapshots = [(None, data)]
+    previous = _read(dead_path)
+    if previous is not None:
+        snapshots.append((None, previous))
+    _write(dead_path, _merge(snapshots))
+    os.remove(path)
+
+
+def _worker_snapshots():
+    flush()
+    snapshots = []
+    for filename in sorted(os.listdir(METRICS_DIR)):
+        name, ext = os.path.splitext(filename)
+        if ext != ".json":
+            continue
+        data = _read(os.path.join(METRICS_DIR, filename))
+        if data is not None:
+            snapshots.append((None if name == "dead" else name, data))
+    return snapshots
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format: every worker's
+    when METRICS_DIR is set (up to METRICS_FLUSH_INTERVAL old for the
+    others), else this process's.
+    """
+    data = _merge(_worker_snapshots()) if METRICS_DIR else snapshot()
+
+    families = {}  # name -> (type, help, sample lines); samples of a family must be contiguous
+
+    def family(name, kind, text):
+        return families.setdefault(name, (kind, text, []))[2]
+
+    for name, labels, buckets, counts, total in sorted(data["histograms"], key=lambda found: found[:2]):
+        samples = family(name, *HELP.get(name, ("histogram", name)))
+        cumulative = 0
+        for bound, count in zip(tuple(buckets) + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            samples.append(f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+        samples.append(f"{name}_sum{_format_labels(labels)} {total}")
+        samples.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    for name, labels, value in sorted(data["counters"], key=lambda found: found[:2]):
+        family(name, *HELP.get(name, ("counter", name))).append(f"{name}{_format_labels(labels)} {value}")
+
+    for name, kind, text, labels, value in data["stats"]:
+        family(name, kind, text).append(f"{name}{_format_labels(labels)} {value}")
+
+    lines = []
+    for name, (kind, text, samples) in families.items():
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}", *samples]
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Forget everything recorded so far (tests)."""
+    with _registry_lock:
+        _histograms.clear()
+        _counters.clear()
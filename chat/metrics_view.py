@@ -0,0 +1,19 @@
+import hmac
+
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+
+from .metrics import METRICS_TOKEN, render
+
+
+@require_GET
+def metrics_view(request):
+    """Prometheus scrape endpoint, for staff users or the METRICS_TOKEN bearer."""
+    allowed = request.user.is_authenticated and request.user.is_staff
+    if METRICS_TOKEN and not allowed:
+        expected = f"Bearer {METRICS_TOKEN}"
+        allowed = hmac.compare_digest(request.headers.get("Authorization", ""), expected)
+    if not allowed:
+        return HttpResponseForbidden("metrics token required")
+
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
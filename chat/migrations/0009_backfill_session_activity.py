@@ -0,0 +1,37 @@
+from django.db import migrations
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
+
+# Frozen copies, migrations must not import app code
+CRISIS_MARKER = "CRISIS_INTERVENTION_TRIGGERED"
+PREVIEW_LENGTH = 80
+
+
+def backfill(apps, schema_editor):
+    ChatSession = apps.get_model("chat", "ChatSession")
+    ChatMessage = apps.get_model("chat", "ChatMessage")
+
+    messages = ChatMessage.objects.filter(session=OuterRef("pk"))
+    latest = messages.order_by("-created_at", "-id")
+    counts = messages.order_by().values("session").annotate(n=Count("id")).values("n")
+
+    # One UPDATE over all sessions, correlated subqueries per row
+    ChatSession.objects.update(
+        message_count=Coalesce(Subquery(counts), 0),
+        last_message_at=Coalesce(Subquery(latest.values("created_at")[:1]), F("created_at")),
+        preview=Coalesce(
+            Substr(Subquery(latest.exclude(content=CRISIS_MARKER).values("content")[:1]), 1, PREVIEW_LENGTH),
+            Value(""),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_chatsession_activity"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
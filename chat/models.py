@@ -1,11 +1,31 @@
-from django.db import models
 from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .safety import CRISIS_MARKER, display_text
+
+PREVIEW_LENGTH = 80
 
 
 class ChatSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=100, default="New Chat")
     created_at = models.DateTimeField(auto_now_add=True)
+    # Rolling summary of the turns older than the context window
+    summary = models.TextField(blank=True, default="")
+    summary_upto = models.BigIntegerField(default=0)  # last ChatMessage id folded into summary
+    # Denormalised for the sidebar, kept current by record_messages()
+    last_message_at = models.DateTimeField(default=timezone.now)
+    message_count = models.PositiveIntegerField(default=0)
+    preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            # Sidebar pages: a user's sessions, most recently active first
+            models.Index(fields=["user", "last_message_at"], name="chat_session_activity_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title}"
@@ -17,5 +37,79 @@ class ChatMessage(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Sliding-window reads: latest N messages of one session
+            models.Index(fields=["session", "created_at"], name="chat_message_window_idx"),
+        ]
+
     def __str__(self):
         return f"{self.role}: {self.content[:30]}"
+
+    @property
+    def display_content(self):
+        return display_text(self.content)
+
+
+def record_messages(session_id, messages, **extra):
+    """
+    Fold newly saved ``messages`` of one session into its sidebar fields
+    with a single UPDATE, safe against concurrent writers. ``extra`` field
+    values ride along in the same statement.
+    """
+    if not messages:
+        return
+    last = max(messages, key=lambda message: (message.created_at, message.pk or 0))
+    fields = {
+        "last_message_at": Greatest(F("last_message_at"), last.created_at),
+        "message_count": F("message_count") + len(messages),
+        **extra,
+    }
+    visible = [message for message in messages if message.content != CRISIS_MARKER]
+    if visible:
+        fields["preview"] = visible[-1].content[:PREVIEW_LENGTH]
+    ChatSession.objects.filter(id=session_id).update(**fields)
+
+
+class MemoryItem(models.Model):
+    """Long-term memory entry; ``embedding`` is a normalized float32 vector."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="memories")
+    session = models.ForeignKey(ChatSession, on_delete=models.SET_NULL, related_name="memories", null=True, blank=True)
+    text = models.TextField()
+    embedding = models.BinaryField()
+    importance = models.FloatField(default=0.0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "importance", "created_at"], name="chat_memory_eviction_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.text[:30]}"
+
+
+class Task(models.Model):
+    """Deferred post-reply work, run by ``manage.py run_tasks``."""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    name = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="chat_task_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
@@ -0,0 +1,64 @@
+import base64
+import os
+from datetime import datetime
+
+from django.db.models import Q
+
+# CONFIG
+MESSAGE_PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", "50"))
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", "30"))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk):
+    raw = f"{value.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        value, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(value), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def _seek(queryset, field, cursor):
+    queryset = queryset.order_by(f"-{field}", "-id")
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f"{field}__lt": value}) | Q(**{field: value, "id__lt": pk}))
+    return queryset
+
+
+def _split(rows, field, page_size):
+    if len(rows) <= page_size:
+        return rows, None
+
+    rows = rows[:page_size]
+    last = rows[-1]
+    if isinstance(last, dict):
+        return rows, encode_cursor(last[field], last["id"])
+    return rows, encode_cursor(getattr(last, field), last.pk)
+
+
+def keyset_page(queryset, field="created_at", cursor=None, page_size=50):
+    """
+    Return ``(rows, next_cursor)``: the next ``page_size`` rows of
+    ``queryset``, newest ``field`` first, strictly after ``cursor``.
+
+    Seeks on ``(field, id)`` instead of OFFSET, so every page is one index
+    range scan no matter how deep the client has scrolled. ``next_cursor``
+    is None on the last page.
+    """
+    queryset = _seek(queryset, field, cursor)
+    return _split(list(queryset[:page_size + 1]), field, page_size)
+
+
+async def akeyset_page(queryset, field="created_at", cursor=None, page_size=50):
+    queryset = _seek(queryset, field, cursor)
+    return _split([row async for row in queryset[:page_size + 1]], field, page_size)
@@ -0,0 +1,38 @@
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from .context import append_to_window, invalidate_window
+from .models import ChatMessage, record_messages
+
+
+def save_turn(session, messages, title=None):
+    """
+    Save ``[(role, content), ...]`` for one turn in a single transaction:
+    one multi-row INSERT plus one UPDATE of the session's activity fields.
+    ``title`` (if given) is set in that same UPDATE and on ``session``.
+
+    Returns the saved ChatMessage objects.
+    """
+    extra = {"title": title} if title else {}
+    with transaction.atomic():
+        saved = ChatMessage.objects.bulk_create([
+            ChatMessage(session=session, role=role, content=content)
+            for role, content in messages
+        ])
+        record_messages(session.id, saved, **extra)
+
+    if title:
+        session.title = title
+
+    if any(message.pk is None for message in saved):
+        # Backend can't return ids from bulk_create, reload the window
+        invalidate_window(session.id)
+    else:
+        for message in saved:
+            append_to_window(message)
+    return saved
+
+
+# For ASGI views; transactions need a single thread, so this runs in the
+# shared sync thread rather than through the async ORM
+asave_turn = sync_to_async(save_turn)
@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# CONFIG
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))  # prompt tokens, reply not included
+PROMPT_KNOWLEDGE_SHARE = float(os.getenv("PROMPT_KNOWLEDGE_SHARE", "0.4"))  # of what's left after system + user
+# tiktoken encoding; set TIKTOKEN_CACHE_DIR to use it without network access
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "o200k_base")
+
+# Role/separator tokens the chat format adds around every message
+MESSAGE_OVERHEAD = 4
+
+SYSTEM_PROMPT = (
+    "You are a supportive mental wellness companion.\n"
+    "Speak calmly, warmly, and practically.\n"
+    "Use provided mental health context if relevant and preserve its structure.\n"
+    "When presenting structured steps, format clearly using numbered lists.\n"
+    "Avoid markdown tables.\n"
+    "Keep formatting clean and readable.\n"
+    "Do not give generic filler responses.\n"
+    "Do not analyze or label the user.\n"
+    "Do not give medical advice."
+)
+
+# Globals (lazy-loaded)
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _approx_tokens(text):
+    # ~4 characters per token for English text
+    return (len(text) + 3) // 4
+
+
+def get_tokenizer():
+    """Return a ``text -> token count`` function, tiktoken if available."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+
+                    encoding = tiktoken.get_encoding(PROMPT_TOKENIZER)
+                    _encoding = lambda text: len(encoding.encode(text, disallowed_special=()))
+                except Exception:
+                    logger.warning("tiktoken unavailable, estimating tokens from length", exc_info=True)
+                    _encoding = _approx_tokens
+    return _encoding
+
+
+def count_tokens(text):
+    return get_tokenizer()(text)
+
+
+class PromptBuilder:
+    """
+    Pack system text, retrieved knowledge, a conversation summary, memories
+    from earlier conversations and recent history into at most ``budget``
+    prompt tokens.
+
+    The system prompt and the user message always go in. The summary and
+    memories come next, knowledge gets up to ``knowledge_share`` of what's left (best
+    ranked chunk first), and the newest history turns fill the rest.
+    """
+
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET, knowledge_share=PROMPT_KNOWLEDGE_SHARE, counter=None):
+        self.budget = budget
+        self.knowledge_share = knowledge_share
+        self.count = counter or count_tokens
+        self.tokens = 0
+
+    def _cost(self, text):
+        return self.count(text) + MESSAGE_OVERHEAD
+
+    def build(self, user_message, system=SYSTEM_PROMPT, knowledge=(), summary="", history=(), memories=()):
+        used = self._cost(system) + self._cost(user_message)
+        messages = [{"role": "system", "content": system}]
+
+        # Conversation summary (older turns)
+        if summary:
+            summary_text = f"Summary of the earlier conversation:\n{summary}"
+            cost = self._cost(summary_text)
+            if used + cost <= self.budget:
+                messages.append({"role": "system", "content": summary_text})
+                used += cost
+
+        # Long-term memory from the user's other conversations
+        memory_header = "From earlier conversations with this user:\n"
+        memory_used = self.count(memory_header) + MESSAGE_OVERHEAD
+        recalled = []
+        for memory in memories:
+            cost = self.count(memory) + 3  # "- " bullet and newline
+            if used + memory_used + cost > self.budget:
+                continue
+            recalled.append(f"- {memory}")
+            memory_used += cost
+        if recalled:
+            messages.append({"role": "system", "content": memory_header + "\n".join(recalled)})
+            used += memory_used
+
+        # Retrieved knowledge, within its share
+        header = "Relevant mental health context:\n"
+        knowledge_budget = int(max(self.budget - used, 0) * self.knowledge_share)
+        knowledge_used = self.count(header) + MESSAGE_OVERHEAD
+        picked = []
+        for chunk in knowledge:
+            cost = self.count(chunk) + 2  # "\n\n" separator
+            if knowledge_used + cost > knowledge_budget:
+                continue
+            picked.append(chunk)
+            knowledge_used += cost
+        if picked:
+            messages.append({"role": "system", "content": header + "\n\n".join(picked)})
+            used += knowledge_used
+
+        # Recent history, newest first, until the budget runs out
+        kept = []
+        for msg in reversed(list(history)):
+            cost = self._cost(msg["content"])
+            if used + cost > self.budget:
+                break
+            kept.append({
+                "role": "assistant" if msg["role"] == "bot" else "user",
+                "content": msg["content"]
+            })
+            used += cost
+        messages += reversed(kept)
+
+        messages.append({"role": "user", "content": user_message})
+        self.tokens = used
+        return messages
@@ -0,0 +1,154 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# CONFIG
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "False") == "True"  # opt-in
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92"))  # cosine similarity
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))  # seconds
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))  # entries per namespace
+
+# Turns about the user's own life are never cached or served from cache.
+# "how do I ..." is fine, "my boyfriend ..." / "I feel ..." is not.
+PERSONAL_PATTERN = re.compile(
+    r"\b(?:my|mine|myself|me|i'm|im|i am|i feel|i felt|i was|i've|i have|i had|i want|i need)\b"
+    r"|\d{3,}|@",
+    re.IGNORECASE,
+)
+
+
+def is_personal(text):
+    return PERSONAL_PATTERN.search(text.replace("’", "'")) is not None
+
+
+class ResponseCache:
+    """
+    Replies to near-duplicate questions. An entry matches when it was built
+    from the same knowledge chunks and its question embedding is within
+    ``threshold`` cosine similarity of the new one. LRU beyond
+    ``max_entries``, entries expire after ``ttl`` seconds.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, threshold=RESPONSE_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries = OrderedDict()  # id -> (chunk_key, vector, reply, llm_ms, stored_at)
+        self.buckets = {}  # chunk_key -> set of ids
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.saved_ms = 0.0
+
+    def _remove(self, entry_id):
+        chunk_key = self.entries.pop(entry_id)[0]
+        bucket = self.buckets[chunk_key]
+        bucket.discard(entry_id)
+        if not bucket:
+            del self.buckets[chunk_key]
+
+    def _best(self, vector, chunk_key, now):
+        ids = [entry_id for entry_id in self.buckets.get(chunk_key, ())
+               if now - self.entries[entry_id][4] < self.ttl]
+        if not ids:
+            return None, -1.0
+        scores = np.stack([self.entries[entry_id][1] for entry_id in ids]) @ vector
+        best = int(np.argmax(scores))
+        return ids[best], float(scores[best])
+
+    def lookup(self, vector, chunk_ids=()):
+        chunk_key = tuple(sorted(chunk_ids))
+        now = time.monotonic()
+        with self.lock:
+            entry_id, score = self._best(vector, chunk_key, now)
+            if entry_id is None or score < self.threshold:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(entry_id)
+            _, _, reply, llm_ms, _ = self.entries[entry_id]
+            self.hits += 1
+            self.saved_ms += llm_ms
+            return reply
+
+    def store(self, vector, chunk_ids, reply, llm_ms=0.0):
+        chunk_key = tuple(sorted(chunk_ids))
+        now = time.monotonic()
+        with self.lock:
+            entry_id, score = self._best(vector, chunk_key, now)
+            if entry_id is not None and score >= self.threshold:
+                return
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = (chunk_key, vector, reply, llm_ms, now)
+            self.buckets.setdefault(chunk_key, set()).add(entry_id)
+            self.stores += 1
+
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+            # Expired entries are dropped as they reach the LRU end
+            while self.entries and now - next(iter(self.entries.values()))[4] >= self.ttl:
+                self._remove(next(iter(self.entries)))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "saved_ms": round(self.saved_ms, 1),
+                "size": len(self.entries),
+            }
+
+
+# Globals (one cache per prompt flavour per worker)
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(namespace):
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = ResponseCache()
+        return _caches[namespace]
+
+
+def cached_reply(namespace, text, chunk_ids=(), has_context=False):
+    """
+    Return ``(reply, query_vector)``. ``reply`` is None on a miss;
+    ``query_vector`` is None when the turn must not touch the cache.
+    Only replies that didn't depend on earlier turns are reusable, so a
+    turn with history or a summary (``has_context``) is neither served nor
+    stored. Crisis turns never get here, callers answer them first.
+    """
+    if not RESPONSE_CACHE_ENABLED or has_context or is_personal(text):
+        return None, None
+
+    from rag.embedder import embed_texts
+
+    try:
+        # Same text as the RAG query, so this is an embedding-cache hit
+        vector = np.asarray(embed_texts([text])[0], dtype="float32")
+    except Exception:
+        logger.warning("Response cache lookup failed", exc_info=True)
+        return None, None
+    vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+    return get_response_cache(namespace).lookup(vector, chunk_ids), vector
+
+
+def remember_reply(namespace, query_vector, chunk_ids, reply, llm_ms):
+    """Store a reply produced for a cacheable, context-free turn."""
+    if query_vector is None or not reply:
+        return
+    get_response_cache(namespace).store(query_vector, chunk_ids, reply, llm_ms)
+    logger.debug("response cache %s: %s", namespace, get_response_cache(namespace).stats())
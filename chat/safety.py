@@ -0,0 +1,165 @@
+import os
+import re
+import threading
+import unicodedata
+
+HIGH_RISK_KEYWORDS = [
+    "suicide",
+    "kill myself",
+    "end my life",
+    "self harm",
+    "hurt myself",
+    "no reason to live",
+    "want to die",
+    "cut myself",
+    "suicidal",
+    "end it all",
+    "better off dead",
+    "take my own life",
+    "harm myself",
+    "don't want to live",
+    "unalive myself",
+    # Shorthand for "kill myself"; also "kms" as in kilometres, but a false
+    # alarm here costs far less than a miss
+    "kms",
+]
+
+# Common misspellings / variants, matched as if they were the keyword
+MISSPELLINGS = {
+    "suicide": ["suicides", "suicde", "sucide", "suiside", "suicid", "sewercide"],
+    "suicidal": ["suicdal", "sucidal", "suisidal"],
+    "kill myself": ["killing myself", "kil my self", "kill my self", "kilmyself"],
+    "self harm": ["selfharm", "self harming", "self-harm"],
+    "hurt myself": ["hurting myself", "hurt my self", "hurtmyself"],
+    "cut myself": ["cutting myself", "cut my self"],
+    "want to die": ["wanting to die", "wanna die", "want 2 die", "wan to die"],
+    "end my life": ["ending my life", "end my own life"],
+}
+
+# Optional file with extra phrases, one per line
+CRISIS_PHRASES_FILE = os.getenv("CRISIS_PHRASES_FILE")
+
+# Stored as the bot message of every crisis turn, by every view; the
+# response itself is shown in its place (see display_text)
+CRISIS_MARKER = "CRISIS_INTERVENTION_TRIGGERED"
+
+CRISIS_RESPONSE = """
+I’m really sorry that you’re feeling this way.
+You’re not alone, and help is available.
+
+If you are in immediate danger or thinking about harming yourself,
+please contact your local emergency number right now.
+
+📞Suicide Prevention Helpline: Talk to someone now
+91-9820466726
+If you’re thinking about suicide, are worried about a friend or loved one,
+or would like emotional support, AASRA is available 24/7 across India.
+The Lifeline is available for everyone, is free, and confidential.
+If possible, please reach out to a trusted person nearby.
+"""
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_APOSTROPHES = re.compile(r"['’`]")
+_REPEATS = re.compile(r"([a-z])\1+")
+
+
+def normalize(text):
+    """
+    Fold text to lowercase ASCII words separated by single spaces, with
+    runs of a repeated letter collapsed ("diiie" -> "die", "kill" -> "kil").
+    Patterns go through the same function, so both sides line up.
+    """
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    text = _APOSTROPHES.sub("", text.lower())
+    text = _NON_WORD.sub(" ", text)
+    text = _REPEATS.sub(r"\1", text)
+    return " ".join(text.split())
+
+
+def _trie_pattern(phrases):
+    """
+    Build one regex from a character trie of ``phrases``. Shared prefixes
+    are factored out, so the work per input position is bounded by the
+    phrase length and alphabet, not by how many phrases there are.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node):
+        terminal = "" in node
+        branches = []
+        singles = []
+        for char in sorted(key for key in node if key):
+            child = node[char]
+            if list(child) == [""]:
+                singles.append(re.escape(char))
+            else:
+                branches.append(re.escape(char) + emit(child))
+
+        if singles:
+            branches.append(singles[0] if len(singles) == 1 else f"[{''.join(singles)}]")
+
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if terminal:
+            body = f"(?:{body})?"
+        return body
+
+    return emit(trie)
+
+
+class CrisisDetector:
+    def __init__(self, phrases):
+        normalized = {normalize(phrase) for phrase in phrases}
+        normalized.discard("")
+        self.phrases = normalized
+        # Whole words only: "skill myself" must not match "kill myself"
+        self.pattern = re.compile(rf"(?<![a-z0-9])(?:{_trie_pattern(normalized)})(?![a-z0-9])")
+
+    def find(self, text):
+        """Return the normalized phrase found in ``text``, or None."""
+        match = self.pattern.search(normalize(text))
+        return match.group(0) if match else None
+
+    def is_crisis(self, text):
+        return self.find(text) is not None
+
+
+def load_phrases():
+    phrases = list(HIGH_RISK_KEYWORDS)
+    for variants in MISSPELLINGS.values():
+        phrases += variants
+
+    if CRISIS_PHRASES_FILE:
+        with open(CRISIS_PHRASES_FILE, "r", encoding="utf-8") as f:
+            phrases += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    return phrases
+
+
+# Globals (lazy-loaded, one per worker)
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = CrisisDetector(load_phrases())
+    return _detector
+
+
+def is_crisis(text):
+    return get_detector().is_crisis(text)
+
+
+def display_text(content):
+    """Message content as the chat shows it: the crisis response for the marker."""
+    return CRISIS_RESPONSE.strip() if content == CRISIS_MARKER else content
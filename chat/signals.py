@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import ChatMessage, record_messages
+
+
+@receiver(post_save, sender=ChatMessage)
+def update_session_activity(sender, instance, created, raw=False, **kwargs):
+    # bulk_create sends no signal; callers using it call record_messages()
+    if created and not raw and instance.session_id:
+        record_messages(instance.session_id, [instance])
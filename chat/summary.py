@@ -0,0 +1,80 @@
+import os
+
+from .context import drop_crisis_turns, load_window
+from .llm import LLMError, get_gateway
+from .models import ChatMessage
+
+# CONFIG
+SUMMARY_KEEP = int(os.getenv("SUMMARY_KEEP", "6"))  # newest messages always sent verbatim
+SUMMARY_FOLD = int(os.getenv("SUMMARY_FOLD", "6"))  # older messages folded per summary update
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+
+SUMMARY_PROMPT = (
+    "You keep a short running summary of a conversation between a user and a "
+    "mental wellness companion. Merge the new turns into the existing summary. "
+    "Keep what the user shared about their situation, feelings and goals, and "
+    "any advice already given. Write at most a few sentences in the third person."
+)
+
+
+def unsummarized(session, window):
+    """Messages of ``window`` not yet folded into the session summary."""
+    return [msg for msg in window if msg["id"] > session.summary_upto]
+
+
+def summary_due(session, window):
+    return len(unsummarized(session, window)) >= SUMMARY_KEEP + SUMMARY_FOLD
+
+
+def pending_messages(session):
+    """Every message after ``session.summary_upto``, oldest first and without crisis turns, read from the DB."""
+    return drop_crisis_turns(
+        ChatMessage.objects
+        .filter(session_id=session.id, id__gt=session.summary_upto)
+        .order_by("created_at", "id")
+        .values("id", "role", "content")
+    )
+
+
+def refresh_summary(session, window=None):
+    """
+    Fold the unsummarized turns of ``session`` into ``session.summary``,
+    ``SUMMARY_FOLD`` at a time, keeping the newest ``SUMMARY_KEEP``
+    verbatim. The summary is stored on the session, so each turn is
+    summarized once and reused by every later prompt.
+
+    ``window`` (the cached context window) only decides whether anything
+    is due, so the common case costs no LLM call. The turns themselves come
+    from the DB: when the task worker lags, older turns have already left
+    the window and must still be folded. LLM errors propagate, so the task
+    queue retries with backoff.
+    """
+    if window is None:
+        window = load_window(session.id)
+
+    if not summary_due(session, window):
+        return False
+
+    pending = pending_messages(session)
+    while len(pending) >= SUMMARY_KEEP + SUMMARY_FOLD:
+        fold, pending = pending[:SUMMARY_FOLD], pending[SUMMARY_FOLD:]
+        turns = "\n".join(f"{msg['role']}: {msg['content']}" for msg in fold)
+        summary = get_gateway().complete(
+            [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"Summary so far:\n{session.summary or '(none)'}\n\nNew turns:\n{turns}"
+                },
+            ],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS
+        ).strip()
+        if not summary:
+            raise LLMError("empty summary")
+
+        # Saved per fold, so a retry after a failure resumes from here
+        session.summary = summary
+        session.summary_upto = fold[-1]["id"]
+        session.save(update_fields=["summary", "summary_upto"])
+    return True
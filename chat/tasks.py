@@ -0,0 +1,249 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ChatSession, Task
+
+logger = logging.getLogger(__name__)
+
+# CONFIG
+TASKS_EAGER = os.getenv("TASKS_EAGER", "False") == "True"  # drain in-process after each enqueue (dev/tests)
+TASK_BATCH_SIZE = int(os.getenv("TASK_BATCH_SIZE", "100"))  # tasks claimed per poll
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "3"))
+TASK_RETRY_DELAY = float(os.getenv("TASK_RETRY_DELAY", "5"))  # seconds, doubled per attempt
+TASK_TIMEOUT = float(os.getenv("TASK_TIMEOUT", "300"))  # running longer than this = worker died
+TASK_RETENTION = float(os.getenv("TASK_RETENTION", "86400"))  # seconds finished rows are kept
+
+# name -> (handler, batch_size); handlers take a list of payloads
+HANDLERS = {}
+
+# Per-worker latency metrics, see stats()
+_stats = defaultdict(lambda: {"count": 0, "failed": 0, "batches": 0, "run_ms": 0.0, "max_run_ms": 0.0, "wait_ms": 0.0})
+_stats_lock = threading.Lock()
+
+
+def register(name, batch_size=1):
+    """
+    Register ``handler(payloads)`` for tasks called ``name``. Up to
+    ``batch_size`` queued tasks are handed over in one call.
+    """
+    def decorator(handler):
+        HANDLERS[name] = (handler, batch_size)
+        return handler
+    return decorator
+
+
+def enqueue_many(jobs):
+    """Queue ``[(name, payload), ...]`` with a single INSERT."""
+    if not jobs:
+        return []
+    for name, _ in jobs:
+        if name not in HANDLERS:
+            raise ValueError(f"Unknown task: {name}")
+
+    tasks = Task.objects.bulk_create([Task(name=name, payload=payload) for name, payload in jobs])
+    if TASKS_EAGER:
+        transaction.on_commit(drain)
+    return tasks
+
+
+def enqueue(name, payload):
+    return enqueue_many([(name, payload)])[0]
+
+
+def _claim(limit):
+    now = timezone.now()
+    with transaction.atomic():
+        # skip_locked lets several workers poll one Postgres table; SQLite
+        # ignores it and serialises writers anyway
+        tasks = list(
+            Task.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=Task.PENDING, run_after__lte=now)
+            .order_by("id")[:limit]
+        )
+        if tasks:
+            Task.objects.filter(id__in=[task.id for task in tasks]).update(
+                status=Task.RUNNING,
+                started_at=now,
+                attempts=F("attempts") + 1
+            )
+    for task in tasks:
+        task.started_at = now
+        task.attempts += 1
+    return tasks
+
+
+def _record(name, tasks, run_ms, failed):
+    wait_ms = sum((task.started_at - task.created_at).total_seconds() * 1000 for task in tasks)
+    with _stats_lock:
+        entry = _stats[name]
+        entry["count"] += len(tasks)
+        entry["batches"] += 1
+        entry["failed"] += len(tasks) if failed else 0
+        entry["run_ms"] += run_ms
+        entry["max_run_ms"] = max(entry["max_run_ms"], run_ms)
+        entry["wait_ms"] += wait_ms
+    logger.info(
+        "task %s x%d %s in %.1fms (avg wait %.1fms)",
+        name, len(tasks), "failed" if failed else "ran", run_ms, wait_ms / len(tasks)
+    )
+
+
+def _run_batch(name, tasks):
+    handler, _ = HANDLERS[name]
+    start = time.perf_counter()
+    try:
+        handler([task.payload for task in tasks])
+    except Exception as e:
+        run_ms = (time.perf_counter() - start) * 1000
+        _record(name, tasks, run_ms, failed=True)
+        logger.warning("Task %s failed", name, exc_info=True)
+
+        ids = [task.id for task in tasks]
+        attempts = max(task.attempts for task in tasks)
+        if attempts >= TASK_MAX_ATTEMPTS:
+            Task.objects.filter(id__in=ids).update(
+                status=Task.FAILED, error=repr(e), finished_at=timezone.now()
+            )
+        else:
+            delay = TASK_RETRY_DELAY * 2 ** (attempts - 1)
+            Task.objects.filter(id__in=ids).update(
+                status=Task.PENDING, error=repr(e), run_after=timezone.now() + timedelta(seconds=delay)
+            )
+        return
+
+    run_ms = (time.perf_counter() - start) * 1000
+    _record(name, tasks, run_ms, failed=False)
+    Task.objects.filter(id__in=[task.id for task in tasks]).update(
+        status=Task.DONE, finished_at=timezone.now()
+    )
+
+
+def run_pending(limit=TASK_BATCH_SIZE):
+    """Claim and run up to ``limit`` due tasks; returns how many ran."""
+    tasks = _claim(limit)
+
+    by_name = defaultdict(list)
+    for task in tasks:
+        by_name[task.name].append(task)
+
+    for name, group in by_name.items():
+        if name not in HANDLERS:
+            Task.objects.filter(id__in=[task.id for task in group]).update(
+                status=Task.FAILED, error="unknown task", finished_at=timezone.now()
+            )
+            continue
+        batch_size = HANDLERS[name][1]
+        for i in range(0, len(group), batch_size):
+            _run_batch(name, group[i:i + batch_size])
+
+    return len(tasks)
+
+
+def drain(limit=TASK_BATCH_SIZE):
+    """Run every due task in this thread (eager mode and tests)."""
+    total = 0
+    while True:
+        ran = run_pending(limit)
+        if not ran:
+            return total
+        total += ran
+
+
+def release_stale():
+    """Requeue tasks whose worker died mid-run, drop old finished rows."""
+    now = timezone.now()
+    Task.objects.filter(
+        status=Task.RUNNING, started_at__lt=now - timedelta(seconds=TASK_TIMEOUT)
+    ).update(status=Task.PENDING)
+    Task.objects.filter(
+        status__in=[Task.DONE, Task.FAILED], finished_at__lt=now - timedelta(seconds=TASK_RETENTION)
+    ).delete()
+
+
+def stats():
+    with _stats_lock:
+        return {
+            name: {
+                "count": entry["count"],
+                "failed": entry["failed"],
+                "batches": entry["batches"],
+                "avg_run_ms": entry["run_ms"] / max(entry["batches"], 1),
+                "max_run_ms": entry["max_run_ms"],
+                "avg_wait_ms": entry["wait_ms"] / max(entry["count"], 1),
+            }
+            for name, entry in _stats.items()
+        }
+
+
+# ----------------------------------------------------------------------
+# Post-reply work
+# ----------------------------------------------------------------------
+
+@register("chat.summary")
+def update_summaries(payloads):
+    from .summary import refresh_summary
+
+    for session_id in dict.fromkeys(payload["session_id"] for payload in payloads):
+        session = ChatSession.objects.filter(id=session_id).first()
+        if session is not None:
+            refresh_summary(session)
+
+
+@register("chat.title")
+def generate_titles(payloads):
+    from .titles import generate_title
+
+    for payload in payloads:
+        generate_title(payload["session_id"], payload["message"])
+
+
+@register("memory.index", batch_size=64)
+def index_memories(payloads):
+    """Embed messages from many sessions in one call, then store per user."""
+    import numpy as np
+
+    from rag.embedder import embed_texts
+
+    from .memory import add_to_memory
+
+    payloads = [payload for payload in payloads if payload["text"].strip()]
+    if not payloads:
+        return
+
+    vectors = embed_texts([payload["text"] for payload in payloads])
+
+    groups = defaultdict(list)
+    for i, payload in enumerate(payloads):
+        groups[(payload["user_id"], payload.get("session_id"))].append(i)
+    for (user_id, session_id), positions in groups.items():
+        add_to_memory(
+            user_id,
+            [payloads[i]["text"] for i in positions],
+            session=session_id,
+            vectors=np.asarray(vectors)[positions],
+        )
+
+
+def schedule_post_reply(session, user_message, window, new_title=False):
+    """
+    Queue the work that used to follow a reply on the request path: memory
+    indexing, the title of a new session (``new_title``) and (when due)
+    the summary.
+    """
+    from .summary import summary_due
+
+    jobs = [("memory.index", {"user_id": session.user_id, "session_id": session.id, "text": user_message})]
+    if new_title:
+        jobs.append(("chat.title", {"session_id": session.id, "message": user_message}))
+    if summary_due(session, window):
+        jobs.append(("chat.summary", {"session_id": session.id}))
+    return enqueue_many(jobs)
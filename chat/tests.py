@@ -1,3 +1,1334 @@
+import asyncio
+import hashlib
+import importlib.util
+import io
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import json
+import mmap
+import struct
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from rag.batching import MicroBatcher
+from rag.bm25 import BM25Index
+from rag.build_embeddings import build, check, load_previous
+from rag.chunker import chunk_text, count_tokens
+from rag.embedder import EMBEDDING_ONNX_DIR, mean_pool
+from rag.embedding_cache import EmbeddingCache, SQLiteTier
+from rag.rag_utils import retrieve_knowledge
+from rag.index_spec import factory_string, make_spec, new_index, reconstruct_all, same_structure, train
+from rag.store import KnowledgeStore, file_hash, read_manifest, write_artifact
+
+from . import memory, metrics
+from .context import CONTEXT_WINDOW, append_to_window, load_window
+from .llm import LLMError, LLMGateway
+from .memory import add_to_memory, retrieve_memory
+from .models import ChatMessage, ChatSession, MemoryItem, Task
+from .pagination import keyset_page
+from .persistence import save_turn
+from .prompt import PromptBuilder
+from .response_cache import ResponseCache, is_personal
+from .safety import CRISIS_MARKER, CRISIS_RESPONSE, MISSPELLINGS, CrisisDetector, is_crisis, load_phrases, normalize
+from .summary import SUMMARY_FOLD, SUMMARY_KEEP, refresh_summary
+from .tasks import HANDLERS, TASK_MAX_ATTEMPTS, drain, enqueue, enqueue_many, register, schedule_post_reply, stats
+from .views import ChatAPIView
+from .warmup import HEAVY_MODULES, IMPORT_BUDGET_MS, warm_up
+
+
+class ContextWindowTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("alice", password="pw")
+        self.session = ChatSession.objects.create(user=self.user)
+        self.total = CONTEXT_WINDOW + 4
+        for i in range(self.total):
+            ChatMessage.objects.create(
+                session=self.session,
+                role="user" if i % 2 == 0 else "bot",
+                content=f"message {i}",
+            )
+
+    def test_loads_latest_messages_oldest_first(self):
+        window = load_window(self.session.id)
+        self.assertEqual(
+            [msg["content"] for msg in window],
+            [f"message {i}" for i in range(self.total - CONTEXT_WINDOW, self.total)],
+        )
+
+    def test_crisis_turns_are_left_out(self):
+        save_turn(self.session, [("user", "I want to kill myself"), ("bot", CRISIS_MARKER)])
+        window = load_window(self.session.id)
+        self.assertEqual(
+            [msg["content"] for msg in window],
+            [f"message {i}" for i in range(self.total - CONTEXT_WINDOW, self.total)],
+        )
+        cache.clear()
+        self.assertEqual(load_window(self.session.id), window)
+
+    def test_cached_window_costs_one_lookup(self):
+        with self.assertNumQueries(2):
+            load_window(self.session.id)
+        # Only the newest-id check, the rows come from the cache
+        with self.assertNumQueries(2):
+            load_window(self.session.id)
+            load_window(self.session.id, n=4)
+
+    def test_writes_update_cached_window(self):
+        load_window(self.session.id)
+        message = ChatMessage.objects.create(session=self.session, role="user", content="newest")
+        with self.assertNumQueries(0):
+            append_to_window(message)
+        with self.assertNumQueries(1):
+            window = load_window(self.session.id)
+        self.assertEqual(window[-1]["content"], "newest")
+        self.assertEqual(len(window), CONTEXT_WINDOW)
+        cache.clear()
+        self.assertEqual(window, load_window(self.session.id))
+
+    def test_messages_saved_by_another_worker_are_seen(self):
+        load_window(self.session.id)
+        # Written elsewhere, so this process's cache never heard of it
+        ChatMessage.objects.create(session=self.session, role="user", content="from another worker")
+        self.assertEqual(load_window(self.session.id)[-1]["content"], "from another worker")
+
+    def test_crisis_turns_keep_the_cache_valid(self):
+        load_window(self.session.id)
+        append_to_window(ChatMessage.objects.create(session=self.session, role="user", content="I want to kill myself"))
+        append_to_window(ChatMessage.objects.create(session=self.session, role="bot", content=CRISIS_MARKER))
+        with self.assertNumQueries(1):
+            window = load_window(self.session.id)
+        self.assertEqual(window[-1]["content"], f"message {self.total - 1}")
+        self.assertNotIn("I want to kill myself", [msg["content"] for msg in window])
+
+
+class ChatAPIViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("bob", password="pw")
+        self.session = ChatSession.objects.create(user=self.user)
+        other = ChatSession.objects.create(user=User.objects.create_user("eve", password="pw"))
+        ChatMessage.objects.create(session=other, role="user", content="someone else's secret")
+
+    def post(self, data):
+        request = APIRequestFactory().post("/chat/api/", data, format="json")
+        force_authenticate(request, user=self.user)
+        return async_to_sync(ChatAPIView.as_view())(request)
+
+    def test_context_is_scoped_to_session(self):
+        gateway = mock.Mock()
+        gateway.acomplete = mock.AsyncMock(return_value="hello")
+        with mock.patch("chat.views.get_gateway", return_value=gateway):
+            self.post({"message": "hi", "session_id": self.session.id})
+            # Session lookup; the turn (savepoint, one INSERT for both
+            # messages, one session UPDATE, release); the queued post-reply
+            # tasks. The window comes from the cache, checked against the
+            # newest message id before and after the turn.
+            with self.assertNumQueries(8):
+                response = self.post({"message": "again", "session_id": self.session.id})
+
+        self.assertEqual(response.data["session_id"], self.session.id)
+        prompt = [msg["content"] for msg in gateway.acomplete.call_args[0][0]]
+        self.assertEqual(prompt[-3:], ["hi", "hello", "again"])
+        self.assertNotIn("someone else's secret", prompt)
+
+    def test_routed_and_login_required(self):
+        url = reverse("chat_api")
+        self.assertEqual(url, "/chat/api/")
+        self.assertIn(self.client.post(url, {"message": "hi"}, content_type="application/json").status_code, (401, 403))
+
+        gateway = mock.Mock()
+        gateway.acomplete = mock.AsyncMock(return_value="hello")
+        self.client.force_login(self.user)
+        with mock.patch("chat.views.get_gateway", return_value=gateway):
+            response = self.client.post(url, {"message": "hi", "session_id": self.session.id}, content_type="application/json")
+        self.assertEqual(response.json(), {"reply": "hello", "session_id": self.session.id})
+
+    def test_related_memories_from_other_sessions_are_recalled(self):
+        memory._cache.clear()
+        older = ChatSession.objects.create(user=self.user)
+        axes = np.eye(384, dtype="float32")
+        add_to_memory(self.user, "My dog Max helps me calm down", session=older, vectors=axes[:1])
+        add_to_memory(self.user, "I like rainy days", session=older, vectors=axes[1:2])
+        add_to_memory(self.user, "Already in this session", session=self.session, vectors=axes[:1])
+
+        gateway = mock.Mock()
+        gateway.acomplete = mock.AsyncMock(return_value="hello")
+        with mock.patch("chat.views.get_gateway", return_value=gateway), \
+                mock.patch("chat.memory.embed_texts", return_value=axes[:1]):
+            self.post({"message": "How do I calm down?", "session_id": self.session.id})
+
+        prompt = "\n".join(msg["content"] for msg in gateway.acomplete.call_args[0][0])
+        self.assertIn("- My dog Max helps me calm down", prompt)
+        self.assertNotIn("rainy days", prompt)
+        self.assertNotIn("Already in this session", prompt)
+
+
+class FakeProvider:
+    """Plays back ``outcomes``: an LLMError to raise, else the reply text."""
+
+    def __init__(self, *outcomes, delay=0.0, tokens_before_error=()):
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.tokens_before_error = tokens_before_error
+        self.calls = 0
+        self.active = self.peak = 0
+
+    async def complete(self, messages, model, **params):
+        self.calls += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+            if isinstance(outcome, LLMError):
+                raise outcome
+            return outcome
+        finally:
+            self.active -= 1
+
+    async def stream(self, messages, model, **params):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, LLMError):
+            for token in self.tokens_before_error:
+                yield token
+            raise outcome
+        for token in outcome.split():
+            yield token
+
+
+class LLMGatewayTests(TestCase):
+    def gateway(self, provider, **kwargs):
+        kwargs = {"timeout": 5, "max_retries": 2, "backoff_base": 0.001, **kwargs}
+        gateway = LLMGateway(provider, **kwargs)
+        self.addCleanup(gateway.loop.call_soon_threadsafe, gateway.loop.stop)
+        return gateway
+
+    @staticmethod
+    def error(status_code, retry_after=None):
+        return LLMError(f"HTTP {status_code}", status_code=status_code,
+                        retryable=status_code == 429 or status_code >= 500, retry_after=retry_after)
+
+    def stream(self, gateway):
+        async def collect():
+            tokens = []
+            try:
+                async for token in gateway.astream([{"role": "user", "content": "hi"}]):
+                    tokens.append(token)
+            except LLMError as e:
+                return tokens, e
+            return tokens, None
+        return async_to_sync(collect)()
+
+    def test_retries_rate_limits_and_server_errors(self):
+        provider = FakeProvider(self.error(429), self.error(503), "better now")
+        self.assertEqual(self.gateway(provider).complete([]), "better now")
+        self.assertEqual(provider.calls, 3)
+
+    def test_client_errors_are_not_retried(self):
+        provider = FakeProvider(self.error(400), "never")
+        with self.assertRaises(LLMError):
+            self.gateway(provider).complete([])
+        self.assertEqual(provider.calls, 1)
+
+    def test_gives_up_after_max_retries(self):
+        provider = FakeProvider(*[self.error(503)] * 5)
+        with self.assertRaises(LLMError):
+            self.gateway(provider, max_retries=2).complete([])
+        self.assertEqual(provider.calls, 3)
+
+    def test_retry_after_is_honoured(self):
+        provider = FakeProvider(self.error(429, retry_after=0.2), "ok")
+        start = time.monotonic()
+        self.gateway(provider).complete([])
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+        # A wait past the deadline fails now instead of sleeping
+        provider = FakeProvider(self.error(429, retry_after=10), "ok")
+        with self.assertRaises(LLMError):
+            self.gateway(provider, timeout=1).complete([])
+        self.assertEqual(provider.calls, 1)
+
+    def test_deadline_covers_the_whole_call(self):
+        provider = FakeProvider(delay=2)
+        start = time.monotonic()
+        with self.assertRaisesRegex(LLMError, "deadline"):
+            self.gateway(provider, timeout=0.1).complete([])
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_concurrency_is_capped(self):
+        provider = FakeProvider(delay=0.05)
+        gateway = self.gateway(provider, max_concurrency=2)
+
+        async def burst():
+            return await asyncio.gather(*(gateway.acomplete([]) for _ in range(6)))
+
+        self.assertEqual(async_to_sync(burst)(), ["ok"] * 6)
+        self.assertEqual(provider.peak, 2)
+
+    def test_stream_retries_only_before_the_first_token(self):
+        provider = FakeProvider(self.error(503), "hello there")
+        self.assertEqual(self.stream(self.gateway(provider)), (["hello", "there"], None))
+        self.assertEqual(provider.calls, 2)
+
+        provider = FakeProvider(self.error(503), "hello there", tokens_before_error=["partial"])
+        tokens, error = self.stream(self.gateway(provider))
+        self.assertEqual((tokens, error.status_code), (["partial"], 503))
+        self.assertEqual(provider.calls, 1)
+
+
+class PromptBuilderTests(TestCase):
+    def setUp(self):
+        # One token per word keeps the arithmetic readable
+        self.builder = PromptBuilder(budget=100, knowledge_share=0.4, counter=lambda text: len(text.split()))
+
+    def test_keeps_newest_history_within_budget(self):
+        history = [{"role": "user", "content": f"turn {i} " + "word " * 8} for i in range(10)]
+        messages = self.builder.build("question", system="be kind", history=history)
+
+        self.assertLessEqual(self.builder.tokens, 100)
+        self.assertLess(len(messages), len(history) + 2)
+        self.assertEqual(messages[0]["content"], "be kind")
+        self.assertEqual(messages[-1]["content"], "question")
+        kept = [msg["content"] for msg in messages[1:-1]]
+        self.assertTrue(kept)
+        self.assertEqual(kept, [msg["content"] for msg in history[-len(kept):]])
+
+    def test_knowledge_limited_to_its_share(self):
+        chunks = ["tip " * 10, "tip " * 10, "tip " * 10]
+        messages = self.builder.build("question", system="be kind", knowledge=chunks)
+        self.assertEqual(messages[1]["content"].count("tip"), 20)
+
+    def test_memories_come_before_history(self):
+        history = [{"role": "user", "content": "word " * 20} for _ in range(10)]
+        messages = self.builder.build("question", system="be kind", memories=["has a dog", "word " * 200], history=history)
+        self.assertEqual(messages[1]["content"], "From earlier conversations with this user:\n- has a dog")
+        self.assertLessEqual(self.builder.tokens, 100)
+
+
+class SummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user("carol", password="pw")
+        self.session = ChatSession.objects.create(user=user)
+
+    def add_messages(self, count):
+        for i in range(count):
+            append_to_window(ChatMessage.objects.create(session=self.session, role="user", content=f"m{i}"))
+
+    def test_summary_is_computed_once_and_reused(self):
+        self.add_messages(SUMMARY_KEEP + SUMMARY_FOLD - 1)
+        gateway = mock.Mock()
+        gateway.complete.return_value = "They feel stressed about exams."
+
+        with mock.patch("chat.summary.get_gateway", return_value=gateway):
+            self.assertFalse(refresh_summary(self.session))
+            self.add_messages(1)
+            self.assertTrue(refresh_summary(self.session))
+            # Folded turns are not summarized again on the next turn; only
+            # the cached window's newest-id check runs
+            with self.assertNumQueries(1):
+                self.assertFalse(refresh_summary(self.session))
+
+        self.assertEqual(gateway.complete.call_count, 1)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, "They feel stressed about exams.")
+        window = load_window(self.session.id)
+        self.assertEqual(len([m for m in window if m["id"] > self.session.summary_upto]), SUMMARY_KEEP)
+
+    def test_turns_that_left_the_window_are_still_folded(self):
+        # The worker fell behind: far more turns than the window holds
+        self.add_messages(SUMMARY_KEEP + 3 * SUMMARY_FOLD)
+        gateway = mock.Mock()
+        gateway.complete.side_effect = ["one", "two", "three"]
+
+        with mock.patch("chat.summary.get_gateway", return_value=gateway):
+            self.assertTrue(refresh_summary(self.session))
+
+        folded = [call.args[0][1]["content"] for call in gateway.complete.call_args_list]
+        self.assertEqual(len(folded), 3)
+        self.assertIn("user: m0\n", folded[0])
+        self.assertIn("Summary so far:\ntwo", folded[2])
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, "three")
+        self.assertEqual(ChatMessage.objects.filter(session=self.session, id__gt=self.session.summary_upto).count(), SUMMARY_KEEP)
+
+    def test_llm_errors_leave_the_task_to_be_retried(self):
+        self.add_messages(SUMMARY_KEEP + SUMMARY_FOLD)
+        task = enqueue("chat.summary", {"session_id": self.session.id})
+        gateway = mock.Mock()
+        gateway.complete.side_effect = LLMError("upstream down", status_code=503, retryable=True)
+
+        with mock.patch("chat.summary.get_gateway", return_value=gateway):
+            drain()
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.PENDING, 1))
+        self.assertIn("upstream down", task.error)
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.summary, self.session.summary_upto), ("", 0))
+
+
+class MemoryTests(TestCase):
+    def setUp(self):
+        memory._cache.clear()
+        self.axes = np.eye(384, dtype="float32")
+        self.user = User.objects.create_user("jack", password="pw")
+        self.sessions = [ChatSession.objects.create(user=self.user) for _ in range(2)]
+
+    def add(self, text, axis, user=None, session=None, importance=0.0):
+        return add_to_memory(user or self.user, text, session=session, importance=importance,
+                             vectors=self.axes[axis:axis + 1])
+
+    def recall(self, axis, **kwargs):
+        with mock.patch("chat.memory.embed_texts", return_value=self.axes[axis:axis + 1]):
+            return retrieve_memory(self.user, "query", **kwargs)
+
+    def test_most_similar_first(self):
+        self.add("about sleep", 0)
+        self.add("about work", 1)
+        with mock.patch("chat.memory.embed_texts", return_value=[self.axes[0] + 0.5 * self.axes[1]]):
+            self.assertEqual(retrieve_memory(self.user, "query", k=2), ["about sleep", "about work"])
+
+    def test_users_are_isolated(self):
+        self.add("mine", 0)
+        self.add("theirs", 0, user=User.objects.create_user("kim", password="pw"))
+        self.assertEqual(self.recall(0, k=5), ["mine"])
+
+    def test_session_filters(self):
+        first, second = self.sessions
+        self.add("first session", 0, session=first)
+        self.add("second session", 0, session=second)
+        self.assertEqual(self.recall(0, k=5, session=first), ["first session"])
+        self.assertEqual(self.recall(0, k=5, exclude_session=first), ["second session"])
+        self.assertEqual(self.recall(1, k=5, min_score=0.5), [])
+
+    def test_capacity_evicts_least_important_then_oldest(self):
+        with mock.patch("chat.memory.MEMORY_CAPACITY", 3):
+            self.add("important", 0, importance=1.0)
+            self.add("old", 1)
+            self.add("newer", 2)
+            self.add("newest", 3)
+
+        self.assertEqual(sorted(MemoryItem.objects.filter(user=self.user).values_list("text", flat=True)),
+                         ["important", "newer", "newest"])
+        # The cached snapshot dropped it too, and a fresh load agrees
+        self.assertEqual(self.recall(1, k=5, min_score=0.5), [])
+        memory._cache.clear()
+        self.assertEqual(len(self.recall(0, k=5)), 3)
+
+    def test_snapshot_follows_writes_without_reloading(self):
+        self.add("first", 0)
+        self.recall(0)
+        self.add("second", 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.recall(1, k=1), ["second"])
+
+    def test_snapshot_read_during_a_write_is_not_cached(self):
+        load = memory.UserMemory.load
+
+        def load_racing_a_write(user_id):
+            snapshot = load(user_id)
+            self.add("written meanwhile", 1)
+            return snapshot
+
+        self.add("first", 0)
+        with mock.patch.object(memory.UserMemory, "load", side_effect=load_racing_a_write):
+            self.assertEqual(self.recall(1, k=1, min_score=0.5), [])
+        self.assertEqual(self.recall(1, k=1, min_score=0.5), ["written meanwhile"])
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("dave", password="pw")
+        self.sessions = [ChatSession.objects.create(user=self.user) for _ in range(3)]
+
+    def test_post_reply_work_is_deferred(self):
+        session = self.sessions[0]
+        schedule_post_reply(session, "exam stress is getting to me", [])
+        self.assertFalse(MemoryItem.objects.exists())
+
+        with mock.patch("rag.embedder.embed_texts", side_effect=lambda texts: np.ones((len(texts), 384), dtype="float32")):
+            self.assertEqual(drain(), 1)
+
+        self.assertEqual(MemoryItem.objects.get(user=self.user).text, "exam stress is getting to me")
+        self.assertFalse(Task.objects.exclude(status=Task.DONE).exists())
+        self.assertEqual(stats()["memory.index"]["failed"], 0)
+
+    def test_first_turn_title_is_generated_later(self):
+        from .views_ui import finish_turn
+
+        session = self.sessions[0]
+        finish_turn(session, "I can't stop worrying about my exams", "That sounds hard.")
+        finish_turn(session, "They start next week", "Let's plan for it.")
+        self.assertEqual(ChatSession.objects.get(id=session.id).title, "I can't stop worrying about my")
+        self.assertEqual(Task.objects.filter(name="chat.title").count(), 1)
+
+        gateway = mock.Mock()
+        gateway.complete.return_value = '"Exam worries"'
+        with mock.patch("chat.titles.get_gateway", return_value=gateway), \
+                mock.patch("rag.embedder.embed_texts", side_effect=lambda texts: np.ones((len(texts), 384), dtype="float32")):
+            drain()
+
+        self.assertEqual(gateway.complete.call_args[0][0][1]["content"], "I can't stop worrying about my exams")
+        self.assertEqual(ChatSession.objects.get(id=session.id).title, "Exam worries")
+        self.assertFalse(Task.objects.exclude(status=Task.DONE).exists())
+
+    def test_memory_is_embedded_in_one_batch_across_sessions(self):
+        enqueue_many([
+            ("memory.index", {"user_id": self.user.id, "session_id": session.id, "text": f"note {i}"})
+            for i, session in enumerate(self.sessions)
+        ])
+        embed = mock.Mock(side_effect=lambda texts: np.ones((len(texts), 384), dtype="float32"))
+        with mock.patch("rag.embedder.embed_texts", embed):
+            drain()
+
+        embed.assert_called_once_with(["note 0", "note 1", "note 2"])
+        self.assertEqual(MemoryItem.objects.filter(user=self.user).count(), 3)
+
+    def test_failing_task_is_retried_then_marked_failed(self):
+        register("test.fail")(mock.Mock(side_effect=RuntimeError("boom")))
+        self.addCleanup(HANDLERS.pop, "test.fail")
+        task = enqueue("test.fail", {})
+
+        for _ in range(TASK_MAX_ATTEMPTS):
+            Task.objects.filter(id=task.id).update(run_after=task.created_at)
+            drain()
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertEqual(task.attempts, TASK_MAX_ATTEMPTS)
+        self.assertIn("boom", task.error)
+
+
+class SafetyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ivy", password="pw")
+        self.session = ChatSession.objects.create(user=self.user)
+        self.gateway = mock.Mock()
+        self.gateway.acomplete = mock.AsyncMock(return_value="should not be used")
+
+    def test_normalization(self):
+        self.assertEqual(normalize("I WANT to Díe!!"), "i want to die")
+        self.assertEqual(normalize("don’t  want to live..."), "dont want to live")
+        self.assertEqual(normalize("kiiiill myself"), normalize("kill myself"))
+        for text in ["I want to KILL MYSELF", "kill—myself", "I'm suicídal", "kiiiill myself", "I don’t want to live"]:
+            self.assertTrue(is_crisis(text), text)
+
+    def test_misspellings_match(self):
+        for keyword, variants in MISSPELLINGS.items():
+            for variant in variants:
+                self.assertTrue(is_crisis(f"honestly {variant} tonight"), variant)
+
+    def test_new_phrases(self):
+        for text in ["I just don't want to live anymore", "ngl i might kms", "thinking about how to unalive myself"]:
+            self.assertTrue(is_crisis(text), text)
+
+    def test_whole_words_only(self):
+        for text in ["I need to skill myself up", "that's a killer app", "I want to diet", "my suicidesque playlist"]:
+            self.assertFalse(is_crisis(text), text)
+
+    def test_phrases_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("# extra phrases\nno way out\n\n")
+        self.addCleanup(os.remove, f.name)
+        with mock.patch("chat.safety.CRISIS_PHRASES_FILE", f.name):
+            detector = CrisisDetector(load_phrases())
+        self.assertEqual(detector.find("There's NO way out for me"), "no way out")
+        self.assertNotIn("extra phrases", detector.phrases)
+
+    def assert_crisis_turn_saved(self, bot_content):
+        self.gateway.acomplete.assert_not_called()
+        self.gateway.astream.assert_not_called()
+        self.assertEqual(
+            list(ChatMessage.objects.filter(session=self.session).values_list("role", "content").order_by("id")),
+            [("user", "I want to kill myself"), ("bot", bot_content)],
+        )
+
+    def test_chat_page_short_circuits(self):
+        self.client.force_login(self.user)
+        with mock.patch("chat.views_ui.get_gateway", return_value=self.gateway):
+            response = self.client.post(reverse("chat_page", args=[self.session.id]), {"message": "I want to kill myself"})
+        self.assertEqual(response.status_code, 302)
+        self.assert_crisis_turn_saved(CRISIS_MARKER)
+
+        # Shown as the response, never as the marker
+        page = self.client.get(reverse("chat_page", args=[self.session.id])).content.decode()
+        self.assertIn("Suicide Prevention Helpline", page)
+        self.assertNotIn(CRISIS_MARKER, page)
+        history = self.client.get(reverse("message_history", args=[self.session.id])).json()["messages"]
+        self.assertEqual(history[-1]["content"], CRISIS_RESPONSE.strip())
+
+    def test_chat_stream_short_circuits(self):
+        self.client.force_login(self.user)
+        with mock.patch("chat.views_ui.get_gateway", return_value=self.gateway):
+            response = self.client.post(reverse("chat_stream", args=[self.session.id]), {"message": "I want to kill myself"})
+
+            async def read():
+                return b"".join([chunk async for chunk in response.streaming_content]).decode()
+            body = async_to_sync(read)()
+        self.assertIn(json.dumps({"token": CRISIS_RESPONSE.strip()}), body)
+        self.assert_crisis_turn_saved(CRISIS_MARKER)
+
+    def test_api_short_circuits(self):
+        request = APIRequestFactory().post(
+            "/chat/api/", {"message": "I want to kill myself", "session_id": self.session.id}, format="json"
+        )
+        force_authenticate(request, user=self.user)
+        with mock.patch("chat.views.get_gateway", return_value=self.gateway):
+            response = async_to_sync(ChatAPIView.as_view())(request)
+        self.assertEqual(response.data["reply"], CRISIS_RESPONSE)
+        self.assert_crisis_turn_saved(CRISIS_MARKER)
+
+
+class EmbeddingCacheTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.vectors = np.eye(4, dtype="float32")
+
+    def clock(self):
+        return self.now
+
+    def cache(self, **kwargs):
+        return EmbeddingCache(**{"max_entries": 2, "ttl": 60, "path": None, "clock": self.clock, **kwargs})
+
+    def test_lru_eviction_at_capacity(self):
+        embedding_cache = self.cache()
+        embedding_cache.put_many(["a", "b"], self.vectors[:2])
+        embedding_cache.get_many(["a"])  # "b" is now least recently used
+        embedding_cache.put_many(["c"], self.vectors[2:3])
+
+        found, missing = embedding_cache.get_many(["a", "b", "c"])
+        self.assertEqual((sorted(found), missing), ([0, 2], [1]))
+        np.testing.assert_array_equal(found[2], self.vectors[2])
+        self.assertEqual(embedding_cache.stats()["evictions"], 1)
+
+    def test_ttl_expiry(self):
+        embedding_cache = self.cache()
+        embedding_cache.put_many(["a"], self.vectors[:1])
+        self.now += 59
+        self.assertEqual(embedding_cache.get_many(["a"])[1], [])
+        self.now += 2
+        self.assertEqual(embedding_cache.get_many(["a"])[1], [0])
+        self.assertEqual(embedding_cache.stats()["size"], 0)
+
+    def test_normalized_text_and_stats(self):
+        embedding_cache = self.cache()
+        embedding_cache.put_many(["Hello   World"], self.vectors[:1])
+        found, missing = embedding_cache.get_many(["hello world", "other", "HELLO WORLD"])
+        self.assertEqual((sorted(found), missing), ([0, 2], [1]))
+        stats = embedding_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["disk_hits"], stats["evictions"]), (2, 1, 0, 0))
+
+    def test_sqlite_tier(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "embeddings.sqlite3")
+            self.cache(path=path, namespace="model-a").put_many(["a"], self.vectors[1:2])
+
+            # A fresh worker finds it on disk, then in memory
+            worker = self.cache(path=path, namespace="model-a")
+            found, missing = worker.get_many(["a"])
+            np.testing.assert_array_equal(found[0], self.vectors[1])
+            worker.get_many(["a"])
+            self.assertEqual((worker.stats()["disk_hits"], worker.stats()["hits"]), (1, 2))
+
+            # Other namespaces don't see it
+            self.assertEqual(self.cache(path=path, namespace="model-b").get_many(["a"])[1], [0])
+
+            # Expired rows are neither served nor kept
+            self.now += 61
+            self.assertEqual(self.cache(path=path, namespace="model-a").get_many(["a"])[1], [0])
+            tier = SQLiteTier(path, ttl=60, max_rows=2, clock=self.clock)
+            self.assertEqual(tier.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0], 0)
+
+    def test_sqlite_tier_is_bounded_like_the_lru(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tier = SQLiteTier(os.path.join(tmpdir, "embeddings.sqlite3"), ttl=60, max_rows=2,
+                              clock=self.clock, purge_every=3)
+
+            def count():
+                return tier.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+            for key, vector in zip("abc", self.vectors):
+                self.now += 1
+                tier.put_many([(key, vector)])
+            # Trimmed on the third write, keeping the newest rows
+            self.assertEqual(count(), 2)
+            self.assertEqual(sorted(tier.get_many(["a", "b", "c"])), ["b", "c"])
+
+            tier.put_many([("d", self.vectors[3])])
+            self.assertEqual(count(), 3)
+
+
+class ResponseCacheTests(TestCase):
+    def unit(self, *values):
+        vector = np.array(values, dtype="float32")
+        return vector / np.linalg.norm(vector)
+
+    def test_near_duplicate_with_same_chunks_hits(self):
+        response_cache = ResponseCache(max_entries=10, ttl=60, threshold=0.95)
+        response_cache.store(self.unit(1, 0, 0), [3, 1], "Try box breathing.", llm_ms=800)
+
+        self.assertEqual(response_cache.lookup(self.unit(1, 0.1, 0), [1, 3]), "Try box breathing.")
+        self.assertIsNone(response_cache.lookup(self.unit(1, 0.1, 0), [1, 4]))
+        self.assertIsNone(response_cache.lookup(self.unit(0, 1, 0), [1, 3]))
+        stats = response_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["saved_ms"]), (1, 2, 800))
+
+    def test_lru_and_ttl(self):
+        response_cache = ResponseCache(max_entries=2, ttl=60, threshold=0.95)
+        for i, vector in enumerate([self.unit(1, 0, 0), self.unit(0, 1, 0), self.unit(0, 0, 1)]):
+            response_cache.store(vector, [], f"reply {i}")
+        self.assertIsNone(response_cache.lookup(self.unit(1, 0, 0)))
+        self.assertEqual(response_cache.lookup(self.unit(0, 0, 1)), "reply 2")
+
+        response_cache.ttl = 0
+        self.assertIsNone(response_cache.lookup(self.unit(0, 0, 1)))
+
+    def test_personal_turns_are_not_cacheable(self):
+        self.assertFalse(is_personal("How do I stop a panic attack?"))
+        self.assertTrue(is_personal("My boyfriend left and I feel empty"))
+        self.assertTrue(is_personal("I’m scared of tomorrow"))
+
+    def test_turns_with_history_never_hit(self):
+        user = User.objects.create_user("hank", password="pw")
+        session = ChatSession.objects.create(user=user)
+        gateway = mock.Mock()
+        gateway.acomplete = mock.AsyncMock(return_value="Try box breathing.")
+
+        def post(message):
+            request = APIRequestFactory().post("/chat/api/", {"message": message, "session_id": session.id}, format="json")
+            force_authenticate(request, user=user)
+            return async_to_sync(ChatAPIView.as_view())(request).data["reply"]
+
+        with mock.patch("chat.response_cache.RESPONSE_CACHE_ENABLED", True), \
+                mock.patch("chat.response_cache._caches", {}), \
+                mock.patch("rag.embedder.embed_texts", return_value=[[1.0, 0.0, 0.0]]), \
+                mock.patch("chat.views.get_gateway", return_value=gateway):
+            post("How do I calm down before exams?")
+            # Same question, but now the session has history: ask the LLM
+            gateway.acomplete.return_value = "Since you mentioned exams, try this."
+            self.assertEqual(post("How do I calm down before exams?"), "Since you mentioned exams, try this.")
+
+        self.assertEqual(gateway.acomplete.call_count, 2)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("erin", password="pw")
+        self.session = ChatSession.objects.create(user=self.user)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=self.session, role="user", content=f"m{i}") for i in range(25)
+        ])
+        # Same timestamp everywhere: the id tie-break must still page cleanly
+        ChatMessage.objects.filter(session=self.session).update(created_at=self.session.created_at)
+        self.client.force_login(self.user)
+
+    def test_pages_cover_everything_once(self):
+        seen, cursor = [], None
+        while True:
+            rows, cursor = keyset_page(ChatMessage.objects.filter(session=self.session), cursor=cursor, page_size=10)
+            seen += [row.content for row in rows]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f"m{i}" for i in reversed(range(25))])
+
+    def test_history_endpoint_walks_back(self):
+        url = reverse("message_history", args=[self.session.id])
+        with mock.patch("chat.views_ui.MESSAGE_PAGE_SIZE", 10):
+            first = self.client.get(url).json()
+            second = self.client.get(url, {"before": first["next"]}).json()
+
+        self.assertEqual([m["content"] for m in first["messages"]], [f"m{i}" for i in range(15, 25)])
+        self.assertEqual([m["content"] for m in second["messages"]], [f"m{i}" for i in range(5, 15)])
+        self.assertEqual(self.client.get(url, {"before": "garbage"}).status_code, 400)
+
+    def test_page_render_does_not_grow_with_history(self):
+        url = reverse("chat_page", args=[self.session.id])
+        # auth session + user, chat session, one message page, one sidebar page
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["messages"]), 25)
+
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=self.session, role="bot", content="more") for _ in range(200)
+        ])
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["messages"]), 50)
+        self.assertTrue(response.context["older_cursor"])
+
+
+class SessionActivityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("finn", password="pw")
+        self.old, self.new = (ChatSession.objects.create(user=self.user) for _ in range(2))
+
+    def test_counts_preview_and_order_follow_writes(self):
+        ChatMessage.objects.create(session=self.old, role="user", content="first")
+        ChatMessage.objects.create(session=self.old, role="bot", content="reply " * 30)
+
+        self.old.refresh_from_db()
+        self.assertEqual(self.old.message_count, 2)
+        self.assertEqual(self.old.preview, ("reply " * 30)[:80])
+
+        self.client.force_login(self.user)
+        sessions = self.client.get(reverse("chat_page", args=[self.new.id])).context["sessions"]
+        self.assertEqual([s.id for s in sessions], [self.old.id, self.new.id])
+
+    def test_page_crisis_turn_keeps_the_preview(self):
+        ChatMessage.objects.create(session=self.old, role="bot", content="earlier reply")
+        self.client.force_login(self.user)
+        self.client.post(reverse("chat_page", args=[self.old.id]), {"message": "I want to kill myself"})
+
+        self.old.refresh_from_db()
+        self.assertEqual(self.old.message_count, 3)
+        self.assertEqual(self.old.preview, "I want to kill myself")
+
+    def test_one_update_per_message(self):
+        # INSERT + the F() UPDATE on the session row
+        with self.assertNumQueries(2):
+            ChatMessage.objects.create(session=self.new, role="user", content="hi")
+
+
+class PersistenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = ChatSession.objects.create(user=User.objects.create_user("gina", password="pw"))
+
+    def test_turn_is_one_insert_and_one_update(self):
+        load_window(self.session.id)
+        # savepoint, INSERT, UPDATE, release
+        with self.assertNumQueries(4):
+            save_turn(self.session, [("user", "hello"), ("bot", "hi there")], title="hello")
+
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.title, self.session.message_count, self.session.preview), ("hello", 2, "hi there"))
+        with self.assertNumQueries(1):
+            self.assertEqual([m["content"] for m in load_window(self.session.id)], ["hello", "hi there"])
+
+    def test_failed_turn_saves_nothing(self):
+        with mock.patch("chat.persistence.record_messages", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                save_turn(self.session, [("user", "hello"), ("bot", "hi there")])
+        self.assertFalse(ChatMessage.objects.exists())
+
+
+class KnowledgeStoreTests(TestCase):
+    records = [
+        {"id": 9, "source": "sleep.txt", "section": "Wind down", "position": 0, "content": "Dim the lights an hour before bed."},
+        {"id": 2, "source": "panic.txt", "section": "Step 1: Breathe", "position": 0, "content": "Inhale for 4, exhale for 6."},
+        {"id": 5, "source": "panic.txt", "section": "Step 2: Ground", "position": 1, "content": "Name five things you can see."},
+    ]
+
+    def write(self, out_dir):
+        vectors = np.eye(8, dtype="float32")[:3]
+        index = new_index(make_spec("flat"), 8)
+        index.add_with_ids(vectors, np.array([r["id"] for r in self.records], dtype="int64"))
+        return write_artifact(
+            index, self.records, "all-MiniLM-L6-v2", make_spec("flat"), {"sleep.txt": "a", "panic.txt": "b"},
+            next_id=10, out_dir=out_dir, chunker={"max_tokens": 128}, embedder={"precision": "fp32"},
+        )
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            manifest = self.write(out_dir)
+            self.assertEqual((manifest["version"], manifest["count"], manifest["next_id"]), (4, 3, 10))
+            self.assertEqual(sorted(os.listdir(out_dir)), ["bm25.npz", "chunks.bin", "index.faiss", "manifest.json"])
+
+            store = KnowledgeStore(out_dir)
+            self.assertIsInstance(store.chunks._mmap, mmap.mmap)
+            self.assertEqual(store.chunks.ids.tolist(), [2, 5, 9])
+            self.assertEqual(list(store.chunks), sorted(self.records, key=lambda r: r["id"]))
+            self.assertEqual(store.chunks.get(5)["section"], "Step 2: Ground")
+            with self.assertRaises(KeyError):
+                store.chunks.get(3)
+
+            # Row 1 of the index was added under id 2
+            hits = store.search(np.eye(8, dtype="float32")[1:2], k=2)[0]
+            self.assertEqual(hits[0]["id"], 2)
+            self.assertEqual(hits[0]["content"], "Inhale for 4, exhale for 6.")
+            self.assertEqual([hit["id"] for hit in store.keyword_search("lights before bed", 1)], [9])
+
+    def test_unreadable_versions_are_rejected(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            self.write(out_dir)
+            manifest_path = os.path.join(out_dir, "manifest.json")
+            manifest = read_manifest(out_dir)
+            with open(manifest_path, "w") as f:
+                json.dump(dict(manifest, version=2), f)
+            with self.assertRaisesRegex(ValueError, "version 2"):
+                KnowledgeStore(out_dir)
+
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f)
+            with open(os.path.join(out_dir, "chunks.bin"), "r+b") as f:
+                f.write(struct.pack("<4sI", b"RAGC", 99))
+            with self.assertRaisesRegex(ValueError, "Unsupported chunk file"):
+                KnowledgeStore(out_dir)
+
+
+class FakeEmbedder:
+    """Deterministic stand-in for the model: a random unit vector seeded by the text."""
+
+    name = "local"
+    precision = "fp32"
+
+    def __init__(self):
+        self.seen = []
+
+    def encode(self, texts):
+        self.seen += list(texts)
+        vectors = np.stack([
+            np.random.default_rng(int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)).random(384)
+            for text in texts
+        ]).astype("float32")
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class IncrementalBuildTests(TestCase):
+    files = {
+        "anxiety.txt": "Anxiety\n\nStep 1: Breathe\nInhale slowly.\n\nStep 2: Ground\nName five things you see.\n",
+        "sleep.txt": "Sleep\n\nStep 1: Wind down\nDim the lights.\n\nStep 2: No screens\nPut the phone away.\n",
+        "anger.txt": "Anger\n\nStep 1: Pause\nCount to ten.\n",
+    }
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.folder = os.path.join(tmpdir.name, "knowledge")
+        self.out_dir = os.path.join(tmpdir.name, "index")
+        os.makedirs(self.folder)
+        for name, text in self.files.items():
+            self.write(name, text)
+        self.embedder = FakeEmbedder()
+
+    def write(self, name, text):
+        with open(os.path.join(self.folder, name), "w") as f:
+            f.write(text)
+
+    def build(self, **kwargs):
+        self.embedder.seen = []
+        with mock.patch("rag.build_embeddings.load_embedder", return_value=self.embedder), \
+                mock.patch("rag.build_embeddings.EMBEDDING_BACKEND", "local"), mock.patch("builtins.print"):
+            build(out_dir=self.out_dir, folder=self.folder, max_tokens=12, **kwargs)
+        store = KnowledgeStore(self.out_dir)
+        ids, vectors = reconstruct_all(store.index)
+        return {chunk["id"]: chunk for chunk in store.chunks}, dict(zip(ids.tolist(), vectors))
+
+    def ids_of(self, chunks, source):
+        return {chunk_id for chunk_id, chunk in chunks.items() if chunk["source"] == source}
+
+    def test_unchanged_files_keep_ids_and_vectors(self):
+        chunks, vectors = self.build()
+        self.assertEqual(len(self.embedder.seen), len(chunks))
+        manifest = read_manifest(self.out_dir)
+
+        new_chunks, new_vectors = self.build()
+        self.assertEqual(self.embedder.seen, [])
+        self.assertEqual(new_chunks, chunks)
+        for chunk_id, vector in vectors.items():
+            np.testing.assert_array_equal(new_vectors[chunk_id], vector)
+        self.assertEqual(read_manifest(self.out_dir)["built_at"], manifest["built_at"])
+
+    def test_edited_file_re_embeds_only_changed_chunks(self):
+        chunks, vectors = self.build()
+        self.write("sleep.txt", self.files["sleep.txt"].replace("Put the phone away.", "Leave the phone in another room."))
+        new_chunks, new_vectors = self.build()
+
+        self.assertEqual(self.embedder.seen, ["Step 2: No screens\nLeave the phone in another room."])
+        for chunk_id in self.ids_of(chunks, "anxiety.txt") | self.ids_of(chunks, "anger.txt"):
+            self.assertEqual(new_chunks[chunk_id], chunks[chunk_id])
+            np.testing.assert_array_equal(new_vectors[chunk_id], vectors[chunk_id])
+        kept = self.ids_of(chunks, "sleep.txt") & self.ids_of(new_chunks, "sleep.txt")
+        self.assertEqual(len(kept), len(self.ids_of(chunks, "sleep.txt")) - 1)
+        # The new chunk gets a fresh id, never a reused one
+        self.assertGreater(max(self.ids_of(new_chunks, "sleep.txt") - kept), max(chunks))
+
+    def test_removed_file_drops_its_ids(self):
+        chunks, _ = self.build()
+        os.remove(os.path.join(self.folder, "anger.txt"))
+        new_chunks, new_vectors = self.build()
+
+        self.assertEqual(self.embedder.seen, [])
+        self.assertEqual(set(new_chunks), set(chunks) - self.ids_of(chunks, "anger.txt"))
+        self.assertEqual(set(new_vectors), set(new_chunks))
+        self.assertNotIn("anger.txt", read_manifest(self.out_dir)["file_hashes"])
+
+    def test_full_rebuild_re_embeds_everything(self):
+        chunks, _ = self.build()
+        self.build(full=True)
+        self.assertEqual(len(self.embedder.seen), len(chunks))
+
+    def test_streams_in_embedding_batches(self):
+        batches = []
+        encode = self.embedder.encode
+        self.embedder.encode = lambda texts: batches.append(len(texts)) or encode(texts)
+        # IVF has to be trained before it takes vectors, so they go through the spool
+        chunks, vectors = self.build(batch_size=2, spec_options={"index_type": "ivf", "nlist": 1})
+
+        self.assertLessEqual(max(batches), 2)
+        self.assertEqual(sum(batches), len(chunks))
+        self.assertEqual(set(vectors), set(chunks))
+        self.assertEqual(sorted(os.listdir(self.out_dir)), ["bm25.npz", "chunks.bin", "index.faiss", "manifest.json"])
+
+    def test_index_type_change_rebuilds_from_stored_vectors(self):
+        chunks, vectors = self.build()
+        new_chunks, new_vectors = self.build(spec_options={"index_type": "hnsw", "hnsw_m": 8})
+
+        self.assertEqual(read_manifest(self.out_dir)["index"]["type"], "hnsw")
+        self.assertEqual(self.embedder.seen, [])
+        self.assertEqual(new_chunks, chunks)
+        for chunk_id, vector in vectors.items():
+            np.testing.assert_array_equal(new_vectors[chunk_id], vector)
+
+        # HNSW can't delete in place: removing a file rebuilds it, still
+        # without re-embedding, and the spec is kept
+        os.remove(os.path.join(self.folder, "anger.txt"))
+        new_chunks, _ = self.build()
+        self.assertEqual(self.embedder.seen, [])
+        self.assertEqual(set(new_chunks), set(chunks) - self.ids_of(chunks, "anger.txt"))
+        self.assertEqual(read_manifest(self.out_dir)["index"], make_spec("hnsw", hnsw_m=8))
+
+
+class IndexSpecTests(TestCase):
+    def test_defaults_and_structure(self):
+        spec = make_spec("ivf", n=100000)
+        self.assertEqual(spec, {"type": "ivf", "nlist": 1264, "nprobe": 79})
+        self.assertEqual(factory_string(spec), "IDMap2,IVF1264,Flat")
+        # Few vectors: never more cells than can be trained
+        self.assertEqual(make_spec("ivf", n=100)["nlist"], 2)
+        self.assertEqual(make_spec("ivfpq", n=100, dimension=384)["pq_bits"], 4)
+        self.assertTrue(same_structure(spec, dict(spec, nprobe=1)))
+        self.assertFalse(same_structure(spec, dict(spec, nlist=256)))
+        with self.assertRaises(ValueError):
+            make_spec("annoy")
+
+    def store_for(self, spec):
+        vectors = np.random.default_rng(0).random((200, 16)).astype("float32")
+        index = new_index(spec, 16)
+        train(index, vectors)
+        index.add_with_ids(vectors, np.arange(200, dtype="int64"))
+        records = [{"id": i, "source": "x.txt", "content": f"chunk {i}"} for i in range(200)]
+        out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out_dir)
+        write_artifact(index, records, "all-MiniLM-L6-v2", spec, {}, 200, out_dir)
+        return KnowledgeStore(out_dir), vectors
+
+    def test_search_parameters_reach_the_wrapped_index(self):
+        import faiss
+
+        store, vectors = self.store_for(make_spec("ivf", nlist=4, nprobe=3))
+        self.assertEqual(faiss.extract_index_ivf(store.index).nprobe, 3)
+        self.assertEqual(store.search(vectors[7:8], 1)[0][0]["id"], 7)
+
+        store, vectors = self.store_for(make_spec("hnsw", hnsw_m=8, ef_search=77))
+        self.assertEqual(faiss.downcast_index(store.index.index).hnsw.efSearch, 77)
+        self.assertEqual(store.search(vectors[7:8], 1)[0][0]["id"], 7)
+
+
+class HybridRetrievalTests(TestCase):
+    records = [
+        {"id": 0, "source": "panic.txt", "content": "Panic attack: slow breathing, inhale for 4 seconds."},
+        {"id": 1, "source": "sleep.txt", "content": "Sleep routine: dim lights and avoid your phone before bed."},
+        {"id": 2, "source": "cbt.txt", "content": "Write the automatic thoughts and the evidence against them."},
+    ]
+
+    def store(self):
+        store = mock.Mock()
+        store.bm25 = BM25Index.build(self.records)
+        by_id = {record["id"]: record for record in self.records}
+        store.keyword_search = lambda query, k: [dict(by_id[i], bm25=s) for i, s in store.bm25.search(query, k)]
+        store.search.return_value = [[self.records[1], self.records[0]]]
+        return store
+
+    def test_bm25_ranks_and_round_trips(self):
+        index = BM25Index.build(self.records)
+        self.assertEqual([chunk_id for chunk_id, _ in index.search("panic breathing", 3)], [0])
+        self.assertEqual(index.search("unrelated words", 3), [])
+
+        buffer = io.BytesIO()
+        index.save(buffer)
+        buffer.seek(0)
+        self.assertEqual(BM25Index.load(buffer).search("phone at bed", 3), index.search("phone at bed", 3))
+
+    def test_fuses_dense_and_keyword_hits(self):
+        with mock.patch("rag.rag_utils.get_store", return_value=self.store()), \
+                mock.patch("rag.rag_utils.embed_query", return_value=np.zeros(3, dtype="float32")):
+            passages = retrieve_knowledge("panic attack breathing", k=2, use_reranker=False)
+
+        # Second by dense but first by keywords beats first by dense only
+        self.assertEqual([(p.id, p.source) for p in passages], [(0, "panic.txt"), (1, "sleep.txt")])
+        self.assertAlmostEqual(passages[0].score, (1 / 61 + 1 / 62) / (2 / 61))
+        self.assertEqual(passages[0].text, self.records[0]["content"])
+
+    def test_threshold_and_keyword_fallback(self):
+        with mock.patch("rag.rag_utils.get_store", return_value=self.store()), \
+                mock.patch("rag.rag_utils.embed_query", side_effect=RuntimeError("no model")):
+            passages = retrieve_knowledge("evidence against thoughts", k=2, min_score=0.99, use_reranker=False)
+        self.assertEqual([p.source for p in passages], ["cbt.txt"])
+
+
+class ChunkerTests(TestCase):
+    text = (
+        "Coping Guide\n\n"
+        "Purpose:\nA short guide with several steps that must stay whole.\n\n"
+        "Step 1: Breathe\nInhale for 4 seconds.\nExhale for 6 seconds.\n\n"
+        "Step 2: Notice\nName five things you can see and four things you can touch,\n"
+        "then three things you can hear. Take your time with each one.\n"
+    )
+
+    def test_steps_are_never_split_across_chunks(self):
+        chunks = chunk_text(self.text, source="guide.txt", max_tokens=20)
+        self.assertEqual([c["section"] for c in chunks[:2]], ["Coping Guide", "Step 1: Breathe"])
+        self.assertEqual([c["position"] for c in chunks], list(range(len(chunks))))
+        # The title stays with the first section instead of becoming a chunk
+        self.assertTrue(chunks[0]["content"].startswith("Coping Guide\n\nPurpose:"))
+        self.assertEqual(chunks[1]["content"], "Step 1: Breathe\nInhale for 4 seconds.\nExhale for 6 seconds.")
+        self.assertTrue(all(count_tokens(c["content"]) <= 20 and c["source"] == "guide.txt" for c in chunks))
+
+    def test_oversized_section_splits_on_sentences_and_repeats_heading(self):
+        chunks = [c for c in chunk_text(self.text, max_tokens=30) if c["section"] == "Step 2: Notice"]
+        self.assertEqual([c["content"] for c in chunks], [
+            "Step 2: Notice\nName five things you can see and four things you can touch, "
+            "then three things you can hear.",
+            "Step 2: Notice\nTake your time with each one.",
+        ])
+
+    def test_check_reports_a_stale_artifact(self):
+        with tempfile.TemporaryDirectory() as out_dir, tempfile.TemporaryDirectory() as folder:
+            with open(os.path.join(folder, "guide.txt"), "w") as f:
+                f.write(self.text)
+            manifest = {"version": 4, "model": "all-MiniLM-L6-v2", "dimension": 384, "chunker": {"max_tokens": 128},
+                        "embedder": {"precision": "fp32"}, "file_hashes": {"guide.txt": file_hash(f.name)}}
+            with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+
+            self.assertEqual(check(out_dir, max_tokens=128, backend="local", folder=folder), [])
+            reasons = check(out_dir, max_tokens=64, backend="onnx", folder=folder)
+            self.assertEqual(len(reasons), 2)
+
+            manifest.update(version=3, file_hashes={"old.txt": "0"})
+            with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+            reasons = check(out_dir, max_tokens=128, backend="local", folder=folder)
+            self.assertEqual(reasons[0], "format v3, current is v4")
+            self.assertEqual(reasons[1], "knowledge files changed: guide.txt, old.txt")
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_turn_stages_are_exported(self):
+        with metrics.trace_turn("api") as turn:
+            with metrics.span("safety"):
+                pass
+            with self.assertRaises(RuntimeError), metrics.span("llm"):
+                raise RuntimeError("upstream down")
+        metrics.incr("chat_fallbacks_total", reason="llm_error")
+
+        self.assertEqual([stage for stage, _ in turn.stages], ["safety", "llm"])
+        text = metrics.render()
+        self.assertIn("# TYPE chat_stage_seconds histogram", text)
+        self.assertIn('chat_stage_seconds_bucket{stage="safety",le="+Inf"} 1', text)
+        self.assertIn('chat_stage_seconds_count{stage="llm"} 1', text)
+        self.assertIn('chat_stage_errors_total{stage="llm"} 1', text)
+        self.assertIn('chat_turn_seconds_count{view="api"} 1', text)
+        self.assertIn('chat_fallbacks_total{reason="llm_error"} 1', text)
+        # One HELP/TYPE header per family, even with several label sets
+        self.assertEqual(text.count("# TYPE chat_stage_seconds "), 1)
+
+    def test_streamed_turn_is_traced(self):
+        async def astream(messages, **params):
+            for token in ["Try ", "breathing."]:
+                yield token
+
+        gateway = mock.Mock(astream=astream)
+        user = User.objects.create_user("sam", password="pw")
+        session = ChatSession.objects.create(user=user)
+        self.client.force_login(user)
+        with mock.patch("chat.views_ui.get_gateway", return_value=gateway), \
+                mock.patch("chat.views_ui.retrieve_context", return_value=[]), \
+                mock.patch("chat.views_ui.recall", return_value=[]), \
+                mock.patch("chat.metrics.SLOW_TURN_MS", 0), self.assertLogs("chat.metrics", "WARNING") as logs:
+            response = self.client.post(reverse("chat_stream", args=[session.id]), {"message": "I feel tense"})
+
+            async def read():
+                return b"".join([chunk async for chunk in response.streaming_content])
+            async_to_sync(read)()
+
+        self.assertIn('chat_turn_seconds_count{view="stream"} 1', metrics.render())
+        # The breakdown covers the stream itself, up to saving the reply
+        for stage in ("context", "safety", "prompt", "llm_first_token", "llm", "persist"):
+            self.assertIn(f"{stage} ", logs.output[0])
+
+    def test_endpoint_wants_staff_or_token(self):
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with mock.patch("chat.metrics_view.METRICS_TOKEN", "s3cret"):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+            response = self.client.get(url, HTTP_AUTHORIZATION="Bearer s3cret")
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+        self.client.force_login(User.objects.create_user("lee", password="pw"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user("mo", password="pw", is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_workers_are_added_up(self):
+        with tempfile.TemporaryDirectory() as metrics_dir, mock.patch("chat.metrics.METRICS_DIR", metrics_dir):
+            # Another worker's file
+            metrics.incr("chat_fallbacks_total", 2, reason="llm_error")
+            metrics.histogram("chat_turn_seconds", view="api").observe(0.2)
+            other = metrics.snapshot()
+            other["stats"] = [("chat_embedder_info", "gauge", "Embedding backend in use.", [("backend", "remote")], 1)]
+            with open(os.path.join(metrics_dir, "4242.json"), "w") as f:
+                json.dump(other, f)
+            metrics.reset()
+
+            metrics.incr("chat_fallbacks_total", reason="llm_error")
+            metrics.histogram("chat_turn_seconds", view="api").observe(0.3)
+            text = metrics.render()
+            self.assertIn('chat_fallbacks_total{reason="llm_error"} 3', text)
+            self.assertIn('chat_turn_seconds_count{view="api"} 2', text)
+            self.assertIn('chat_embedder_info{backend="remote",worker="4242"} 1', text)
+            self.assertIn(f"{os.getpid()}.json", os.listdir(metrics_dir))
+
+            # An exited worker keeps counting towards the totals, its gauges go
+            metrics.mark_dead(4242)
+            text = metrics.render()
+            self.assertIn('chat_fallbacks_total{reason="llm_error"} 3', text)
+            self.assertNotIn('worker="4242"', text)
+            self.assertEqual(sorted(os.listdir(metrics_dir)), sorted(["dead.json", f"{os.getpid()}.json"]))
+
+
+class WarmupTests(TestCase):
+    def test_app_import_stays_within_budget(self):
+        code = "import django; django.setup(); import wellness_bot.urls, wellness_bot.asgi"
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE="wellness_bot.settings"),
+            capture_output=True, text=True, check=True,
+        )
+        # "import time: self [us] | cumulative | [indent]package"
+        rows = [line.split("|") for line in result.stderr.splitlines() if line.startswith("import time:")][1:]
+        imported = {row[2].strip() for row in rows}
+        self.assertFalse(imported & set(HEAVY_MODULES))
+        total_ms = sum(int(row[1]) for row in rows if not row[2].startswith("  ")) / 1000
+        self.assertLess(total_ms, IMPORT_BUDGET_MS)
+
+    def test_failed_stage_is_left_lazy(self):
+        with mock.patch("rag.store._store", None), \
+                mock.patch("rag.store.KnowledgeStore", side_effect=OSError("no artifact")):
+            timings = warm_up(["safety", "knowledge"])
+        self.assertIsInstance(timings["safety"], float)
+        self.assertIsNone(timings["knowledge"])
+
+
+class EmbeddingBatchingTests(TestCase):
+    def test_concurrent_requests_share_one_model_call(self):
+        calls, release = [], threading.Event()
+
+        def encode(texts):
+            calls.append(list(texts))
+            release.wait(5)
+            return np.asarray([[len(text)] for text in texts], dtype="float32")
+
+        batcher = MicroBatcher(encode, max_items=8, max_wait_ms=0)
+        first = batcher.submit(["a"])
+        deadline = time.monotonic() + 5
+        while not calls and time.monotonic() < deadline:
+            time.sleep(0.001)
+        # These queue up while the model is busy with the first request
+        waiting = [batcher.submit(["x" * n, "y"]) for n in (2, 3, 4)]
+        release.set()
+
+        self.assertEqual(first.result(5).tolist(), [[1.0]])
+        self.assertEqual([f.result(5)[:, 0].tolist() for f in waiting], [[2, 1], [3, 1], [4, 1]])
+        self.assertEqual(calls, [["a"], ["xx", "y", "xxx", "y", "xxxx", "y"]])
+        self.assertEqual(batcher.stats()["max_batch"], 6)
+
+    def test_model_error_reaches_the_caller(self):
+        batcher = MicroBatcher(mock.Mock(side_effect=RuntimeError("model down")), max_wait_ms=0)
+        with self.assertRaises(RuntimeError):
+            batcher.encode(["a"])
+
+
+def _onnx_parity_available():
+    return (importlib.util.find_spec("onnxruntime") and importlib.util.find_spec("sentence_transformers")
+            and os.path.exists(os.path.join(EMBEDDING_ONNX_DIR, "model.onnx")))
+
+
+class OnnxEmbedderTests(TestCase):
+    texts = [
+        "I can't sleep because my thoughts keep racing",
+        "Breathe in for four seconds and out for six",
+        "Write down the evidence for and against the thought",
+        "I feel like a failure",
+    ]
+
+    def test_mean_pool_ignores_padding(self):
+        tokens = np.array([[[1.0, 0.0], [3.0, 0.0], [100.0, 100.0]]], dtype="float32")
+        pooled = mean_pool(tokens, np.array([[1, 1, 0]]))
+        np.testing.assert_allclose(pooled, [[1.0, 0.0]])
+
+    def test_precision_change_forces_full_rebuild(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+                json.dump({"version": 4, "model": "all-MiniLM-L6-v2", "dimension": 384,
+                           "embedder": {"backend": "local", "precision": "fp32"}}, f)
+            with mock.patch("builtins.print"):
+                self.assertIsNone(load_previous(out_dir, backend="onnx"))
+
+    def test_cache_namespace_follows_backend_and_precision(self):
+        from rag import embedder
+
+        onnx = mock.Mock(spec=[])
+        onnx.name, onnx.precision = "onnx", "int8"
+        with mock.patch("rag.embedder._cache", None), mock.patch("rag.embedder._embedder", onnx):
+            self.assertEqual(embedder.get_cache().namespace, f"{embedder.MODEL_NAME}:onnx:int8")
+
+    def test_fallback_is_logged_and_reported(self):
+        from rag import embedder
+
+        with mock.patch.dict(embedder.BACKENDS, {"onnx": mock.Mock(side_effect=OSError("no export"))}), \
+                mock.patch("rag.embedder.EMBEDDING_REMOTE_FALLBACK", True), \
+                self.assertLogs("rag.embedder", "ERROR"):
+            loaded = embedder.load_embedder("onnx")
+        self.assertEqual(loaded.name, "remote")
+
+        with mock.patch("rag.embedder._embedder", loaded), mock.patch("rag.embedder.EMBEDDING_BACKEND", "onnx"):
+            self.assertIn('chat_embedder_info{backend="remote",precision="fp32",configured="onnx"} 1', metrics.render())
+
+    @unittest.skipUnless(_onnx_parity_available(), "needs onnxruntime, sentence-transformers and `python -m rag.export_onnx`")
+    def test_int8_embeddings_match_reference(self):
+        from rag.embedder import LocalEmbedder, OnnxEmbedder
 
-# Create your tests here.
+        reference = LocalEmbedder().encode(self.texts)
+        quantised = OnnxEmbedder().encode(self.texts)
+        cosine = (reference * quantised).sum(axis=1)
+        self.assertGreater(cosine.min(), 0.98)
+        # Same nearest neighbour for every text
+        np.testing.assert_array_equal(
+            np.argsort(-(reference @ reference.T), axis=1)[:, 1],
+            np.argsort(-(quantised @ reference.T), axis=1)[:, 1],
+        )
@@ -0,0 +1,44 @@
+import os
+
+from .llm import LLMError, get_gateway
+from .models import ChatSession
+
+# CONFIG
+DEFAULT_TITLE = "New Chat"
+PLACEHOLDER_LENGTH = 30  # first message, cut, until the title task has run
+TITLE_MAX_TOKENS = int(os.getenv("TITLE_MAX_TOKENS", "16"))
+
+TITLE_PROMPT = (
+    "Give this conversation with a mental wellness companion a short, gentle "
+    "title of at most five words, based on the user's first message. Reply "
+    "with the title only, no quotes."
+)
+
+
+def placeholder_title(session, user_message):
+    """
+    Title saved with a session's first turn (in the same UPDATE), or None
+    once the session has one. The chat.title task replaces it later.
+    """
+    if session.title != DEFAULT_TITLE:
+        return None
+    return user_message[:PLACEHOLDER_LENGTH]
+
+
+def generate_title(session_id, user_message):
+    """Ask the LLM for a title and store it, unless the placeholder was replaced meanwhile."""
+    title = get_gateway().complete(
+        [
+            {"role": "system", "content": TITLE_PROMPT},
+            {"role": "user", "content": user_message},
+        ],
+        temperature=0.2,
+        max_tokens=TITLE_MAX_TOKENS
+    ).strip().strip("\"'")
+    if not title:
+        raise LLMError("empty title")
+
+    max_length = ChatSession._meta.get_field("title").max_length
+    return ChatSession.objects.filter(
+        id=session_id, title=user_message[:PLACEHOLDER_LENGTH]
+    ).update(title=title[:max_length])
@@ -1,9 +1,14 @@
 from django.urls import path
-from . import views_ui
+from . import views, views_ui
 
 urlpatterns = [
     path("", views_ui.new_chat, name="new_chat"),
+    path("sessions/", views_ui.session_list, name="session_list"),
+    # JSON API for logged-in users (async, like the page views)
+    path("api/", views.ChatAPIView.as_view(), name="chat_api"),
     path("<int:session_id>/", views_ui.chat_page, name="chat_page"),
+    path("<int:session_id>/messages/", views_ui.message_history, name="message_history"),
+    path("<int:session_id>/stream/", views_ui.chat_stream, name="chat_stream"),
     path("<int:session_id>/delete/", views_ui.delete_chat, name="delete_chat"),
 ]
 
@@ -1,44 +1,44 @@
-from rest_framework.views import APIView
+from adrf.views import APIView
+from asgiref.sync import sync_to_async
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import JSONParser, FormParser
-from .models import ChatMessage
+from .context import load_window
+from .llm import get_gateway
+from .memory import recall
+from .metrics import incr, span, trace_turn
+from .models import ChatSession
+from .persistence import asave_turn, save_turn
+from .prompt import PromptBuilder
+from .response_cache import cached_reply, remember_reply
+from .safety import CRISIS_MARKER, CRISIS_RESPONSE, is_crisis
+from .summary import unsummarized
+from .tasks import schedule_post_reply
+from .titles import placeholder_title
 from rest_framework.permissions import IsAuthenticated
 import os
+import time
 
 USE_RAG = os.getenv("USE_RAG", "True") == "True"
 
-HIGH_RISK_KEYWORDS = [
-    "suicide",
-    "kill myself",
-    "end my life",
-    "self harm",
-    "hurt myself",
-    "no reason to live",
-    "want to die",
-    "cut myself"
-]
-
-CRISIS_RESPONSE = """
-I’m really sorry that you’re feeling this way.
-You’re not alone, and help is available.
-
-If you are in immediate danger or thinking about harming yourself,
-please contact your local emergency number right now.
-
-📞Suicide Prevention Helpline: Talk to someone now
-91-9820466726
-If you’re thinking about suicide, are worried about a friend or loved one, 
-or would like emotional support, AASRA is available 24/7 across India. 
-The Lifeline is available for everyone, is free, and confidential.
-If possible, please reach out to a trusted person nearby.
-"""
+API_SYSTEM_PROMPT = (
+    "You are a mental wellness support chatbot.\n"
+    "- Speak directly to the user.\n"
+    "- Be empathetic and supportive.\n"
+    "- NEVER mention instructions, rules, probabilities, or system design.\n"
+    "- NEVER role-play as an engineer, AI, or developer.\n"
+    "- NEVER explain how the chatbot works.\n"
+    "- Do NOT mention policies or internal logic.\n"
+    "- Do NOT give medical advice.\n"
+    "- Keep responses natural and human."
+)
+
 
 class ChatAPIView(APIView):
     permission_classes = [IsAuthenticated]
     parser_classes = [JSONParser, FormParser]
 
-    def post(self, request):
+    async def post(self, request):
         # 1️⃣ Validate request body
         if not request.data:
             return Response(
@@ -54,101 +54,86 @@ class ChatAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # 2️⃣ SAFETY CHECK — MUST COME IMMEDIATELY AFTER VALIDATION
-        lower_msg = user_message.lower()
+        # Conversation this message belongs to (latest one by default)
+        session_id = request.data.get("session_id")
+        if session_id:
+            session = await ChatSession.objects.filter(id=session_id, user=request.user).afirst()
+            if session is None:
+                return Response(
+                    {"error": "session not found"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+        else:
+            session = (
+                await ChatSession.objects.filter(user=request.user).order_by("-last_message_at", "-id").afirst()
+                or await ChatSession.objects.acreate(user=request.user)
+            )
 
-        for keyword in HIGH_RISK_KEYWORDS:
-            if keyword in lower_msg:
+        with trace_turn("api"):
+            # 2️⃣ SAFETY CHECK — MUST COME IMMEDIATELY AFTER VALIDATION
+            with span("safety"):
+                crisis = is_crisis(user_message)
+            if crisis:
+                incr("chat_crisis_turns_total", view="api")
                 # Log risky message
-                ChatMessage.objects.create(
-                    role="user",
-                    content=user_message
-                )
-                ChatMessage.objects.create(
-                    role="bot",
-                    content="CRISIS_INTERVENTION_TRIGGERED"
-                )
+                await asave_turn(session, [("user", user_message), ("bot", CRISIS_MARKER)])
 
                 return Response(
-                    {"reply": CRISIS_RESPONSE},
+                    {"reply": CRISIS_RESPONSE, "session_id": session.id},
                     status=status.HTTP_200_OK
                 )
 
-        # 3️⃣ Retrieve recent NON-CRISIS memory
-        recent_messages = (
-            ChatMessage.objects
-            .exclude(content="CRISIS_INTERVENTION_TRIGGERED")
-            .order_by("-created_at")[:4]
-        )
-        recent_messages = reversed(recent_messages)
-
-        memory_text = ""
-        for msg in recent_messages:
-            memory_text += f"{msg.role}: {msg.content}\n"
-
-        # 4️⃣ Build prompt
-        prompt = f"""
-You are a supportive mental wellness assistant.
-If previous thoughts are provided, consider them
-before responding.
-Do not give medical advice.
-
-Conversation so far:
-{memory_text}
-
-User says: {user_message}
-"""
-
-        # 5️⃣ Call Ollama (SAFE PATH ONLY)
-        try:
-            response = ollama.chat(
-    model="phi",
-    messages=[
-        {
-            "role": "system",
-            "content": (
-                "You are a mental wellness support chatbot.\n"
-                "- Speak directly to the user.\n"
-                "- Be empathetic and supportive.\n"
-                "- NEVER mention instructions, rules, probabilities, or system design.\n"
-                "- NEVER role-play as an engineer, AI, or developer.\n"
-                "- NEVER explain how the chatbot works.\n"
-                "- Do NOT mention policies or internal logic.\n"
-                "- Do NOT give medical advice.\n"
-                "- Keep responses natural and human."
-            )
-        },
-        {
-            "role": "user",
-            "content": f"Previous context:\n{memory_text}\n\nUser: {user_message}"
-        }
-    ],
-    options={
-        "num_predict": 120,
-        "temperature": 0.6,
-        "top_p": 0.9
-    }
-)
+            # 3️⃣ Build prompt: summary + recent NON-CRISIS memory of this session
+            # + related memories from the user's other sessions, within the token budget
+            with span("context"):
+                window = await sync_to_async(load_window)(session.id)
+            with span("memory"):
+                memories = await sync_to_async(recall)(session, user_message)
+            with span("prompt"):
+                messages = PromptBuilder().build(
+                    user_message,
+                    system=API_SYSTEM_PROMPT,
+                    summary=session.summary,
+                    history=unsummarized(session, window),
+                    memories=memories,
+                )
+
+            # 4️⃣ Semantic cache for generic questions, else the LLM gateway (SAFE PATH ONLY)
+            with span("cache"):
+                bot_reply, query_vector = await sync_to_async(cached_reply)(
+                    "api", user_message, has_context=bool(window or session.summary or memories)
+                )
+            if bot_reply is None:
+                try:
+                    start = time.perf_counter()
+                    with span("llm"):
+                        bot_reply = (await get_gateway().acomplete(
+                            messages,
+                            max_tokens=120,
+                            temperature=0.6,
+                            top_p=0.9
+                        )).strip()
+
+                except Exception as e:
+                    return Response(
+                        {"error": str(e)},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    )
+
+                # No-op unless the turn was cacheable (query_vector set)
+                remember_reply("api", query_vector, (), bot_reply, (time.perf_counter() - start) * 1000)
+
+            # 5️⃣ Store messages (one transaction) and queue post-reply work
+            with span("persist"):
+                await sync_to_async(self.finish_turn)(session, user_message, bot_reply)
 
-        except Exception as e:
             return Response(
-                {"error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"reply": bot_reply, "session_id": session.id},
+                status=status.HTTP_200_OK
             )
 
-        bot_reply = response["message"]["content"]
-
-        # 6️⃣ Store messages
-        ChatMessage.objects.create(
-            role="user",
-            content=user_message
-        )
-        ChatMessage.objects.create(
-            role="bot",
-            content=bot_reply
-        )
-
-        return Response(
-            {"reply": bot_reply},
-            status=status.HTTP_200_OK
-        )
+    @staticmethod
+    def finish_turn(session, user_message, bot_reply):
+        title = placeholder_title(session, user_message)
+        save_turn(session, [("user", user_message), ("bot", bot_reply)], title=title)
+        schedule_post_reply(session, user_message, load_window(session.id), new_title=bool(title))
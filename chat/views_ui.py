@@ -1,159 +1,347 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, aget_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
-import os
+from django.http import StreamingHttpResponse, HttpResponseBadRequest, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET, require_POST
+from asgiref.sync import sync_to_async
+import asyncio
+import json
+import logging
+import time
 
+from .context import load_window
+from .llm import get_gateway
+from .memory import recall
+from .metrics import incr, observe, span, trace_turn
 from .models import ChatSession, ChatMessage
+from .pagination import MESSAGE_PAGE_SIZE, SESSION_PAGE_SIZE, InvalidCursor, akeyset_page
+from .persistence import asave_turn, save_turn
+from .prompt import PromptBuilder
+from .response_cache import cached_reply, remember_reply
+from .safety import CRISIS_MARKER, CRISIS_RESPONSE, display_text, is_crisis
+from .summary import unsummarized
+from .tasks import schedule_post_reply
+from .titles import placeholder_title
 
-# 🔹 Lazy Groq client (safe on Render)
-_groq_client = None
+logger = logging.getLogger(__name__)
 
+FALLBACK_REPLY = (
+    "I’m here with you. I might be a bit slow right now, "
+    "but you can keep talking — I’m listening."
+)
 
-def get_groq_client():
-    global _groq_client
-    if _groq_client is None:
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            raise RuntimeError("GROQ_API_KEY not set")
-        from groq import Groq
-        _groq_client = Groq(api_key=api_key)
-    return _groq_client
+
+def retrieve_context(user_message):
+    # Hybrid RAG (lightweight retrieval)
+    trace = []
+    try:
+        from rag.rag_utils import retrieve_knowledge
+        with span("retrieve"):
+            return retrieve_knowledge(user_message, k=2, trace=trace)
+    except Exception:
+        incr("chat_fallbacks_total", reason="no_knowledge")
+        logger.warning("RAG retrieval failed", exc_info=True)
+        return []
+    finally:
+        # embed / faiss / bm25 / rerank timings from inside the retriever
+        for stage, seconds, ok in trace:
+            observe(stage, seconds, ok)
+            if not ok:
+                incr("chat_upstream_errors_total", service=stage)
+
+
+def build_llm_messages(session, user_message, history=None, chunks=None, memories=None):
+    # Recent memory (session-scoped); callers pass the window they loaded
+    # before saving the new message so it isn't sent twice
+    if history is None:
+        history = load_window(session.id)
+    if chunks is None:
+        chunks = retrieve_context(user_message)
+    # Long-term memory (the user's other sessions)
+    if memories is None:
+        memories = recall(session, user_message)
+
+    # Pack everything into the prompt token budget; turns already in the
+    # summary are not repeated
+    return PromptBuilder().build(
+        user_message,
+        knowledge=[chunk.text for chunk in chunks],
+        summary=session.summary,
+        history=unsummarized(session, history),
+        memories=memories,
+    )
+
+
+def prepare_reply(session, user_message, history):
+    """
+    Retrieval, prompt building and the semantic cache lookup, run as one
+    sync_to_async hop from the async views (DB + embedding work).
+    """
+    chunks = retrieve_context(user_message)
+    with span("memory"):
+        memories = recall(session, user_message)
+    with span("prompt"):
+        messages = build_llm_messages(session, user_message, history, chunks, memories)
+    chunk_ids = [chunk.id for chunk in chunks]
+    with span("cache"):
+        cached, query_vector = cached_reply(
+            "ui", user_message, chunk_ids, has_context=bool(history or session.summary or memories)
+        )
+    return messages, chunk_ids, cached, query_vector
+
+
+def finish_turn(session, user_message, bot_reply):
+    # Save the turn (and a placeholder title on the first turn) in one
+    # transaction, then queue memory indexing, the title and the summary
+    # for the task worker
+    turn = [("user", user_message)]
+    if bot_reply:
+        turn.append(("bot", bot_reply))
+    title = placeholder_title(session, user_message)
+    with span("persist"):
+        save_turn(session, turn, title=title)
+        schedule_post_reply(session, user_message, load_window(session.id), new_title=bool(title))
 
 
 @login_required
-def new_chat(request):
-    session = ChatSession.objects.create(user=request.user)
+async def new_chat(request):
+    user = await request.auser()
+    session = await ChatSession.objects.acreate(user=user)
     return redirect("chat_page", session_id=session.id)
 
 
 @login_required
-def chat_page(request, session_id):
-    session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+async def chat_page(request, session_id):
+    user = await request.auser()
+    session = await aget_object_or_404(ChatSession, id=session_id, user=user)
 
     if request.method == "POST":
         user_message = request.POST.get("message", "").strip()
 
         if user_message:
-            # 1️⃣ Save user message
-            ChatMessage.objects.create(
-                session=session,
-                role="user",
-                content=user_message
-            )
+            with trace_turn("ui"):
+                with span("context"):
+                    history = await sync_to_async(load_window)(session.id)
 
-            # 2️⃣ Load recent memory (session-scoped)
-            recent_messages = (
-                ChatMessage.objects
-                .filter(session=session)
-                .order_by("created_at")[:6]
-            )
-
-            # 3️⃣ Hybrid RAG (lightweight retrieval)
-            knowledge_text = ""
-            try:
-                from rag.rag_utils import retrieve_knowledge
-                chunks = retrieve_knowledge(user_message, k=2)
-                if chunks:
-                    knowledge_text = "\n\n".join(chunks)
-            except Exception:
-                knowledge_text = ""
-
-            # 4️⃣ Build LLM messages
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a supportive mental wellness companion.\n"
-                        "Speak calmly, warmly, and practically.\n"
-                        "Use provided mental health context if relevant.\n"
-                        "When presenting structured steps, format clearly using numbered lists.\n"
-                        "Avoid markdown tables.\n"
-                        "Keep formatting clean and readable.\n"
-                        "Use provided mental health context if relevant.\n"
-                        "Preserve structure from the provided context.\n"
-                        "Do not give generic filler responses.\n"
-                        "Do not analyze or label the user.\n"
-                        "Do not give medical advice."
-                    )
-                }
-            ]
-
-            # 🔹 Inject RAG context if available
-            if knowledge_text:
-                messages.append({
-                    "role": "system",
-                    "content": f"Relevant mental health context:\n{knowledge_text}"
-                })
-
-            # Conversation memory
-            for msg in recent_messages:
-                messages.append({
-                    "role": "assistant" if msg.role == "bot" else "user",
-                    "content": msg.content
-                })
-
-            # Latest user message
-            messages.append({
-                "role": "user",
-                "content": user_message
-            })
-
-            # 5️⃣ LLM call (SAFE)
-            try:
-                client = get_groq_client()
+                # 1️⃣ Safety check before anything reaches the LLM
+                with span("safety"):
+                    crisis = is_crisis(user_message)
+                if crisis:
+                    incr("chat_crisis_turns_total", view="ui")
+                    await asave_turn(session, [("user", user_message), ("bot", CRISIS_MARKER)])
+                    return redirect("chat_page", session_id=session.id)
 
-                response = client.chat.completions.create(
-                    model="openai/gpt-oss-20b",
-                    messages=messages,
-                    temperature=0.5,
-                    max_tokens=900
+                # 2️⃣ Build LLM messages (memory + RAG), off the event loop
+                messages, chunk_ids, bot_reply, query_vector = await sync_to_async(prepare_reply)(
+                    session, user_message, history
                 )
 
-                bot_reply = response.choices[0].message.content.strip()
+                # 3️⃣ Semantic cache hit, else LLM call (SAFE)
+                if bot_reply is None:
+                    try:
+                        start = time.perf_counter()
+                        with span("llm"):
+                            bot_reply = (await get_gateway().acomplete(
+                                messages,
+                                temperature=0.5,
+                                max_tokens=900
+                            )).strip()
+                        # No-op unless the turn was cacheable (query_vector set)
+                        remember_reply("ui", query_vector, chunk_ids, bot_reply, (time.perf_counter() - start) * 1000)
+                        if not bot_reply:
+                            incr("chat_fallbacks_total", reason="empty_reply")
+                            bot_reply = FALLBACK_REPLY
 
-            except Exception:
-                bot_reply = (
-                    "I’m here with you. I might be a bit slow right now, "
-                    "but you can keep talking — I’m listening."
-                )
-
-            # 6️⃣ Save bot reply
-            ChatMessage.objects.create(
-                session=session,
-                role="bot",
-                content=bot_reply
-            )
+                    except Exception:
+                        incr("chat_fallbacks_total", reason="llm_error")
+                        logger.warning("LLM call failed", exc_info=True)
+                        bot_reply = FALLBACK_REPLY
 
-            # Auto-set chat title
-            if session.title == "New Chat":
-                session.title = user_message[:30]
-                session.save()
+                # 4️⃣ Save the turn, 5️⃣ queue memory indexing and summary
+                await sync_to_async(finish_turn)(session, user_message, bot_reply)
 
         return redirect("chat_page", session_id=session.id)
 
-    # GET request
-    messages = ChatMessage.objects.filter(session=session).order_by("created_at")
-    sessions = ChatSession.objects.filter(user=request.user).order_by("-created_at")
+    # GET request: only the newest page of each list, older pages load on scroll
+    messages, older_cursor = await akeyset_page(
+        ChatMessage.objects.filter(session=session).only("id", "role", "content", "created_at"),
+        page_size=MESSAGE_PAGE_SIZE
+    )
+    messages.reverse()
+    sessions, sessions_cursor = await akeyset_page(
+        ChatSession.objects.filter(user=user).only("id", "title", "last_message_at", "message_count", "preview"),
+        field="last_message_at",
+        page_size=SESSION_PAGE_SIZE
+    )
 
     return render(
         request,
         "chat/chat.html",
         {
             "messages": messages,
+            "older_cursor": older_cursor,
             "sessions": sessions,
+            "sessions_cursor": sessions_cursor,
             "active_session": session,
         }
     )
 
 
+@login_required
+@require_GET
+async def message_history(request, session_id):
+    """Older messages of a session, for scroll-up (oldest first in the page)."""
+    user = await request.auser()
+    session = await aget_object_or_404(ChatSession, id=session_id, user=user)
+    try:
+        rows, cursor = await akeyset_page(
+            ChatMessage.objects.filter(session=session).values("id", "role", "content", "created_at"),
+            cursor=request.GET.get("before"),
+            page_size=MESSAGE_PAGE_SIZE
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    rows.reverse()
+    return JsonResponse({
+        "messages": [
+            {"id": row["id"], "role": row["role"], "content": display_text(row["content"]), "created_at": row["created_at"]}
+            for row in rows
+        ],
+        "next": cursor,
+    })
+
+
+@login_required
+@require_GET
+async def session_list(request):
+    """Next page of the sidebar, most recently active sessions first."""
+    user = await request.auser()
+    try:
+        rows, cursor = await akeyset_page(
+            ChatSession.objects.filter(user=user).values(
+                "id", "title", "last_message_at", "message_count", "preview"
+            ),
+            field="last_message_at",
+            cursor=request.GET.get("after"),
+            page_size=SESSION_PAGE_SIZE
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    return JsonResponse({
+        "sessions": [
+            {
+                "id": row["id"],
+                "title": row["title"],
+                "message_count": row["message_count"],
+                "preview": row["preview"],
+                "url": reverse("chat_page", args=[row["id"]]),
+                "delete_url": reverse("delete_chat", args=[row["id"]]),
+            }
+            for row in rows
+        ],
+        "next": cursor,
+    })
+
+
+def sse_event(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        payload = f"event: {event}\n{payload}"
+    return payload
+
+
+@login_required
+@require_POST
+async def chat_stream(request, session_id):
+    user = await request.auser()
+    session = await aget_object_or_404(ChatSession, id=session_id, user=user)
+
+    user_message = request.POST.get("message", "").strip()
+    if not user_message:
+        return HttpResponseBadRequest("message required")
+
+    async def event_stream():
+        # The turn runs inside the stream, so its time covers every token
+        with trace_turn("stream"):
+            with span("context"):
+                history = await sync_to_async(load_window)(session.id)
+
+            # 1️⃣ Safety check before anything reaches the LLM
+            with span("safety"):
+                crisis = is_crisis(user_message)
+            if crisis:
+                incr("chat_crisis_turns_total", view="stream")
+                await asave_turn(session, [("user", user_message), ("bot", CRISIS_MARKER)])
+                yield sse_event({"token": CRISIS_RESPONSE.strip()})
+                yield sse_event({"title": session.title}, event="done")
+                return
+
+            # 2️⃣ Build LLM messages (DB + embedding work stays off the event loop)
+            messages, chunk_ids, cached, query_vector = await sync_to_async(prepare_reply)(
+                session, user_message, history
+            )
+
+            tokens = []
+
+            async def save_reply(bot_reply):
+                # 4️⃣ Save the turn, 5️⃣ queue memory indexing and summary
+                await sync_to_async(finish_turn)(session, user_message, bot_reply)
+
+            # 3️⃣ Relay tokens as they arrive (or a cached reply in one go)
+            try:
+                if cached is not None:
+                    tokens.append(cached)
+                    yield sse_event({"token": cached})
+                else:
+                    start = time.perf_counter()
+                    async for token in get_gateway().astream(
+                        messages,
+                        temperature=0.5,
+                        max_tokens=900
+                    ):
+                        if not tokens:
+                            observe("llm_first_token", time.perf_counter() - start)
+                        tokens.append(token)
+                        yield sse_event({"token": token})
+                    observe("llm", time.perf_counter() - start)
+                    remember_reply(
+                        "ui", query_vector, chunk_ids, "".join(tokens).strip(),
+                        (time.perf_counter() - start) * 1000
+                    )
+
+            except asyncio.CancelledError:
+                # Client went away: keep the message and whatever was already shown
+                await asyncio.shield(save_reply("".join(tokens).strip()))
+                raise
+
+            except Exception:
+                logger.warning("LLM stream failed", exc_info=True)
+                if not tokens:
+                    incr("chat_fallbacks_total", reason="llm_error")
+                    yield sse_event({"token": FALLBACK_REPLY})
+
+            # Persist the turn once the stream completes
+            await save_reply("".join(tokens).strip() or FALLBACK_REPLY)
+            yield sse_event({"title": session.title}, event="done")
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx-style proxies from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 @login_required
 @require_POST
-def delete_chat(request, session_id):
-    session = get_object_or_404(ChatSession, id=session_id, user=request.user)
-    session.delete()
+async def delete_chat(request, session_id):
+    user = await request.auser()
+    session = await aget_object_or_404(ChatSession, id=session_id, user=user)
+    await session.adelete()
 
-    remaining = ChatSession.objects.filter(user=request.user).order_by("-created_at")
-    if remaining.exists():
-        return redirect("chat_page", session_id=remaining.first().id)
+    latest = await ChatSession.objects.filter(user=user).order_by("-last_message_at", "-id").afirst()
+    if latest is not None:
+        return redirect("chat_page", session_id=latest.id)
 
-    return redirect("new_chat")
\ No newline at end of file
+    return redirect("new_chat")
@@ -0,0 +1,80 @@
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# CONFIG
+# Loaded once in the gunicorn master (preload_app) and shared copy-on-write
+# by the forked workers; drop "embedder" if the model misbehaves after fork
+WARMUP_STAGES = [s for s in os.getenv("WARMUP_STAGES", "safety,tokenizer,knowledge,embedder,reranker,llm_sdk").split(",") if s]
+
+# Importing the app (settings, URLconf, views) must stay cheap and must not
+# pull these in; they belong to the warm-up stages above
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "3000"))
+HEAVY_MODULES = ("faiss", "torch", "sentence_transformers", "transformers", "tiktoken", "groq")
+
+
+def _safety():
+    from .safety import get_detector
+    get_detector()
+
+
+def _tokenizer():
+    from .prompt import get_tokenizer
+    get_tokenizer()
+
+
+def _knowledge():
+    # FAISS index (mmapped), chunk store and BM25 arrays
+    from rag.store import get_store
+    get_store()
+
+
+def _embedder():
+    from rag.embedder import get_embedder
+    get_embedder()
+
+
+def _llm_sdk():
+    # Module import only; the gateway's loop thread and connection pool
+    # can't cross a fork, so get_gateway() still runs in each worker
+    from .llm import LLM_PROVIDER
+    if LLM_PROVIDER == "groq":
+        import groq  # noqa: F401
+        import httpx  # noqa: F401
+
+
+def _reranker():
+    from rag.rag_utils import get_reranker
+    get_reranker()
+
+
+# Only process-safe state: no DB connections, threads or event loops
+STAGES = {
+    "safety": _safety,
+    "tokenizer": _tokenizer,
+    "knowledge": _knowledge,
+    "embedder": _embedder,
+    "reranker": _reranker,
+    "llm_sdk": _llm_sdk,
+}
+
+
+def warm_up(stages=None):
+    """
+    Load the heavy per-process singletons now instead of on the first
+    request. A stage that fails is logged and left to its lazy getter.
+    Returns ``{stage: seconds}``, ``None`` for failed stages.
+    """
+    timings = {}
+    for name in stages or WARMUP_STAGES:
+        start = time.perf_counter()
+        try:
+            STAGES[name]()
+        except Exception:
+            logger.warning("warm-up stage %s failed, it will load on first use", name, exc_info=True)
+            timings[name] = None
+        else:
+            timings[name] = time.perf_counter() - start
+    return timings
@@ -0,0 +1,96 @@
+"""
+Gunicorn settings, used by the Procfile (``gunicorn -c gunicorn.conf.py``).
+
+SERVER_MODE picks how Django is served:
+
+- "asgi": uvicorn workers running wellness_bot.asgi. The chat views are
+  async, so one worker holds many conversations open while they wait on
+  the LLM, and streaming replies don't pin a thread each. Database
+  connections are pooled (Postgres) or closed after each request (SQLite).
+- "wsgi": classic threaded workers running wellness_bot.wsgi. Every
+  in-flight request (LLM wait included) occupies one of
+  WEB_CONCURRENCY * GUNICORN_THREADS threads.
+
+With GUNICORN_PRELOAD (default on) the master imports Django and runs the
+warm-up stage (chat.warmup) before forking, so the crisis detector,
+tokenizer, knowledge index and embedding model are loaded once and shared
+copy-on-write instead of loading inside the first request of each worker.
+Each worker then starts its own LLM gateway right after the fork.
+Management commands and `runserver` skip this and load them lazily.
+
+Metrics are kept per worker; unless METRICS_DIR is set, each server start
+gets a fresh directory where the workers write them so /metrics can add
+them up (see chat.metrics).
+"""
+
+import os
+import shutil
+import tempfile
+
+# CONFIG
+SERVER_MODE = os.getenv("SERVER_MODE", "asgi")  # "asgi" or "wsgi"
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+accesslog = "-" if os.getenv("GUNICORN_ACCESS_LOG", "False") == "True" else None
+errorlog = "-"
+preload_app = os.getenv("GUNICORN_PRELOAD", "True") == "True"
+
+# Read with the rest of the settings, before the app (and chat.metrics) loads
+_own_metrics_dir = "METRICS_DIR" not in os.environ
+if _own_metrics_dir:
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="wellness-metrics-")
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "wellness_bot.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "wellness_bot.wsgi:application"
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported, before any fork
+    if preload_app:
+        from chat.warmup import warm_up
+
+        timings = warm_up()
+        server.log.info("Warm-up: %s", ", ".join(
+            f"{stage} {'failed' if seconds is None else f'{seconds * 1000:.0f}ms'}"
+            for stage, seconds in timings.items()
+        ))
+
+
+def post_worker_init(worker):
+    # The LLM gateway owns a loop thread and a connection pool, which don't
+    # survive a fork: build it in each worker before it takes requests
+    from chat.llm import get_gateway
+    from chat.metrics import start_flusher
+
+    start_flusher()
+    try:
+        get_gateway()
+    except Exception:
+        worker.log.warning("LLM gateway not ready, it will start on first use", exc_info=True)
+
+
+def worker_exit(server, worker):
+    from chat.metrics import flush
+
+    flush()
+
+
+def child_exit(server, worker):
+    # In the master: keep the exited worker's counters, drop its gauges
+    from chat.metrics import mark_dead
+
+    mark_dead(worker.pid)
+
+
+def on_exit(server):
+    if _own_metrics_dir:
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
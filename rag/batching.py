@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent ``encode`` calls into shared model calls.
+
+    Callers hand over their texts and block (``encode``) or await
+    (``aencode``) a future. A single background thread takes the first
+    waiting request, keeps gathering until ``max_items`` texts or
+    ``max_wait_ms`` have passed, then runs one ``encode_fn`` over the batch
+    and slices the rows back out to each caller. With ``max_wait_ms=0`` it
+    only batches what queued up while the previous call was running, so a
+    lone caller pays no extra latency.
+    """
+
+    def __init__(self, encode_fn, max_items=32, max_wait_ms=2.0):
+        self.encode_fn = encode_fn
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000
+        self._pending = deque()  # (texts, future)
+        self._pending_items = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {"batches": 0, "items": 0, "max_batch": 0}
+
+    def submit(self, texts):
+        """Queue ``texts``; returns a Future of their (n, dim) embeddings."""
+        future = Future()
+        texts = list(texts)
+        with self._cond:
+            # Started on first use, so a batcher never crosses a fork
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+            self._pending.append((texts, future))
+            self._pending_items += len(texts)
+            self._cond.notify()
+        return future
+
+    def encode(self, texts):
+        return self.submit(texts).result()
+
+    async def aencode(self, texts):
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+        stats["avg_batch"] = round(stats["items"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
+
+    def _take(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while self._pending_items < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # Whole requests only; an oversized one still goes alone
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0][0]) <= self.max_items):
+                texts, future = self._pending.popleft()
+                batch.append((texts, future))
+                size += len(texts)
+            self._pending_items -= size
+            return batch, size
+
+    def _run(self):
+        while True:
+            batch, size = self._take()
+            texts = [text for request, _ in batch for text in request]
+            try:
+                vectors = np.asarray(self.encode_fn(texts), dtype="float32")
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._cond:
+                self._stats["batches"] += 1
+                self._stats["items"] += size
+                self._stats["max_batch"] = max(self._stats["max_batch"], size)
+
+            start = 0
+            for request, future in batch:
+                future.set_result(vectors[start:start + len(request)])
+                start += len(request)
@@ -0,0 +1,122 @@
+import re
+
+import numpy as np
+
+# CONFIG
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by do does for from has have how i if in into is it its "
+    "me my no not of on or so that the their them then there these they this to up was "
+    "we what when where which who why will with you your".split()
+)
+SUFFIXES = ("ing", "ed", "ly", "s")
+
+
+def tokenize(text):
+    """Lowercase word tokens, stopwords dropped, common suffixes stripped."""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        for suffix in SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+                token = token[:-len(suffix)]
+                break
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory inverted index over the knowledge chunks.
+
+    Postings are stored CSR-style (one offsets array into flat doc/weight
+    arrays) and each posting already carries its full BM25 term weight,
+    so a query is a handful of array adds.
+    """
+
+    def __init__(self, terms, offsets, docs, weights, chunk_ids):
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.chunk_ids = chunk_ids
+
+    @classmethod
+    def build(cls, records, k1=BM25_K1, b=BM25_B):
+        records = sorted(records, key=lambda record: record["id"])
+        postings = {}
+        lengths = np.zeros(len(records), dtype="float32")
+        for doc, record in enumerate(records):
+            tokens = tokenize(record["content"])
+            lengths[doc] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((doc, tf))
+
+        n = len(records)
+        avgdl = float(lengths.mean()) if n else 0.0
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype="int64")
+        docs, weights = [], []
+        for i, term in enumerate(terms):
+            entries = postings[term]
+            idf = np.log(1 + (n - len(entries) + 0.5) / (len(entries) + 0.5))
+            for doc, tf in entries:
+                norm = k1 * (1 - b + b * lengths[doc] / max(avgdl, 1e-9))
+                docs.append(doc)
+                weights.append(idf * tf * (k1 + 1) / (tf + norm))
+            offsets[i + 1] = len(docs)
+
+        return cls(
+            terms,
+            offsets,
+            np.asarray(docs, dtype="int32"),
+            np.asarray(weights, dtype="float32"),
+            np.asarray([record["id"] for record in records], dtype="int64"),
+        )
+
+    def save(self, f):
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez(
+            f,
+            terms=np.asarray(terms, dtype=str),
+            offsets=self.offsets,
+            docs=self.docs,
+            weights=self.weights,
+            chunk_ids=self.chunk_ids,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["terms"].tolist(),
+                data["offsets"],
+                data["docs"],
+                data["weights"],
+                data["chunk_ids"],
+            )
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def search(self, query, k):
+        """Return up to ``k`` ``(chunk_id, score)`` pairs, best first."""
+        scores = np.zeros(len(self.chunk_ids), dtype="float32")
+        for token in set(tokenize(query)):
+            i = self.vocabulary.get(token)
+            if i is not None:
+                start, end = self.offsets[i], self.offsets[i + 1]
+                scores[self.docs[start:end]] += self.weights[start:end]
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(int(self.chunk_ids[doc]), float(scores[doc])) for doc in hits]
@@ -1,65 +1,359 @@
+# Run from the repo root: python -m rag.build_embeddings [--full | --check]
+import argparse
+import itertools
 import os
-import json
+import tempfile
+from collections import defaultdict
+
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from rag.bm25 import BM25Index
+from rag.chunker import CHUNK_MAX_TOKENS, chunk_file
+from rag.embedder import DIMENSION, EMBEDDING_BACKEND, EMBEDDING_BATCH_SIZE, MODEL_NAME, describe, load_embedder
+from rag.index_spec import (
+    INDEX_TYPES,
+    exact_vectors,
+    factory_string,
+    make_spec,
+    new_index,
+    reconstruct_ids,
+    same_structure,
+    supports_remove,
+    train,
+)
+from rag.store import (
+    ARTIFACT_DIR,
+    ARTIFACT_VERSION,
+    BASE_DIR,
+    CHUNKS_FILE,
+    INDEX_FILE,
+    ChunkStore,
+    ChunkWriter,
+    file_hash,
+    read_manifest,
+    write_artifact,
+)
 
 # CONFIG
-KNOWLEDGE_FOLDER = "rag/knowledge"
-INDEX_PATH = "rag/index.faiss"
-METADATA_PATH = "rag/metadata.json"
-CHUNK_SIZE = 300  # characters per chunk (simple version)
-CHUNK_OVERLAP = 50
+KNOWLEDGE_FOLDER = os.path.join(BASE_DIR, "knowledge")
+
+
+def read_knowledge(folder=KNOWLEDGE_FOLDER):
+    """Return ``{filename: (sha256, path)}`` for every knowledge file (text is streamed later)."""
+    files = {}
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".txt"):
+            filepath = os.path.join(folder, filename)
+            files[filename] = (file_hash(filepath), filepath)
+    return files
+
+
+class IndexFeeder:
+    """
+    Adds embedded batches to ``index`` as they arrive. An index that still
+    needs training (IVF, PQ) can't take vectors yet, so those are spooled
+    to a temporary file; ``finish`` trains on a sample of the spool and
+    adds it back ``train_size`` vectors at a time.
+    """
+
+    def __init__(self, index, train_size=50000):
+        self.index = index
+        self.train_size = train_size
+        self._spool = None if index.is_trained else tempfile.TemporaryDirectory()
+        self._count = 0
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype="int64")
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if self._spool is None:
+            self.index.add_with_ids(vectors, ids)
+            return
+        with open(os.path.join(self._spool.name, "ids"), "ab") as f:
+            f.write(ids.tobytes())
+        with open(os.path.join(self._spool.name, "vectors"), "ab") as f:
+            f.write(vectors.tobytes())
+        self._count += len(ids)
+
+    def finish(self):
+        if self._spool is None:
+            return
+        with self._spool:
+            if not self._count:
+                return
+            ids = np.memmap(os.path.join(self._spool.name, "ids"), dtype="int64", mode="r")
+            vectors = np.memmap(
+                os.path.join(self._spool.name, "vectors"), dtype="float32", mode="r", shape=(self._count, self.index.d)
+            )
+            train(self.index, vectors, self.train_size)
+            for start in range(0, self._count, self.train_size):
+                self.index.add_with_ids(
+                    np.ascontiguousarray(vectors[start:start + self.train_size]),
+                    np.ascontiguousarray(ids[start:start + self.train_size]),
+                )
+            del ids, vectors
+
+
+def load_previous(out_dir=ARTIFACT_DIR, backend=EMBEDDING_BACKEND):
+    """Load the last artifact for editing, or None if a full build is needed."""
+    try:
+        manifest = read_manifest(out_dir)
+    except FileNotFoundError:
+        return None
+
+    if (manifest.get("version") != ARTIFACT_VERSION
+            or manifest.get("model") != MODEL_NAME
+            or manifest.get("dimension") != DIMENSION):
+        return None
+
+    # Vectors from an int8 and an fp32 model must not share one index
+    built_with = manifest.get("embedder", {}).get("precision", "fp32")
+    if built_with != describe(backend)["precision"]:
+        print(f"Index was embedded at {built_with}, {backend} backend is {describe(backend)['precision']}")
+        return None
+
+    index = faiss.read_index(os.path.join(out_dir, INDEX_FILE))
+    chunks = ChunkStore(os.path.join(out_dir, manifest["files"]["chunks"]))
+    return manifest, index, chunks
+
+
+def check(out_dir=ARTIFACT_DIR, max_tokens=CHUNK_MAX_TOKENS, backend=EMBEDDING_BACKEND, folder=KNOWLEDGE_FOLDER):
+    """Reasons the artifact in ``out_dir`` is out of date, empty when current. Needs no model."""
+    try:
+        manifest = read_manifest(out_dir)
+    except FileNotFoundError:
+        return [f"no artifact in {out_dir}"]
+
+    reasons = []
+    if manifest.get("version") != ARTIFACT_VERSION:
+        reasons.append(f"format v{manifest.get('version')}, current is v{ARTIFACT_VERSION}")
+    if manifest.get("model") != MODEL_NAME or manifest.get("dimension") != DIMENSION:
+        reasons.append(f"embedded with {manifest.get('model')}, configured model is {MODEL_NAME}")
+    built_with = manifest.get("embedder", {}).get("precision", "fp32")
+    if built_with != describe(backend)["precision"]:
+        reasons.append(f"embedded at {built_with}, {backend} backend is {describe(backend)['precision']}")
+    if manifest.get("chunker") != {"max_tokens": max_tokens}:
+        reasons.append(f"chunker settings {manifest.get('chunker')}, current are {{'max_tokens': {max_tokens}}}")
+
+    file_hashes = {filename: digest for filename, (digest, _) in read_knowledge(folder).items()}
+    old_hashes = manifest.get("file_hashes", {})
+    changed = sorted(
+        name for name in file_hashes.keys() | old_hashes.keys() if file_hashes.get(name) != old_hashes.get(name)
+    )
+    if changed:
+        reasons.append(f"knowledge files changed: {', '.join(changed)}")
+    return reasons
+
+
+def iter_records(files, plan, old_chunks, max_tokens=CHUNK_MAX_TOKENS):
+    """Stream the final chunk records file by file, with the ids picked by the plan."""
+    for filename, (_, path) in files.items():
+        reused, ids = plan[filename]
+        if reused:
+            for chunk_id in ids:
+                yield old_chunks.get(chunk_id)
+        else:
+            for chunk, chunk_id in zip(chunk_file(path, filename, max_tokens), ids):
+                yield dict(chunk, id=chunk_id)
+
+
+def build(full=False, spec_options=None, train_size=50000, out_dir=ARTIFACT_DIR,
+          max_tokens=CHUNK_MAX_TOKENS, batch_size=EMBEDDING_BATCH_SIZE, folder=KNOWLEDGE_FOLDER):
+    print("Reading knowledge files...")
+    files = read_knowledge(folder)
+    chunker = {"max_tokens": max_tokens}
+    embedder_info = describe(EMBEDDING_BACKEND)
+
+    previous = None if full else load_previous(out_dir)
+    if previous is None:
+        print("Full rebuild")
+        old_manifest, old_index, old_chunks = None, None, ()
+        old_hashes, next_id = {}, 0
+    else:
+        old_manifest, old_index, old_chunks = previous
+        old_hashes, next_id = old_manifest["file_hashes"], old_manifest["next_id"]
+        if old_manifest.get("chunker") != chunker:
+            # Different chunk limits: re-chunk every file, unchanged chunk
+            # text still keeps its vector
+            print("Chunker settings changed, re-chunking all files")
+            old_hashes = {}
+
+    # Only ids per source; the text stays in the mmap'd chunk store
+    by_source = defaultdict(list)
+    for chunk in old_chunks:
+        by_source[chunk["source"]].append(chunk["id"])
+
+    # Plan pass: chunk the changed files to decide which ids survive and
+    # which chunks are new. Nothing is embedded or kept but the ids
+    plan = {}
+    removed_ids = []
+    first_new_id = next_id
+
+    # Deleted files: drop all their vectors
+    for source, ids in by_source.items():
+        if source not in files:
+            removed_ids += ids
+
+    for filename, (digest, path) in files.items():
+        if old_hashes.get(filename) == digest:
+            plan[filename] = (True, by_source[filename])
+            continue
+
+        # Edited or new file: chunks whose text is unchanged keep their id
+        # (and vector), everything else is embedded again
+        existing = defaultdict(list)
+        for chunk_id in by_source[filename]:
+            existing[old_chunks.get(chunk_id)["content"]].append(chunk_id)
+
+        ids = []
+        for chunk in chunk_file(path, filename, max_tokens):
+            if existing[chunk["content"]]:
+                ids.append(existing[chunk["content"]].pop(0))
+            else:
+                ids.append(next_id)
+                next_id += 1
+        plan[filename] = (False, ids)
+
+        removed_ids += [chunk_id for ids in existing.values() for chunk_id in ids]
+
+    count = sum(len(ids) for _, ids in plan.values())
+
+    # Index spec: explicit options win, otherwise keep what was built last
+    spec_options = dict(spec_options or {})
+    if old_manifest is not None and "index_type" not in spec_options:
+        old_spec = old_manifest["index"]
+        spec_options.setdefault("index_type", old_spec["type"])
+        for key in ("nlist", "hnsw_m", "pq_m", "pq_bits", "nprobe", "ef_search"):
+            if key in old_spec:
+                spec_options.setdefault(key, old_spec[key])
+    spec = make_spec(n=count, dimension=DIMENSION, **spec_options)
+
+    old_spec = old_manifest["index"] if old_manifest else None
+    file_hashes = {filename: digest for filename, (digest, _) in files.items()}
+    if (old_manifest is not None and file_hashes == old_manifest["file_hashes"] and spec == old_spec
+            and old_manifest.get("chunker") == chunker
+            and old_manifest.get("embedder") == embedder_info
+            and "bm25" in old_manifest["files"]):
+        print("Nothing changed, artifact left as is.")
+        return
+
+    rebuild = (
+        old_index is None
+        or not same_structure(spec, old_spec)
+        or (removed_ids and not supports_remove(spec))
+    )
 
-print("Loading embedding model...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
+    # A rebuild refills the new structure from the vectors we already have,
+    # unless those were only stored as PQ codes
+    reembed = old_index is not None and rebuild and not exact_vectors(old_spec)
+    if reembed:
+        print("Previous index is lossy (PQ), re-embedding every chunk")
+    embed_count = count if reembed else next_id - first_new_id
 
-def chunk_text(text, chunk_size=300, overlap=50):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+    if rebuild:
+        print(f"Building {factory_string(spec)} index...")
+        index = new_index(spec, DIMENSION)
+    else:
+        index = old_index
+        if removed_ids:
+            index.remove_ids(np.array(removed_ids, dtype="int64"))
+    feeder = IndexFeeder(index, train_size)
 
-all_chunks = []
-metadata = []
+    embedder = None
+    if embed_count:
+        print("Loading embedding model...")
+        embedder = load_embedder()
+        if describe(embedder) != embedder_info:
+            # load_embedder falls back to the HF API when the backend can't load
+            raise SystemExit(f"{EMBEDDING_BACKEND} embedder unavailable (got {embedder.name}), not mixing vectors")
+        print(f"Generating embeddings for {embed_count} chunks (batches of {batch_size})...")
 
-print("Reading knowledge files...")
+    # Stream: chunks go to disk, vectors into the index, ``batch_size`` at a time
+    os.makedirs(out_dir, exist_ok=True)
+    chunks_path = os.path.join(out_dir, f"{CHUNKS_FILE}.build-{os.getpid()}")
+    to_embed, to_restore = [], []
+    embedded = 0
+    try:
+        with ChunkWriter(chunks_path) as writer:
+            for record in itertools.chain(iter_records(files, plan, old_chunks, max_tokens), [None]):
+                if record is not None:
+                    writer.append(record)
+                    if reembed or record["id"] >= first_new_id:
+                        to_embed.append(record)
+                    elif rebuild:
+                        to_restore.append(record["id"])
 
-for filename in os.listdir(KNOWLEDGE_FOLDER):
-    if filename.endswith(".txt"):
-        filepath = os.path.join(KNOWLEDGE_FOLDER, filename)
+                if to_embed and (len(to_embed) >= batch_size or record is None):
+                    feeder.add([r["id"] for r in to_embed], embedder.encode([r["content"] for r in to_embed]))
+                    embedded += len(to_embed)
+                    print(f"  embedded {embedded}/{embed_count}")
+                    to_embed = []
+                if to_restore and (len(to_restore) >= batch_size or record is None):
+                    feeder.add(to_restore, reconstruct_ids(old_index, to_restore))
+                    to_restore = []
+        feeder.finish()
 
-        with open(filepath, "r", encoding="utf-8") as f:
-            text = f.read()
+        print(
+            f"Chunks: {count} total, {count - embed_count} reused, "
+            f"{embed_count} recomputed, {len(removed_ids)} dropped"
+        )
 
-        chunks = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+        print("Building BM25 keyword index...")
+        chunks = ChunkStore(chunks_path)
+        bm25 = BM25Index.build(chunks)
 
-        for chunk in chunks:
-            all_chunks.append(chunk)
-            metadata.append({
-                "source": filename,
-                "content": chunk
-            })
+        print(f"Saving RAG artifact to {out_dir}...")
+        manifest = write_artifact(
+            index, chunks, MODEL_NAME, spec, file_hashes, next_id, out_dir, bm25=bm25, chunker=chunker,
+            embedder=embedder_info,
+        )
+    finally:
+        if os.path.exists(chunks_path):
+            os.remove(chunks_path)
 
-print(f"Total chunks created: {len(all_chunks)}")
+    print(f"Done! Hybrid RAG index built successfully ({manifest['content_hash'][:12]}).")
 
-print("Generating embeddings...")
-embeddings = model.encode(all_chunks, show_progress_bar=True)
 
-embeddings = np.array(embeddings).astype("float32")
+def main():
+    parser = argparse.ArgumentParser(description="Build the RAG knowledge index")
+    parser.add_argument("--full", action="store_true", help="re-embed every chunk")
+    parser.add_argument("--check", action="store_true", help="exit 1 if the artifact is out of date (no model needed)")
+    parser.add_argument("--index", choices=INDEX_TYPES, help="index type (default: keep previous, else flat)")
+    parser.add_argument("--nlist", type=int, help="IVF cells (default: ~4*sqrt(n))")
+    parser.add_argument("--nprobe", type=int, help="IVF cells visited per query")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW neighbours per node")
+    parser.add_argument("--ef-search", type=int, help="HNSW search breadth")
+    parser.add_argument("--pq-m", type=int, help="PQ sub-quantisers")
+    parser.add_argument("--pq-bits", type=int, help="bits per PQ code")
+    parser.add_argument("--train-size", type=int, default=50000, help="vectors sampled for training")
+    parser.add_argument("--max-tokens", type=int, default=CHUNK_MAX_TOKENS, help="token limit per chunk")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="chunks per embedding call")
+    args = parser.parse_args()
 
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(embeddings)
+    if args.check:
+        reasons = check(max_tokens=args.max_tokens)
+        for reason in reasons:
+            print(f"RAG artifact out of date: {reason}")
+        raise SystemExit(1 if reasons else 0)
 
-print("Saving FAISS index...")
-faiss.write_index(index, INDEX_PATH)
+    spec_options = {
+        "index_type": args.index,
+        "nlist": args.nlist,
+        "nprobe": args.nprobe,
+        "hnsw_m": args.hnsw_m,
+        "ef_search": args.ef_search,
+        "pq_m": args.pq_m,
+        "pq_bits": args.pq_bits,
+    }
+    spec_options = {key: value for key, value in spec_options.items() if value is not None}
+    build(
+        full=args.full,
+        spec_options=spec_options,
+        train_size=args.train_size,
+        max_tokens=args.max_tokens,
+        batch_size=args.batch_size,
+    )
 
-print("Saving metadata...")
-with open(METADATA_PATH, "w", encoding="utf-8") as f:
-    json.dump(metadata, f, indent=2)
 
-print("Done! Hybrid RAG index built successfully.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import os
+import re
+
+# CONFIG
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "128"))  # MiniLM truncates at 256 word pieces
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Sentence ends, but not the "1." of a numbered item
+SENTENCE_RE = re.compile(r"(?:(?<=[.!?…][\"”’)])|(?<=[.!?…])(?<!\d\.))\s+")
+# "Step 2: ...", "1. Mindfulness", "3) ...", "# Heading"
+NUMBERED_RE = re.compile(r"^(step\s+\d+\b|\d+[.)]\s|#+\s)", re.IGNORECASE)
+MAX_HEADING_LENGTH = 80
+
+
+def count_tokens(text):
+    """Words and punctuation marks; close to (slightly under) a WordPiece count."""
+    return len(TOKEN_RE.findall(text))
+
+
+def is_heading(line):
+    line = line.strip()
+    if NUMBERED_RE.match(line):
+        return True
+    return 0 < len(line) <= MAX_HEADING_LENGTH and not line.endswith((".", "!", "?", "”", "\"", ","))
+
+
+def iter_paragraphs(lines):
+    """Group lines into blank-line separated paragraphs (lists of stripped lines)."""
+    paragraph = []
+    for line in lines:
+        line = line.rstrip()
+        if line.strip():
+            paragraph.append(line)
+        elif paragraph:
+            yield paragraph
+            paragraph = []
+    if paragraph:
+        yield paragraph
+
+
+def iter_sections(lines):
+    """
+    Yield ``(heading, text)`` sections. A paragraph whose first line looks
+    like a heading (short, no sentence punctuation, or a numbered step)
+    starts a new section; other paragraphs belong to the current one.
+    Lead-in lines such as "Example:" inside a paragraph never split it, and
+    a bare title line is kept with the section after it.
+    """
+    heading, paragraphs = "", []
+    for paragraph in iter_paragraphs(lines):
+        if is_heading(paragraph[0]) and paragraphs and not (len(paragraphs) == 1 and "\n" not in paragraphs[0]):
+            yield heading, "\n\n".join(paragraphs)
+            paragraphs = []
+        if not paragraphs:
+            heading = paragraph[0].strip().rstrip(":").lstrip("#").strip() if is_heading(paragraph[0]) else heading
+        paragraphs.append("\n".join(paragraph))
+    if paragraphs:
+        yield heading, "\n\n".join(paragraphs)
+
+
+def iter_units(text):
+    """Lines of a section, with soft-wrapped prose lines joined back up."""
+    unit = ""
+    for line in text.split("\n"):
+        line = line.strip()
+        if unit and line[:1].islower() and not unit.endswith((".", "!", "?", ":")):
+            unit += " " + line
+            continue
+        if unit:
+            yield unit
+        unit = line
+    if unit:
+        yield unit
+
+
+def split_oversized(text, max_tokens, counter):
+    """
+    Break one section into ``(separator, piece)`` pieces under
+    ``max_tokens``: sentences (lines and list items end one too), and
+    words for a sentence that is still too long.
+    """
+    for unit in iter_units(text):
+        separator = "\n"
+        for sentence in SENTENCE_RE.split(unit):
+            if counter(sentence) <= max_tokens:
+                yield separator, sentence
+                separator = " "
+                continue
+            piece = []
+            for word in sentence.split():
+                if piece and counter(" ".join(piece + [word])) > max_tokens:
+                    yield separator, " ".join(piece)
+                    separator, piece = " ", []
+                piece.append(word)
+            if piece:
+                yield separator, " ".join(piece)
+                separator = " "
+
+
+def chunk_sections(sections, source, max_tokens=CHUNK_MAX_TOKENS, counter=count_tokens):
+    """
+    Pack whole sections into chunks of at most ``max_tokens``; a section is
+    only split when it doesn't fit on its own, and its continuation chunks
+    repeat the heading. Yields ``{"source", "section", "position", "content"}``.
+    """
+    position = 0
+    parts, section, used = [], None, 0
+
+    def emit():
+        nonlocal position
+        chunk = {"source": source, "section": section, "position": position, "content": "\n\n".join(parts)}
+        position += 1
+        return chunk
+
+    for heading, text in sections:
+        tokens = counter(text)
+        if parts and used + tokens > max_tokens:
+            yield emit()
+            parts, used = [], 0
+
+        if tokens <= max_tokens:
+            if not parts:
+                section = heading
+            parts.append(text)
+            used += tokens
+            continue
+
+        # Section alone is too big: pack its lines/sentences instead
+        section, current, used = heading, "", 0
+        first_line = text.split("\n", 1)[0].strip()
+        bare = False  # current holds nothing but the heading
+        for separator, piece in split_oversized(text, max_tokens, counter):
+            piece_tokens = counter(piece)
+            if current and used + piece_tokens > max_tokens:
+                if not bare:
+                    parts = [current]
+                    yield emit()
+                current, used, separator = "", 0, "\n"
+                # Keep the heading with every continuation for retrieval
+                if heading and counter(heading) + piece_tokens <= max_tokens:
+                    current, used = heading, counter(heading)
+            bare = not current and piece == first_line and bool(heading)
+            current = f"{current}{separator}{piece}" if current else piece
+            used += piece_tokens
+        parts = [current] if current else []
+
+    if parts:
+        yield emit()
+
+
+def chunk_file(path, source=None, max_tokens=CHUNK_MAX_TOKENS, counter=count_tokens):
+    """Stream the chunks of one text file; only one section is held at a time."""
+    source = source or os.path.basename(path)
+    with open(path, "r", encoding="utf-8") as f:
+        yield from chunk_sections(iter_sections(f), source, max_tokens, counter)
+
+
+def chunk_text(text, source="", max_tokens=CHUNK_MAX_TOKENS, counter=count_tokens):
+    return list(chunk_sections(iter_sections(text.splitlines()), source, max_tokens, counter))
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from rag.batching import MicroBatcher
+from rag.embedding_cache import EmbeddingCache, normalize_text
+
+logger = logging.getLogger(__name__)
+
+# CONFIG
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+DIMENSION = 384
+
+# "local" runs the model in-process, "remote" calls the HF inference API
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "local")
+# Use the HF API when the local model can't be loaded (e.g. torch missing)
+EMBEDDING_REMOTE_FALLBACK = os.getenv("EMBEDDING_REMOTE_FALLBACK", "True") == "True"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# Coalesce concurrent requests into one model call (up to EMBEDDING_BATCH_SIZE
+# texts, waiting at most EMBEDDING_BATCH_WAIT_MS for company)
+EMBEDDING_MICROBATCH = os.getenv("EMBEDDING_MICROBATCH", "True") == "True"
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "2"))
+
+HF_API_KEY = os.getenv("HF_API_KEY")
+EMBEDDING_API_URL = os.getenv(
+    "EMBEDDING_API_URL",
+    f"https://api-inference.huggingface.co/pipeline/feature-extraction/sentence-transformers/{MODEL_NAME}",
+)
+EMBEDDING_API_TIMEOUT = float(os.getenv("EMBEDDING_API_TIMEOUT", "10"))
+
+# "onnx": int8-quantised export made by `python -m rag.export_onnx`
+EMBEDDING_ONNX_DIR = os.getenv(
+    "EMBEDDING_ONNX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", f"{MODEL_NAME}-int8"),
+)
+# Per worker; keep WEB_CONCURRENCY * threads <= cores so workers don't fight
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "1"))
+EMBEDDING_MAX_LENGTH = 256  # all-MiniLM-L6-v2 max_seq_length
+
+
+class LocalEmbedder:
+    """Runs the sentence-transformers model inside the worker process."""
+
+    name = "local"
+    precision = "fp32"
+
+    def __init__(self, model_name=MODEL_NAME, batch_size=EMBEDDING_BATCH_SIZE):
+        # Heavy import kept here so importing this module stays cheap
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device="cpu")
+        # torch modules are not safe to call from several threads at once
+        self._lock = threading.Lock()
+
+    def encode(self, texts):
+        with self._lock:
+            embeddings = self.model.encode(
+                list(texts),
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+            )
+        return np.asarray(embeddings, dtype="float32")
+
+
+class RemoteEmbedder:
+    """Calls the hosted HF feature-extraction pipeline."""
+
+    name = "remote"
+    precision = "fp32"
+
+    def __init__(self, url=EMBEDDING_API_URL, api_key=HF_API_KEY, timeout=EMBEDDING_API_TIMEOUT):
+        import requests
+
+        self.url = url
+        self.timeout = timeout
+        # Keep-alive session so repeated calls reuse the TLS connection
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def encode(self, texts):
+        response = self.session.post(
+            self.url,
+            json={"inputs": list(texts)},
+            timeout=self.timeout,
+        )
+
+        if response.status_code != 200:
+            raise RuntimeError(f"HF embedding API failed ({response.status_code})")
+
+        return np.asarray(response.json(), dtype="float32").reshape(-1, DIMENSION)
+
+
+def mean_pool(token_embeddings, attention_mask):
+    """Masked mean over tokens, L2-normalised (MiniLM's pooling + Normalize)."""
+    mask = attention_mask[..., None].astype("float32")
+    summed = (token_embeddings * mask).sum(axis=1)
+    pooled = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+    return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+
+class OnnxEmbedder:
+    """
+    Runs the int8 ONNX export with ONNX Runtime on the CPU: no torch in
+    the worker, a fraction of the memory, faster small batches.
+    """
+
+    name = "onnx"
+    precision = "int8"
+
+    def __init__(self, path=EMBEDDING_ONNX_DIR, threads=EMBEDDING_ONNX_THREADS, batch_size=EMBEDDING_BATCH_SIZE):
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(path, "export.json"), "r", encoding="utf-8") as f:
+            self.export = json.load(f)
+        if self.export["model"] != MODEL_NAME:
+            raise ValueError(f"ONNX export in {path} is {self.export['model']}, expected {MODEL_NAME}")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=EMBEDDING_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+        self.threads = threads
+        self.batch_size = batch_size
+        # Model bytes are read now (shared after a preload fork); the session
+        # and its thread pool are created in the process that uses them
+        with open(os.path.join(path, "model.onnx"), "rb") as f:
+            self._model = f.read()
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        if self._session_pid != os.getpid():
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            # Idle workers shouldn't spin on cores the next request needs
+            options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+            self._session = ort.InferenceSession(self._model, options, providers=["CPUExecutionProvider"])
+            self._inputs = {i.name for i in self._session.get_inputs()}
+            self._session_pid = os.getpid()
+        return self._session
+
+    def encode(self, texts):
+        texts = list(texts)
+        result = np.zeros((len(texts), DIMENSION), dtype="float32")
+        with self._lock:
+            session = self._get_session()
+            for start in range(0, len(texts), self.batch_size):
+                encodings = self.tokenizer.encode_batch(texts[start:start + self.batch_size])
+                feeds = {
+                    "input_ids": np.asarray([e.ids for e in encodings], dtype="int64"),
+                    "attention_mask": np.asarray([e.attention_mask for e in encodings], dtype="int64"),
+                    "token_type_ids": np.asarray([e.type_ids for e in encodings], dtype="int64"),
+                }
+                feeds = {name: value for name, value in feeds.items() if name in self._inputs}
+                token_embeddings = session.run(None, feeds)[0]
+                result[start:start + len(encodings)] = mean_pool(token_embeddings, feeds["attention_mask"])
+        return result
+
+
+BACKENDS = {
+    "local": LocalEmbedder,
+    "remote": RemoteEmbedder,
+    "onnx": OnnxEmbedder,
+}
+
+
+def describe(embedder_or_backend):
+    """What goes in the artifact manifest: query and index vectors must match."""
+    cls = BACKENDS.get(embedder_or_backend) if isinstance(embedder_or_backend, str) else embedder_or_backend
+    return {"backend": cls.name, "model": MODEL_NAME, "precision": cls.precision}
+
+
+# Globals (lazy-loaded, one per worker)
+_embedder = None
+_embedder_lock = threading.Lock()
+_batcher = None
+_cache = None
+
+
+def load_embedder(backend=None):
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    try:
+        return BACKENDS[backend]()
+    except Exception:
+        if backend == "remote" or not EMBEDDING_REMOTE_FALLBACK:
+            raise
+        # Different backend (and maybe precision) than the index was built
+        # with; loud in the logs, and chat_embedder_info shows what runs
+        logger.error("Embedding backend %r unavailable, falling back to the remote API", backend, exc_info=True)
+        return RemoteEmbedder()
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = load_embedder()
+    return _embedder
+
+
+def get_batcher():
+    global _batcher
+    if _batcher is None:
+        with _embedder_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(
+                    lambda texts: get_embedder().encode(texts), EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS
+                )
+    return _batcher
+
+
+def encode(texts):
+    """Embed uncached texts, batched with concurrent callers when enabled."""
+    if EMBEDDING_MICROBATCH:
+        return get_batcher().encode(texts)
+    return get_embedder().encode(texts)
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        # Vectors from another backend/precision must not be served; loaded
+        # outside the lock, get_embedder takes it too
+        info = describe(get_embedder())
+        with _embedder_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(namespace=f"{info['model']}:{info['backend']}:{info['precision']}")
+    return _cache
+
+
+def embed_texts(texts):
+    """Embed a batch of texts, returning a (n, DIMENSION) float32 array."""
+    texts = list(texts)
+    result = np.zeros((len(texts), DIMENSION), dtype="float32")
+    if not texts:
+        return result
+
+    cache = get_cache()
+    found, missing = cache.get_many(texts)
+    for pos, vector in found.items():
+        result[pos] = vector
+
+    if missing:
+        # Embed each distinct missing text once
+        unique = {}
+        for pos in missing:
+            unique.setdefault(normalize_text(texts[pos]), texts[pos])
+        vectors = encode(list(unique.values()))
+        cache.put_many(unique.values(), vectors)
+
+        computed = dict(zip(unique, vectors))
+        for pos in missing:
+            result[pos] = computed[normalize_text(texts[pos])]
+
+    return result
+
+
+def embed_query(text):
+    return embed_texts([text])[0]
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# CONFIG
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+# Optional SQLite file so warm entries survive worker restarts
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+# The disk tier is trimmed back to the LRU size every this many rows written
+EMBEDDING_CACHE_PURGE_EVERY = int(os.getenv("EMBEDDING_CACHE_PURGE_EVERY", "256"))
+
+
+def normalize_text(text):
+    # The MiniLM tokenizer is uncased and ignores runs of whitespace,
+    # so these variants embed to the same vector anyway
+    return " ".join(text.casefold().split())
+
+
+def cache_key(text, namespace=""):
+    data = f"{namespace}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class SQLiteTier:
+    """
+    Disk tier shared by every worker on the host. Expired rows, then the
+    oldest beyond ``max_rows``, are deleted on open and every
+    ``purge_every`` rows written.
+    """
+
+    def __init__(self, path, ttl, max_rows, clock=time.time, purge_every=EMBEDDING_CACHE_PURGE_EVERY):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.clock = clock
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at)")
+        with self._lock:
+            self._purge()
+
+    def _purge(self):
+        # Caller holds the lock
+        self.conn.execute("DELETE FROM embeddings WHERE created_at < ?", (self.clock() - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY created_at DESC, rowid DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        )
+        self.conn.commit()
+        self._writes = 0
+
+    def get_many(self, keys):
+        rows = []
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows += self.conn.execute(
+                    f"SELECT key, vector, created_at FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+
+        cutoff = self.clock() - self.ttl
+        return {
+            key: (np.frombuffer(blob, dtype="float32"), created_at)
+            for key, blob, created_at in rows
+            if created_at >= cutoff
+        }
+
+    def put_many(self, items):
+        now = self.clock()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                [(key, vector.tobytes(), now) for key, vector in items],
+            )
+            self.conn.commit()
+            self._writes += len(items)
+            if self._writes >= self.purge_every:
+                self._purge()
+
+
+class EmbeddingCache:
+    """
+    In-process LRU of embeddings keyed by a hash of the normalized text,
+    with entries expiring after ``ttl`` seconds and an optional disk tier.
+    ``clock`` returns wall-clock seconds (shared with the disk tier, which
+    is kept to the same ``max_entries``).
+    """
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL,
+                 path=EMBEDDING_CACHE_PATH, namespace="", clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.namespace = namespace
+        self.clock = clock
+        self.disk = SQLiteTier(path, ttl, max_entries, clock) if path else None
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, texts):
+        """
+        Return ``(found, missing)`` where ``found`` maps positions in
+        ``texts`` to cached vectors and ``missing`` lists the positions
+        that still need embedding.
+        """
+        keys = [cache_key(text, self.namespace) for text in texts]
+        found = {}
+        disk_lookup = {}
+        now = self.clock()
+
+        with self._lock:
+            for pos, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(key)
+                    found[pos] = entry[0]
+                else:
+                    if entry is not None:
+                        del self._entries[key]
+                    disk_lookup.setdefault(key, []).append(pos)
+
+        if disk_lookup and self.disk is not None:
+            stored = self.disk.get_many(list(disk_lookup))
+            with self._lock:
+                for key, (vector, created_at) in stored.items():
+                    self._store(key, vector, created_at + self.ttl)
+                    for pos in disk_lookup.pop(key):
+                        found[pos] = vector
+                    self.disk_hits += 1
+
+        missing = sorted(pos for positions in disk_lookup.values() for pos in positions)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        return found, missing
+
+    def put_many(self, texts, vectors):
+        items = []
+        expires_at = self.clock() + self.ttl
+
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(text, self.namespace)
+                vector = np.array(vector, dtype="float32")
+                vector.setflags(write=False)
+                self._store(key, vector, expires_at)
+                items.append((key, vector))
+
+        if self.disk is not None:
+            self.disk.put_many(items)
+
+    def _store(self, key, vector, expires_at):
+        self._entries[key] = (vector, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,87 @@
+# Run from the repo root: python -m rag.export_onnx [--output DIR]
+"""
+Export the embedding model to ONNX and quantise it to int8 for the
+"onnx" embedding backend (EMBEDDING_BACKEND=onnx).
+
+Writes ``model.onnx`` (dynamic int8 weights), ``tokenizer.json`` and
+``export.json`` into EMBEDDING_ONNX_DIR. Needs torch and transformers
+(installed with sentence-transformers) plus onnx and onnxruntime; the
+web workers only need onnxruntime and tokenizers.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from rag.embedder import EMBEDDING_MAX_LENGTH, EMBEDDING_ONNX_DIR, MODEL_NAME
+
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def export(model_name=MODEL_NAME, output=EMBEDDING_ONNX_DIR, opset=17):
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    repo = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    print(f"Loading {repo}...")
+    tokenizer = AutoTokenizer.from_pretrained(repo)
+    model = AutoModel.from_pretrained(repo).eval()
+
+    os.makedirs(output, exist_ok=True)
+    tokenizer.backend_tokenizer.save(os.path.join(output, "tokenizer.json"))
+
+    sample = tokenizer(["a short example", "and a somewhat longer second one"], padding=True,
+                       truncation=True, max_length=EMBEDDING_MAX_LENGTH, return_tensors="pt")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fp32_path = os.path.join(tmpdir, "model-fp32.onnx")
+        print("Exporting to ONNX...")
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in INPUT_NAMES),
+                fp32_path,
+                input_names=INPUT_NAMES,
+                output_names=["last_hidden_state"],
+                dynamic_axes={name: {0: "batch", 1: "sequence"} for name in INPUT_NAMES + ["last_hidden_state"]},
+                opset_version=opset,
+            )
+
+        print("Quantising weights to int8...")
+        # Dynamic quantisation: int8 weights, activations quantised per call
+        model_path = os.path.join(output, "model.onnx")
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        fp32_size = os.path.getsize(fp32_path)
+
+    with open(model_path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    metadata = {
+        "model": model_name,
+        "opset": opset,
+        "quantization": "dynamic-int8",
+        "sha256": digest,
+        "fp32_bytes": fp32_size,
+        "int8_bytes": os.path.getsize(model_path),
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(output, "export.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+
+    print(f"Wrote {model_path} ({metadata['int8_bytes'] / 2**20:.1f} MB, fp32 was {fp32_size / 2**20:.1f} MB)")
+    return metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--output", default=EMBEDDING_ONNX_DIR)
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+    export(args.model, args.output, args.opset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import math
+
+import numpy as np
+
+# Supported index types for the knowledge store:
+#   flat   exact brute-force scan (default, fine up to ~10k chunks)
+#   ivf    inverted lists over k-means cells, exact distances inside a cell
+#   hnsw   graph search, no training, no in-place deletes
+#   ivfpq  inverted lists with product-quantised codes (smallest memory)
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+# Keys that change the index structure; the rest are search-time only
+STRUCTURAL_KEYS = ("type", "nlist", "hnsw_m", "pq_m", "pq_bits")
+
+# faiss wants ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def make_spec(index_type="flat", n=0, dimension=384, nlist=None, hnsw_m=32,
+              pq_m=None, pq_bits=None, nprobe=None, ef_search=64):
+    """Fill in defaults for an index spec sized for ``n`` vectors."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    spec = {"type": index_type}
+
+    if index_type in ("ivf", "ivfpq"):
+        if nlist is None:
+            nlist = int(4 * math.sqrt(max(n, 1)))
+            nlist = max(1, min(nlist, n // MIN_POINTS_PER_CENTROID))
+        spec["nlist"] = nlist
+        spec["nprobe"] = nprobe or max(1, nlist // 16)
+
+    if index_type == "ivfpq":
+        spec["pq_m"] = pq_m or _pq_subquantizers(dimension)
+        if pq_bits is None:
+            # 2^bits codewords need 39 points each to train
+            pq_bits = int(math.log2(max(n, 2) / MIN_POINTS_PER_CENTROID)) if n else 8
+            pq_bits = max(4, min(8, pq_bits))
+        spec["pq_bits"] = pq_bits
+
+    if index_type == "hnsw":
+        spec["hnsw_m"] = hnsw_m
+        spec["ef_search"] = ef_search
+
+    return spec
+
+
+def _pq_subquantizers(dimension):
+    # 8 dimensions per sub-quantiser, must divide the dimension
+    for m in (dimension // 8, 48, 32, 24, 16, 12, 8):
+        if m and dimension % m == 0:
+            return m
+    return 1
+
+
+def factory_string(spec):
+    kind = spec["type"]
+    if kind == "flat":
+        body = "Flat"
+    elif kind == "ivf":
+        body = f"IVF{spec['nlist']},Flat"
+    elif kind == "hnsw":
+        body = f"HNSW{spec['hnsw_m']}"
+    else:
+        body = f"IVF{spec['nlist']},PQ{spec['pq_m']}x{spec['pq_bits']}"
+    # Stable external ids so incremental builds can add/remove chunks
+    return f"IDMap2,{body}"
+
+
+def same_structure(a, b):
+    return all(a.get(key) == b.get(key) for key in STRUCTURAL_KEYS)
+
+
+def supports_remove(spec):
+    return spec["type"] != "hnsw"
+
+
+def exact_vectors(spec):
+    # PQ codes only approximate the original embeddings
+    return spec["type"] != "ivfpq"
+
+
+def search_parameters(spec):
+    params = []
+    if "nprobe" in spec:
+        params.append(f"nprobe={spec['nprobe']}")
+    if "ef_search" in spec:
+        params.append(f"efSearch={spec['ef_search']}")
+    return ",".join(params)
+
+
+def mmap_flags(spec):
+    import faiss
+
+    # IVF lists are mapped through the on-disk inverted lists, flat and
+    # HNSW storage through the zero-copy flat-codes reader
+    if spec["type"] in ("ivf", "ivfpq"):
+        return faiss.IO_FLAG_MMAP
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def new_index(spec, dimension):
+    import faiss
+
+    return faiss.index_factory(dimension, factory_string(spec))
+
+
+def train(index, vectors, train_size=50000, seed=0):
+    if index.is_trained:
+        return
+    if len(vectors) > train_size:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), train_size, replace=False)]
+    index.train(np.ascontiguousarray(vectors, dtype="float32"))
+
+
+def apply_search_parameters(index, spec):
+    import faiss
+
+    params = search_parameters(spec)
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+
+
+def reconstruct_ids(index, ids):
+    """Return the vectors stored under ``ids`` in an IDMap2 index."""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(faiss.downcast_index(index.index))
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_batch(np.asarray(ids, dtype="int64"))
+
+
+def reconstruct_all(index):
+    """Return ``(ids, vectors)`` stored in an IDMap2 index."""
+    import faiss
+
+    ids = faiss.vector_to_array(index.id_map).astype("int64")
+    inner = faiss.downcast_index(index.index)
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.make_direct_map()
+    if inner.ntotal == 0:
+        return ids, np.zeros((0, index.d), dtype="float32")
+    return ids, inner.reconstruct_n(0, inner.ntotal)
@@ -1,57 +1,129 @@
+import logging
 import os
-import json
-import faiss
-import numpy as np
-import requests
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-
-INDEX_PATH = os.path.join(BASE_DIR, "index.faiss")
-META_PATH = os.path.join(BASE_DIR, "metadata.json")
-
-# Load FAISS index once
-index = faiss.read_index(INDEX_PATH)
-
-# Load metadata once
-with open(META_PATH, "r", encoding="utf-8") as f:
-    metadata = json.load(f)
+import threading
+import time
+from dataclasses import dataclass
 
-HF_API_KEY = os.getenv("HF_API_KEY")
-
-EMBEDDING_API_URL = "https://api-inference.huggingface.co/pipeline/feature-extraction/sentence-transformers/all-MiniLM-L6-v2"
+import numpy as np
 
-headers = {
-    "Authorization": f"Bearer {HF_API_KEY}"
-}
+from rag.embedder import embed_texts
+from rag.store import get_store
 
+logger = logging.getLogger(__name__)
 
-def embed_query(text):
-    response = requests.post(
-        EMBEDDING_API_URL,
-        headers=headers,
-        json={"inputs": text}
-    )
+# CONFIG
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", "20"))  # hits taken from each retriever before fusion
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))  # reciprocal-rank fusion damping
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.0"))  # drop passages scoring below this (0..1)
+# Optional local cross-encoder, e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RAG_RERANKER = os.getenv("RAG_RERANKER", "")
+RAG_RERANK_DEPTH = int(os.getenv("RAG_RERANK_DEPTH", "10"))  # fused candidates rescored by it
 
-    if response.status_code != 200:
-        raise RuntimeError("HF embedding API failed")
 
-    embedding = response.json()
+@dataclass(frozen=True)
+class Passage:
+    id: int
+    text: str
+    source: str
+    score: float
 
-    # Convert to numpy array
-    return np.array(embedding, dtype="float32")
 
+# Globals (lazy-loaded on first rerank)
+_reranker = None
+_reranker_lock = threading.Lock()
 
-def retrieve_knowledge(query, k=2):
-    query_vector = embed_query(query)
 
-    # FAISS expects 2D array
-    query_vector = np.expand_dims(query_vector, axis=0)
+def get_reranker():
+    """The cross-encoder, or None when disabled or it can't be loaded."""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = False
+                if RAG_RERANKER:
+                    try:
+                        from sentence_transformers import CrossEncoder
+                        _reranker = CrossEncoder(RAG_RERANKER, device="cpu")
+                    except Exception:
+                        logger.warning("Reranker %s unavailable, using fused ranks", RAG_RERANKER, exc_info=True)
+    return _reranker or None
 
-    distances, indices = index.search(query_vector, k)
 
-    results = []
-    for idx in indices[0]:
-        if idx < len(metadata):
-            results.append(metadata[idx])
-
-    return results
\ No newline at end of file
+def embed_query(text):
+    return embed_texts([text])[0]
+
+
+def fuse(ranked_lists, k=RAG_RRF_K):
+    """
+    Reciprocal-rank fusion of lists of chunk dicts (best first). Returns
+    ``[(chunk, score), ...]`` with scores scaled so 1.0 means ranked first
+    by every retriever.
+    """
+    scores, chunks = {}, {}
+    for ranked in ranked_lists:
+        for rank, chunk in enumerate(ranked):
+            scores[chunk["id"]] = scores.get(chunk["id"], 0.0) + 1.0 / (k + rank + 1)
+            chunks.setdefault(chunk["id"], chunk)
+
+    best = len(ranked_lists) / (k + 1)
+    order = sorted(scores, key=lambda chunk_id: (-scores[chunk_id], chunk_id))
+    return [(chunks[chunk_id], scores[chunk_id] / best) for chunk_id in order]
+
+
+def rerank(query, fused, reranker):
+    head, tail = fused[:RAG_RERANK_DEPTH], fused[RAG_RERANK_DEPTH:]
+    # Sigmoid-activated relevance in 0..1, same scale as the fused scores
+    scores = reranker.predict([(query, chunk["content"]) for chunk, _ in head], show_progress_bar=False)
+    head = sorted(zip((chunk for chunk, _ in head), map(float, scores)), key=lambda item: -item[1])
+    # Anything the cross-encoder didn't see ranks below what it did
+    floor = min((score for _, score in head), default=0.0)
+    return head + [(chunk, min(score, floor)) for chunk, score in tail]
+
+
+def retrieve_knowledge(query, k=2, candidates=RAG_CANDIDATES, min_score=RAG_MIN_SCORE, use_reranker=True,
+                       trace=None):
+    """
+    Hybrid retrieval: dense FAISS hits and BM25 keyword hits, fused by
+    reciprocal rank, optionally rescored by a cross-encoder, then
+    thresholded. Returns up to ``k`` :class:`Passage` objects, best first.
+
+    ``trace``, if given, is a list that gets ``(stage, seconds, ok)`` for
+    each step (embed, faiss, bm25, rerank).
+    """
+    # Index is mapped lazily on the first retrieval, not at import
+    store = get_store()
+
+    def timed(stage, start, ok=True):
+        if trace is not None:
+            trace.append((stage, time.perf_counter() - start, ok))
+
+    start = time.perf_counter()
+    ranked_lists = [store.keyword_search(query, candidates)]
+    timed("bm25", start)
+
+    start = time.perf_counter()
+    try:
+        # FAISS expects 2D array
+        query_vector = np.expand_dims(embed_query(query), axis=0)
+    except Exception:
+        # Keyword hits alone still beat no context at all
+        timed("embed", start, ok=False)
+        logger.warning("Dense retrieval failed, using BM25 only", exc_info=True)
+    else:
+        timed("embed", start)
+        start = time.perf_counter()
+        ranked_lists.insert(0, store.search(query_vector, candidates)[0])
+        timed("faiss", start)
+
+    fused = fuse(ranked_lists)
+    reranker = get_reranker() if use_reranker else None
+    if reranker is not None and fused:
+        start = time.perf_counter()
+        fused = rerank(query, fused, reranker)
+        timed("rerank", start)
+
+    return [
+        Passage(id=chunk["id"], text=chunk["content"], source=chunk["source"], score=score)
+        for chunk, score in fused[:k]
+        if score >= min_score
+    ]
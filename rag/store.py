@@ -0,0 +1,309 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from rag import index_spec
+from rag.bm25 import BM25Index
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Versioned artifact written by build_embeddings.py
+ARTIFACT_DIR = os.getenv("RAG_ARTIFACT_DIR", os.path.join(BASE_DIR, "index"))
+ARTIFACT_VERSION = 4
+# v3 artifacts (no chunk metadata) still load; the builder rebuilds them
+READABLE_VERSIONS = (3, 4)
+
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.bin"
+BM25_FILE = "bm25.npz"
+
+# chunks.bin layout: magic, version, count, count int64 chunk ids (ascending),
+# (count + 1) uint64 offsets, blob. Each record is
+# "<source>\0<section>\0<position>\0<content>" in UTF-8 (v3: "<source>\0<content>").
+CHUNKS_MAGIC = b"RAGC"
+CHUNKS_HEADER = struct.Struct("<4sIQ")
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(file_hashes):
+    """Hash of the whole knowledge base, from ``{filename: file_hash}``."""
+    digest = hashlib.sha256()
+    for name in sorted(file_hashes):
+        digest.update(f"{name}\0{file_hashes[name]}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ChunkWriter:
+    """
+    Append-only writer for chunks.bin. Record text is spooled to a
+    temporary file as it arrives and only ids and lengths stay in memory;
+    ``close`` writes the file out in id order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._spool = tempfile.TemporaryFile(dir=os.path.dirname(path) or None)
+        self._ids = []
+        self._lengths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._spool.close()
+
+    def append(self, record):
+        blob = "\0".join([
+            record["source"],
+            record.get("section", ""),
+            str(record.get("position", 0)),
+            record["content"],
+        ]).encode("utf-8")
+        self._spool.write(blob)
+        self._ids.append(record["id"])
+        self._lengths.append(len(blob))
+
+    def close(self):
+        ids = np.array(self._ids, dtype="<i8")
+        lengths = np.array(self._lengths, dtype="<u8")
+        starts = np.concatenate([[0], np.cumsum(lengths)]).astype("<u8")
+        order = np.argsort(ids, kind="stable")
+        offsets = np.zeros(len(ids) + 1, dtype="<u8")
+        offsets[1:] = np.cumsum(lengths[order])
+
+        with open(self.path, "wb") as f:
+            f.write(CHUNKS_HEADER.pack(CHUNKS_MAGIC, ARTIFACT_VERSION, len(ids)))
+            f.write(ids[order].tobytes())
+            f.write(offsets.tobytes())
+            for position in order:
+                self._spool.seek(int(starts[position]))
+                f.write(self._spool.read(int(lengths[position])))
+        self._spool.close()
+        return len(ids)
+
+
+def write_chunks(path, records):
+    with ChunkWriter(path) as writer:
+        for record in records:
+            writer.append(record)
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view over chunks.bin."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count = CHUNKS_HEADER.unpack_from(self._mmap, 0)
+        if magic != CHUNKS_MAGIC or version not in READABLE_VERSIONS:
+            raise ValueError(f"Unsupported chunk file: {path}")
+
+        self.version = version
+        self.count = count
+        self.ids = np.frombuffer(
+            self._mmap, dtype="<i8", count=count, offset=CHUNKS_HEADER.size
+        )
+        self.offsets = np.frombuffer(
+            self._mmap, dtype="<u8", count=count + 1,
+            offset=CHUNKS_HEADER.size + self.ids.nbytes,
+        )
+        self._blob_start = CHUNKS_HEADER.size + self.ids.nbytes + self.offsets.nbytes
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self._read(position)
+
+    def _read(self, position):
+        start = self._blob_start + int(self.offsets[position])
+        end = self._blob_start + int(self.offsets[position + 1])
+        raw = self._mmap[start:end].decode("utf-8")
+        if self.version < 4:
+            source, content = raw.split("\0", 1)
+            section, chunk_position = "", 0
+        else:
+            source, section, chunk_position, content = raw.split("\0", 3)
+        return {
+            "id": int(self.ids[position]),
+            "source": source,
+            "section": section,
+            "position": int(chunk_position),
+            "content": content,
+        }
+
+    def get(self, chunk_id):
+        position = int(np.searchsorted(self.ids, chunk_id))
+        if position >= self.count or self.ids[position] != chunk_id:
+            raise KeyError(chunk_id)
+        return self._read(position)
+
+
+def write_artifact(index, records, model_name, spec, file_hashes, next_id, out_dir=ARTIFACT_DIR,
+                   bm25=None, chunker=None, embedder=None):
+    """
+    Write the FAISS index, packed chunks, BM25 index and manifest into
+    ``out_dir``. ``records`` is an iterable of chunk dicts, or a
+    ``ChunkStore`` the caller already streamed to disk (it is moved in).
+
+    Files are written under temporary names and swapped in with
+    ``os.replace`` (manifest last), so running workers keep reading the
+    old mmap'd files until they reload.
+    """
+    import faiss
+
+    os.makedirs(out_dir, exist_ok=True)
+    suffix = f".tmp-{os.getpid()}"
+
+    index_path = os.path.join(out_dir, INDEX_FILE)
+    faiss.write_index(index, index_path + suffix)
+
+    chunks_path = os.path.join(out_dir, CHUNKS_FILE)
+    if isinstance(records, ChunkStore):
+        # Already streamed to disk by the builder
+        os.replace(records.path, chunks_path + suffix)
+    else:
+        write_chunks(chunks_path + suffix, records)
+    chunks = ChunkStore(chunks_path + suffix)
+
+    bm25_path = os.path.join(out_dir, BM25_FILE)
+    with open(bm25_path + suffix, "wb") as f:
+        (bm25 or BM25Index.build(chunks)).save(f)
+
+    manifest = {
+        "version": ARTIFACT_VERSION,
+        "model": model_name,
+        "dimension": index.d,
+        "count": len(chunks),
+        "index": spec,
+        "chunker": chunker or {},
+        "embedder": embedder or {},
+        "content_hash": content_hash(file_hashes),
+        "file_hashes": file_hashes,
+        "next_id": next_id,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "files": {
+            "index": INDEX_FILE,
+            "chunks": CHUNKS_FILE,
+            "bm25": BM25_FILE,
+        },
+    }
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(manifest_path + suffix, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+
+    os.replace(index_path + suffix, index_path)
+    os.replace(chunks_path + suffix, chunks_path)
+    os.replace(bm25_path + suffix, bm25_path)
+    os.replace(manifest_path + suffix, manifest_path)
+    return manifest
+
+
+def read_manifest(path=ARTIFACT_DIR):
+    with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class KnowledgeStore:
+    def __init__(self, path=ARTIFACT_DIR):
+        import faiss
+
+        self.manifest = read_manifest(path)
+
+        if self.manifest.get("version") not in READABLE_VERSIONS:
+            raise ValueError(
+                f"RAG artifact version {self.manifest.get('version')} not in {READABLE_VERSIONS}, "
+                "rebuild with `python -m rag.build_embeddings`"
+            )
+
+        if self.manifest["version"] != ARTIFACT_VERSION:
+            # Still served, but chunked the old way
+            logger.warning(
+                "RAG artifact is v%s (current v%s); rebuild it with `python -m rag.build_embeddings --full`",
+                self.manifest["version"], ARTIFACT_VERSION,
+            )
+
+        files = self.manifest["files"]
+        spec = self.manifest["index"]
+        # Map the index instead of reading it, so forked workers share the
+        # page cache rather than each holding a private copy
+        self.index = faiss.read_index(
+            os.path.join(path, files["index"]),
+            index_spec.mmap_flags(spec),
+        )
+        # nprobe / efSearch chosen at build time
+        index_spec.apply_search_parameters(self.index, spec)
+        self.chunks = ChunkStore(os.path.join(path, files["chunks"]))
+
+        if self.index.ntotal != len(self.chunks):
+            raise ValueError("RAG index and chunk store are out of sync")
+
+        # Queries must be embedded like the chunks were (fp32 vs int8)
+        from rag.embedder import EMBEDDING_BACKEND, describe
+
+        built_with = self.manifest.get("embedder", {}).get("precision", "fp32")
+        querying_with = describe(EMBEDDING_BACKEND)["precision"]
+        if built_with != querying_with:
+            logger.warning(
+                "RAG index was embedded at %s but EMBEDDING_BACKEND=%s is %s; "
+                "rebuild it with `python -m rag.build_embeddings`", built_with, EMBEDDING_BACKEND, querying_with
+            )
+
+        # Keyword side of hybrid retrieval; artifacts built before it
+        # existed get one built from the chunks on load
+        if "bm25" in files:
+            self.bm25 = BM25Index.load(os.path.join(path, files["bm25"]))
+        else:
+            self.bm25 = BM25Index.build(self.chunks)
+
+    def search(self, query_vectors, k):
+        distances, indices = self.index.search(query_vectors, k)
+        return [
+            [
+                dict(self.chunks.get(idx), distance=float(dist))
+                for dist, idx in zip(row_distances, row_indices)
+                if idx >= 0
+            ]
+            for row_distances, row_indices in zip(distances, indices)
+        ]
+
+    def keyword_search(self, query, k):
+        return [dict(self.chunks.get(chunk_id), bm25=score) for chunk_id, score in self.bm25.search(query, k)]
+
+
+# Globals (lazy-loaded on first retrieval)
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = KnowledgeStore()
+    return _store
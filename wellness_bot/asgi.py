@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wellness_bot.settings")
+# Read by the database settings: no persistent connections under ASGI
+os.environ["SERVER_MODE"] = "asgi"
 
 application = get_asgi_application()
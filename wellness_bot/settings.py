@@ -91,12 +91,61 @@ WSGI_APPLICATION = "wellness_bot.wsgi.application"
 # ======================
 # DATABASE
 # ======================
+# "tuned" (default) applies the settings below, "plain" is bare
+# dj_database_url (kept for benchmarks/db_load.py comparisons)
+DB_PROFILE = os.getenv("DB_PROFILE", "tuned")
+# Set to "asgi" by wellness_bot/asgi.py. Persistent connections are
+# per thread, and async views run their queries on threads that come and
+# go, so under ASGI connections are never kept (Postgres pools instead)
+SERVER_MODE = os.getenv("SERVER_MODE", "wsgi")
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", "600"))  # seconds a connection is reused (WSGI only)
+# psycopg 3 pool instead of persistent connections; the default under ASGI
+DB_POOL = os.getenv("DB_POOL", str(SERVER_MODE == "asgi")) == "True"
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "False") == "True"  # behind pgbouncer in transaction mode
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
 DATABASES = {
     "default": dj_database_url.config(
         default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}"
     )
 }
 
+if DB_PROFILE == "tuned":
+    _db = DATABASES["default"]
+    _options = _db.setdefault("OPTIONS", {})
+
+    if _db["ENGINE"] == "django.db.backends.sqlite3":
+        _db["CONN_MAX_AGE"] = 0 if SERVER_MODE == "asgi" else DB_CONN_MAX_AGE
+        # WAL lets readers run alongside the single writer; IMMEDIATE takes
+        # the write lock up front so busy_timeout applies instead of a
+        # "database is locked" error when a read transaction tries to upgrade
+        _options["transaction_mode"] = "IMMEDIATE"
+        _options["init_command"] = ";".join([
+            "PRAGMA journal_mode=WAL",
+            "PRAGMA synchronous=NORMAL",
+            f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+            f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        ])
+
+    elif _db["ENGINE"] == "django.db.backends.postgresql":
+        _options.setdefault("connect_timeout", 5)
+        if DB_POOL:
+            # Django's built-in pool (psycopg 3); also the option that works
+            # for async views, where persistent connections are not reused
+            _db["CONN_MAX_AGE"] = 0
+            _options["pool"] = {"min_size": DB_POOL_MIN_SIZE, "max_size": DB_POOL_MAX_SIZE, "timeout": 10}
+        elif SERVER_MODE == "asgi":
+            _db["CONN_MAX_AGE"] = 0
+        else:
+            _db["CONN_MAX_AGE"] = DB_CONN_MAX_AGE
+            _db["CONN_HEALTH_CHECKS"] = True
+        if DB_PGBOUNCER:
+            # Transaction pooling can't keep named cursors between transactions
+            _db["DISABLE_SERVER_SIDE_CURSORS"] = True
+
 
 # ======================
 # PASSWORD VALIDATION
@@ -19,6 +19,7 @@ from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.urls import path,include
 from chat.auth_view import signup_view
+from chat.metrics_view import metrics_view
 
 
 urlpatterns = [
@@ -32,4 +33,5 @@ urlpatterns = [
     path("signup/", signup_view, name="signup"),
     path("accounts/", include("django.contrib.auth.urls")),
     path("chat/", include("chat.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]